@@ -1,9 +1,122 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
 
 class Settings:
     DATABASE_URL = os.getenv("DATABASE_URL")
+    # Read replicas for /search and the other read endpoints: comma-separated DSNs, used round robin.
+    # Unset, or no replica healthy: reads go to DATABASE_URL. Replicas are health-checked every
+    # DATABASE_READ_HEALTH_INTERVAL seconds and skipped while failing.
+    DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")
+    DATABASE_READ_HEALTH_INTERVAL = float(os.getenv("DATABASE_READ_HEALTH_INTERVAL", "5"))
+    # asyncpg pools: connections per pool (the primary and each replica), prepared statement cache per
+    # connection (0 behind PgBouncer in transaction mode) and default statement timeout in seconds (0 = none)
+    DATABASE_POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", "1"))
+    DATABASE_POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", "10"))
+    DATABASE_READ_POOL_MIN_SIZE = int(os.getenv("DATABASE_READ_POOL_MIN_SIZE", "1"))
+    DATABASE_READ_POOL_MAX_SIZE = int(os.getenv("DATABASE_READ_POOL_MAX_SIZE", "10"))
+    DATABASE_STATEMENT_CACHE_SIZE = int(os.getenv("DATABASE_STATEMENT_CACHE_SIZE", "100"))
+    DATABASE_COMMAND_TIMEOUT = float(os.getenv("DATABASE_COMMAND_TIMEOUT", "0"))
+
+    # pgvector ANN recall settings (used when the HNSW / IVFFlat indexes are present)
+    HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+    IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+    # Iterative index scans for filtered searches (pgvector >= 0.8): strict_order, relaxed_order or off
+    ANN_ITERATIVE_SCAN = os.getenv("ANN_ITERATIVE_SCAN", "strict_order")
+
+    # Quantized vector search per table: none, halfvec or binary (expression indexes of migration 008).
+    # Quantized searches fetch limit * QUANTIZATION_RESCORE_FACTOR candidates and rescore them with the
+    # full vectors. Compare the levels with quantization_report.py.
+    VECTOR_QUANTIZATION_PRODUCTS = os.getenv("VECTOR_QUANTIZATION_PRODUCTS", "none")
+    VECTOR_QUANTIZATION_SERVICES = os.getenv("VECTOR_QUANTIZATION_SERVICES", "none")
+    QUANTIZATION_RESCORE_FACTOR = int(os.getenv("QUANTIZATION_RESCORE_FACTOR", "4"))
+
+    # Time budget of a /search request in ms (0 = unbounded). Statements are cancelled at the deadline and
+    # a quarter of the budget is kept for a degraded answer: stale cached result, lower recall or lexical-only
+    SEARCH_DEADLINE_MS = float(os.getenv("SEARCH_DEADLINE_MS", "2000"))
+
+    # Max pooled connections a single search request may hold at once (1 = run legs sequentially)
+    SEARCH_MAX_CONNECTIONS_PER_REQUEST = int(os.getenv("SEARCH_MAX_CONNECTIONS_PER_REQUEST", "2"))
+
+    # Hybrid (lexical + vector) ranking: candidates fetched per leg and the RRF constant k
+    HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+    RRF_K = int(os.getenv("RRF_K", "60"))
+    # Answer SKU / barcode-looking queries lexically without embedding them
+    SEARCH_IDENTIFIER_FAST_PATH = os.getenv("SEARCH_IDENTIFIER_FAST_PATH", "true").lower() == "true"
+
+    # Max queries accepted by POST /search/batch
+    SEARCH_BATCH_MAX_QUERIES = int(os.getenv("SEARCH_BATCH_MAX_QUERIES", "200"))
+
+    # Max ids accepted by the bulk lookups GET /product?ids= and GET /service?ids=
+    BULK_LOOKUP_MAX_IDS = int(os.getenv("BULK_LOOKUP_MAX_IDS", "200"))
+
+    # Max items accepted by the batch ingest endpoints POST /product/batch and POST /service/batch
+    INGEST_BATCH_MAX_ITEMS = int(os.getenv("INGEST_BATCH_MAX_ITEMS", "1000"))
+
+    # Similar-items endpoints: serve from the precomputed item_neighbors table (migration 009),
+    # which keeps the top SIMILAR_ITEMS_PRECOMPUTED_K neighbours of every item per type
+    SIMILAR_ITEMS_PRECOMPUTED = os.getenv("SIMILAR_ITEMS_PRECOMPUTED", "false").lower() == "true"
+    SIMILAR_ITEMS_PRECOMPUTED_K = int(os.getenv("SIMILAR_ITEMS_PRECOMPUTED_K", "50"))
+
+    # /search/suggest typeahead: full reload interval (ingest updates it immediately), prefix matches
+    # scanned per lookup and the minimum trigram similarity of fuzzy suggestions
+    SUGGEST_RELOAD_INTERVAL = float(os.getenv("SUGGEST_RELOAD_INTERVAL", "300"))
+    SUGGEST_MAX_SCAN = int(os.getenv("SUGGEST_MAX_SCAN", "2000"))
+    SUGGEST_MIN_SIMILARITY = float(os.getenv("SUGGEST_MIN_SIMILARITY", "0.3"))
+
+    # Structured search logs: the share of searches logged (0-1) and the latency above which every search is logged
+    SEARCH_LOG_SAMPLE_RATE = float(os.getenv("SEARCH_LOG_SAMPLE_RATE", "0.01"))
+    SEARCH_SLOW_LOG_MS = float(os.getenv("SEARCH_SLOW_LOG_MS", "1000"))
+    # Shared secret for /search?debug=true (sent as X-Debug-Token); debug mode is off while unset
+    SEARCH_DEBUG_TOKEN = os.getenv("SEARCH_DEBUG_TOKEN", "")
+
+    # Micro-batching of concurrent embed_text calls into one model.encode batch
+    EMBEDDING_MICRO_BATCHING = os.getenv("EMBEDDING_MICRO_BATCHING", "true").lower() == "true"
+    EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+    EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
+    # Keep stock levels and prices (variant and package prices, basePrice) out of the embedded text: they stay
+    # stored and filterable, and updates touching only them skip the model. Changing it re-embeds items on their next write
+    EMBEDDING_EXCLUDE_VOLATILE_FIELDS = os.getenv("EMBEDDING_EXCLUDE_VOLATILE_FIELDS", "false").lower() == "true"
+    # Dedicated embedding executor: concurrent model.encode calls, and torch intra-op threads (0 = torch default)
+    EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+    EMBEDDING_TORCH_THREADS = int(os.getenv("EMBEDDING_TORCH_THREADS", "0"))
+    # Admission control: /search and the ingest endpoints answer 503 once this many texts of their
+    # priority are waiting for the model (0 = unbounded); the RabbitMQ consumer waits instead
+    EMBEDDING_MAX_QUEUE = int(os.getenv("EMBEDDING_MAX_QUEUE", "256"))
+    # Asynchronous ingest (POST /product?async=true): the embedding job worker run by each API process,
+    # jobs embedded per model call, idle poll interval (s), attempts before a job fails, and the
+    # seconds after which a running job whose worker died is claimed again
+    EMBEDDING_JOBS_WORKER = os.getenv("EMBEDDING_JOBS_WORKER", "true").lower() == "true"
+    EMBEDDING_JOBS_BATCH_SIZE = int(os.getenv("EMBEDDING_JOBS_BATCH_SIZE", "32"))
+    EMBEDDING_JOBS_POLL_INTERVAL = float(os.getenv("EMBEDDING_JOBS_POLL_INTERVAL", "1"))
+    EMBEDDING_JOBS_MAX_ATTEMPTS = int(os.getenv("EMBEDDING_JOBS_MAX_ATTEMPTS", "3"))
+    EMBEDDING_JOBS_STALE_AFTER = float(os.getenv("EMBEDDING_JOBS_STALE_AFTER", "300"))
+    # Done and superseded jobs are deleted this many seconds after they finished (0 = kept forever);
+    # failed jobs are kept for inspection
+    EMBEDDING_JOBS_RETENTION = float(os.getenv("EMBEDDING_JOBS_RETENTION", "604800"))
+
+    # Query embedding LRU cache (TTL in seconds, 0 = never expire; size 0 disables the cache)
+    QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "10000"))
+    QUERY_EMBEDDING_CACHE_TTL = float(os.getenv("QUERY_EMBEDDING_CACHE_TTL", "86400"))
+    # Optional warm file: loaded on startup and rewritten on shutdown
+    QUERY_EMBEDDING_CACHE_FILE = os.getenv("QUERY_EMBEDDING_CACHE_FILE", "")
+
+    # Search result cache (size 0 disables it). Writes from other processes are noticed
+    # within SEARCH_CACHE_MAX_STALENESS seconds via the catalog_version_seq sequence.
+    SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "5000"))
+    SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))
+    SEARCH_CACHE_MAX_STALENESS = float(os.getenv("SEARCH_CACHE_MAX_STALENESS", "5"))
+
+    # Search backend for vector ranking: postgres (pgvector) or memory (in-process index, app/vector_index.py).
+    # The memory index is refreshed from rows whose updated_at changed every VECTOR_INDEX_REFRESH_INTERVAL
+    # seconds and rebuilt (dropping deleted items) every VECTOR_INDEX_FULL_RELOAD_INTERVAL seconds.
+    SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "postgres")
+    VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", os.path.join(tempfile.gettempdir(), "homez-vector-index"))
+    # float32, or float16 to halve the memory footprint
+    VECTOR_INDEX_DTYPE = os.getenv("VECTOR_INDEX_DTYPE", "float32")
+    VECTOR_INDEX_REFRESH_INTERVAL = float(os.getenv("VECTOR_INDEX_REFRESH_INTERVAL", "30"))
+    VECTOR_INDEX_FULL_RELOAD_INTERVAL = float(os.getenv("VECTOR_INDEX_FULL_RELOAD_INTERVAL", "3600"))
 
 settings = Settings()
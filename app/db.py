@@ -1,9 +1,12 @@
 import asyncpg
+import asyncio
+import itertools
 import os
 from dotenv import load_dotenv
-from typing import Optional
+from typing import List, Optional
 import logging
 from pgvector.asyncpg import register_vector
+from app.config import settings
 
 # Load environment variables
 load_dotenv()
@@ -25,6 +28,27 @@ logger.addHandler(ch)
 # Global pool
 pool: Optional[asyncpg.pool.Pool] = None
 
+# Read replica pools (DATABASE_READ_URL) and the positions of those failing their health check
+read_pools: List[asyncpg.pool.Pool] = []
+_unhealthy_replicas = set()
+_next_replica = itertools.count()
+_health_task: Optional[asyncio.Task] = None
+
+# Errors meaning the server is unreachable, as opposed to a failing statement
+CONNECTION_ERRORS = (OSError, asyncpg.PostgresConnectionError, asyncpg.CannotConnectNowError,
+                     asyncpg.ConnectionDoesNotExistError)
+
+
+def pool_options(min_size: int, max_size: int) -> dict:
+    """asyncpg.create_pool arguments shared by the primary, replica and consumer pools"""
+    return {
+        "min_size": min_size,
+        "max_size": max_size,
+        "statement_cache_size": settings.DATABASE_STATEMENT_CACHE_SIZE,
+        "command_timeout": settings.DATABASE_COMMAND_TIMEOUT or None,
+        "init": register_vector,  # Register pgvector extension
+    }
+
 async def init_db_pool():
     """
     Initialize asyncpg connection pool and log status
@@ -44,9 +68,7 @@ async def init_db_pool():
             logger.info("Creating database pool...")
             pool = await asyncpg.create_pool(
                 dsn=DATABASE_URL,
-                min_size=1,
-                max_size=10,
-                init=register_vector  # Register pgvector extension
+                **pool_options(settings.DATABASE_POOL_MIN_SIZE, settings.DATABASE_POOL_MAX_SIZE)
             )
             logger.info("✅ Database pool initialized")
         except Exception as e:
@@ -66,6 +88,76 @@ async def init_db_pool():
                 logger.error(f"Direct connection also failed: {type(direct_e).__name__}: {direct_e}")
             raise
 
+async def init_read_pools():
+    """
+    Create one pool per DATABASE_READ_URL replica and start their health checks.
+    A replica that cannot be reached at startup is logged and left out until the next restart.
+    """
+    global _health_task
+    for dsn in [url.strip() for url in settings.DATABASE_READ_URL.split(",") if url.strip()]:
+        host = dsn.split('@')[-1]
+        try:
+            read_pools.append(await asyncpg.create_pool(
+                dsn=dsn,
+                **pool_options(settings.DATABASE_READ_POOL_MIN_SIZE, settings.DATABASE_READ_POOL_MAX_SIZE)
+            ))
+            logger.info(f"✅ Read replica pool initialized: {host}")
+        except Exception as e:
+            logger.error(f"❌ Failed to initialize read replica pool {host}: {type(e).__name__}: {e}")
+    if read_pools:
+        _health_task = asyncio.create_task(_check_replicas())
+
+
+async def close_read_pools():
+    if _health_task is not None:
+        _health_task.cancel()
+        await asyncio.gather(_health_task, return_exceptions=True)
+    for replica in read_pools:
+        await replica.close()
+    read_pools.clear()
+    _unhealthy_replicas.clear()
+
+
+async def _check_replicas():
+    # An evicted replica rejoins the rotation as soon as it answers again
+    interval = settings.DATABASE_READ_HEALTH_INTERVAL
+    while True:
+        for position, replica in enumerate(read_pools):
+            try:
+                async with replica.acquire(timeout=interval) as conn:
+                    await conn.fetchval("SELECT 1", timeout=interval)
+            except Exception as e:
+                if position not in _unhealthy_replicas:
+                    logger.warning(f"Read replica {position} failed its health check, routing reads elsewhere: "
+                                   f"{type(e).__name__}: {e}")
+                _unhealthy_replicas.add(position)
+                continue
+            if position in _unhealthy_replicas:
+                logger.info(f"Read replica {position} is healthy again")
+                _unhealthy_replicas.discard(position)
+        await asyncio.sleep(interval)
+
+
+def read_pool() -> Optional[asyncpg.pool.Pool]:
+    """Pool for read-only queries: the next healthy replica (round robin), else the primary"""
+    healthy = [replica for position, replica in enumerate(read_pools) if position not in _unhealthy_replicas]
+    if not healthy:
+        return pool
+    return healthy[next(_next_replica) % len(healthy)]
+
+
+def report_failure(failed_pool, error: BaseException):
+    """Evict a replica that lost its connection until its next successful health check"""
+    if isinstance(error, CONNECTION_ERRORS):
+        for position, replica in enumerate(read_pools):
+            if replica is failed_pool and position not in _unhealthy_replicas:
+                logger.warning(f"Read replica {position} is unreachable, routing reads elsewhere: {type(error).__name__}: {error}")
+                _unhealthy_replicas.add(position)
+
+
+def replica_stats() -> dict:
+    return {"configured": len(read_pools), "healthy": len(read_pools) - len(_unhealthy_replicas)}
+
 # Optional: wrapper to log whenever a connection is acquired
 async def acquire_connection():
     if pool is None:
@@ -0,0 +1,213 @@
+"""
+Asynchronous ingest: POST /product?async=true and POST /service?async=true store the item row
+with a pending job (migration 010) and answer 202 at once. The worker here claims pending jobs in
+batches, embeds their texts together and stores the embeddings; until then search leaves the item out.
+GET /jobs/{job_id} reports a job's status.
+"""
+
+from fastapi import APIRouter, HTTPException
+from app.embedding_utils import embed_texts
+from app.config import settings
+from app import metrics, search_cache
+from app.neighbors import refresh_neighbors_many
+from app.ingest_sql import complete_job_query, content_hash
+from app.models import EmbeddingJob
+from app.search_sql import ITEM_TYPES
+from typing import Optional
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Oldest unfinished jobs first; a running job not touched for $2 seconds lost its worker and is claimed again
+CLAIM_JOBS_SQL = """
+    UPDATE embedding_jobs SET status = 'running', attempts = attempts + 1, updated_at = NOW()
+    WHERE id IN (
+        SELECT id FROM embedding_jobs
+        WHERE status = 'pending'
+           OR (status = 'running' AND updated_at < NOW() - make_interval(secs => $2))
+        ORDER BY id
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, item_type, item_id, text, attempts
+"""
+
+# Back to pending for another attempt, or failed once attempts are used up
+FAIL_JOBS_SQL = """
+    UPDATE embedding_jobs
+    SET status = CASE WHEN attempts >= $2 THEN 'failed' ELSE 'pending' END, error = $3, updated_at = NOW()
+    WHERE id = ANY($1::bigint[]) AND status = 'running'
+"""
+
+# Done and superseded jobs finished more than $1 seconds ago, at most $2 per statement
+DELETE_FINISHED_JOBS_SQL = """
+    DELETE FROM embedding_jobs
+    WHERE id IN (
+        SELECT id FROM embedding_jobs
+        WHERE status IN ('done', 'superseded') AND updated_at < NOW() - make_interval(secs => $1)
+        LIMIT $2
+    )
+"""
+# Rows deleted per statement, so one cleanup never holds locks on a large backlog for long
+DELETE_FINISHED_JOBS_CHUNK = 1000
+
+_worker_task: Optional[asyncio.Task] = None
+_wakeup: Optional[asyncio.Event] = None
+
+
+def notify():
+    """Called after a job is queued so this process's worker picks it up without waiting for the next poll"""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _fail(pool, jobs: list, error: Exception):
+    logger.error(f"Embedding jobs {[job['id'] for job in jobs]} failed: {error}")
+    async with pool.acquire() as conn:
+        await conn.execute(FAIL_JOBS_SQL, [job["id"] for job in jobs], settings.EMBEDDING_JOBS_MAX_ATTEMPTS, str(error))
+    for job in jobs:
+        outcome = "failed" if job["attempts"] >= settings.EMBEDDING_JOBS_MAX_ATTEMPTS else "retried"
+        metrics.EMBEDDING_JOBS.labels(job["item_type"], outcome).inc()
+
+
+async def _store_one_by_one(pool, embedded: list) -> list:
+    """Store each (job, embedding) in its own transaction and fail the jobs that raise. Returns the pairs stored"""
+    stored = []
+    async with metrics.acquire(pool, "embedding_jobs", "store_embeddings") as conn:
+        for job, embedding in embedded:
+            try:
+                async with conn.transaction():
+                    await conn.execute(complete_job_query(job["item_type"]), job["id"], embedding, content_hash(job["text"]))
+                stored.append((job, embedding))
+            except Exception as e:
+                await _fail(pool, [job], e)
+    return stored
+
+
+async def process_batch(pool) -> int:
+    """Claim up to EMBEDDING_JOBS_BATCH_SIZE jobs, embed them together and store the embeddings. Returns the jobs claimed"""
+    async with metrics.acquire(pool, "embedding_jobs", "claim") as conn:
+        jobs = await conn.fetch(CLAIM_JOBS_SQL, settings.EMBEDDING_JOBS_BATCH_SIZE, settings.EMBEDDING_JOBS_STALE_AFTER)
+    if not jobs:
+        return 0
+
+    try:
+        # Ingest priority: searches keep going ahead of the backlog
+        with metrics.timed("embedding_jobs", "embed"):
+            embeddings = await embed_texts([job["text"] for job in jobs])
+    except Exception as e:
+        await _fail(pool, jobs, e)
+        return len(jobs)
+
+    # Jobs superseded meanwhile (the item was ingested again or deleted) write nothing
+    embedded = list(zip(jobs, embeddings))
+    try:
+        async with metrics.acquire(pool, "embedding_jobs", "store_embeddings") as conn, conn.transaction():
+            for item_type in ITEM_TYPES:
+                args = [(job["id"], embedding, content_hash(job["text"]))
+                        for job, embedding in embedded if job["item_type"] == item_type]
+                if args:
+                    await conn.executemany(complete_job_query(item_type), args)
+    except Exception as e:
+        # One failing job rolled the whole batch back: store them one by one so only the failing ones are retried
+        logger.warning(f"Storing {len(jobs)} embeddings together failed, storing them one by one: {e}")
+        embedded = await _store_one_by_one(pool, embedded)
+        if not embedded:
+            return len(jobs)
+    done = [job for job, _ in embedded]
+
+    # The items become searchable: cached results may leave them out
+    search_cache.invalidate()
+
+    for job in done:
+        metrics.EMBEDDING_JOBS.labels(job["item_type"], "done").inc()
+        metrics.INGEST_EMBEDDINGS.labels("embedding_jobs", "embedded").inc()
+    with metrics.timed("embedding_jobs", "neighbors"):
+        for item_type in ITEM_TYPES:
+            await refresh_neighbors_many(pool, item_type, [job["item_id"] for job in done if job["item_type"] == item_type])
+    logger.info(f"Embedded {len(done)} queued items")
+    return len(jobs)
+
+
+async def delete_finished_jobs(pool) -> int:
+    """Delete done and superseded jobs older than EMBEDDING_JOBS_RETENTION. Returns the jobs deleted"""
+    deleted = 0
+    while True:
+        async with metrics.acquire(pool, "embedding_jobs", "delete_finished") as conn:
+            status = await conn.execute(DELETE_FINISHED_JOBS_SQL, settings.EMBEDDING_JOBS_RETENTION,
+                                        DELETE_FINISHED_JOBS_CHUNK)
+        # asyncpg returns the command tag, e.g. "DELETE 1000"
+        count = int(status.split()[-1])
+        deleted += count
+        if count < DELETE_FINISHED_JOBS_CHUNK:
+            return deleted
+
+
+async def _work_loop(pool):
+    cleaned_at = float("-inf")
+    while True:
+        _wakeup.clear()
+        # Every tenth of the retention (at most once a minute), so finished jobs outlive it by little
+        cleanup_interval = max(60.0, settings.EMBEDDING_JOBS_RETENTION / 10)
+        if settings.EMBEDDING_JOBS_RETENTION > 0 and time.monotonic() - cleaned_at >= cleanup_interval:
+            cleaned_at = time.monotonic()
+            try:
+                deleted = await delete_finished_jobs(pool)
+                if deleted:
+                    logger.info(f"Deleted {deleted} finished embedding jobs")
+            except Exception as e:
+                logger.error(f"Could not delete finished embedding jobs: {e}")
+        try:
+            claimed = await process_batch(pool)
+        except Exception as e:
+            logger.error(f"Embedding job worker failed: {e}", exc_info=True)
+            claimed = 0
+        if claimed < settings.EMBEDDING_JOBS_BATCH_SIZE:
+            # Queue drained: wait for a job queued by this process, or poll for jobs queued by others
+            try:
+                await asyncio.wait_for(_wakeup.wait(), settings.EMBEDDING_JOBS_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+def start(pool):
+    global _worker_task, _wakeup
+    _wakeup = asyncio.Event()
+    _worker_task = asyncio.create_task(_work_loop(pool))
+
+
+async def stop():
+    if _worker_task is not None:
+        _worker_task.cancel()
+        await asyncio.gather(_worker_task, return_exceptions=True)
+
+
+@router.get("/jobs/{job_id}", response_model=EmbeddingJob)
+async def get_job(job_id: int):
+    """
+    Status of an asynchronous ingest job at `/jobs/{job_id}`: pending, running, done (the item is searchable),
+    failed (see `error`) or superseded (the item was ingested again; follow the newer job).
+    Done and superseded jobs are deleted after EMBEDDING_JOBS_RETENTION seconds and then answer 404
+    """
+
+    # Import pool inside the function to ensure it's initialized
+    from app.db import pool
+
+    # Check if database pool is initialized
+    if pool is None:
+        raise HTTPException(status_code=500, detail="Database pool is not initialized. Please check server logs for database connection errors. Make sure PostgreSQL is running and the database exists.")
+
+    # Always the primary: a replica may not have the job yet
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("""
+            SELECT id, item_type, item_id, status, attempts, error, created_at, updated_at
+            FROM embedding_jobs
+            WHERE id = $1
+        """, job_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return EmbeddingJob(**dict(row))
@@ -1,18 +1,290 @@
 from sentence_transformers import SentenceTransformer
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from app.config import settings
+from app import metrics
+import numpy as np
 import asyncio
+import itertools
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
 
 # Initialize the sentence transformer model
 # Using a model that produces 768-dimensional embeddings to match the database schema
-model = SentenceTransformer('all-mpnet-base-v2')
-
-async def embed_text(text: str):
-    # Run the embedding in a separate thread to avoid blocking
-    embedding = await asyncio.get_event_loop().run_in_executor(None, model.encode, text)
-    # Convert numpy array to list for database storage
-    return embedding.tolist()
-
-async def embed_texts(texts: list):
-    # Run multiple embeddings in a separate thread to avoid blocking
-    embeddings = await asyncio.get_event_loop().run_in_executor(None, model.encode, texts)
-    # Convert numpy array to list for database storage
-    return [embedding.tolist() for embedding in embeddings]
\ No newline at end of file
+MODEL_NAME = 'all-mpnet-base-v2'
+model = SentenceTransformer(MODEL_NAME)
+
+# Intra-op threads of each model.encode call; shared by all EMBEDDING_WORKERS
+if settings.EMBEDDING_TORCH_THREADS > 0:
+    import torch
+    torch.set_num_threads(settings.EMBEDDING_TORCH_THREADS)
+
+# Lower runs first: interactive search embeddings jump ahead of ingest and consumer ones
+PRIORITY_SEARCH = 0
+PRIORITY_INGEST = 1
+PRIORITY_NAMES = {PRIORITY_SEARCH: "search", PRIORITY_INGEST: "ingest"}
+
+
+class EmbeddingQueueFull(Exception):
+    """Raised instead of queueing an embedding when EMBEDDING_MAX_QUEUE texts of its priority are already waiting"""
+
+    # Seconds, sent as Retry-After with the 503
+    retry_after = 1
+
+    def __init__(self, priority: int):
+        super().__init__(f"Embedding queue is full ({PRIORITY_NAMES[priority]}); retry shortly")
+        self.priority = priority
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent embed_text calls into one model.encode batch.
+    A batch is dispatched once EMBEDDING_MAX_BATCH_SIZE texts are waiting or
+    EMBEDDING_BATCH_WINDOW_MS after the first one arrived, whichever comes first.
+    Batches run on a dedicated executor of EMBEDDING_WORKERS threads, at most one per thread;
+    texts arriving meanwhile wait in a priority queue, search texts first.
+    """
+
+    def __init__(self, max_batch_size: int, window_ms: float, workers: int, max_queue: int):
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = window_ms / 1000
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.batches = 0
+        self.texts = 0
+        self.batch_sizes = {}  # batch size -> number of batches dispatched with that size
+        self.rejected = {name: 0 for name in PRIORITY_NAMES.values()}
+        # Not the loop's default executor: vector index loads and other run_in_executor work never queue behind the model
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="embedding")
+        self._sequence = itertools.count()
+        self._waiting = {priority: 0 for priority in PRIORITY_NAMES}
+        self._loop = None
+        self._queue = None
+        self._batch_full = None
+        self._slots = None
+        self._worker = None
+
+    def _ensure_worker(self):
+        # The queue and worker belong to one event loop (the API, bulk_import and tests each run their own)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.PriorityQueue()
+            self._batch_full = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.workers)
+            self._waiting = {priority: 0 for priority in PRIORITY_NAMES}
+            self._worker = loop.create_task(self._run())
+
+    def queue_depth(self, priority: Optional[int] = None) -> int:
+        """Texts waiting for a model call, in total or of one priority"""
+        if priority is None:
+            return sum(self._waiting.values())
+        return self._waiting[priority]
+
+    def check_capacity(self, priority: int):
+        """Admission control: raise EmbeddingQueueFull rather than queue behind EMBEDDING_MAX_QUEUE waiting texts"""
+        if self.max_queue > 0 and self._waiting[priority] >= self.max_queue:
+            self.rejected[PRIORITY_NAMES[priority]] += 1
+            metrics.EMBEDDING_REJECTED.labels(PRIORITY_NAMES[priority]).inc()
+            raise EmbeddingQueueFull(priority)
+
+    async def embed(self, text: str, priority: int = PRIORITY_INGEST):
+        self._ensure_worker()
+        future = self._loop.create_future()
+        # The sequence number keeps equal priorities first-in first-out
+        self._queue.put_nowait((priority, next(self._sequence), text, future))
+        self._waiting[priority] += 1
+        # The worker already took the first text of the batch off the queue
+        if self._queue.qsize() >= self.max_batch_size - 1:
+            self._batch_full.set()
+        return await future
+
+    async def _run(self):
+        while True:
+            # Wait for a free worker first, so the batch is taken from the queue with the latest priorities
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+            # Give concurrent callers a short window to join this batch
+            if self.window > 0 and self._queue.qsize() < self.max_batch_size - 1:
+                self._batch_full.clear()
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            for priority, _, _, _ in batch:
+                self._waiting[priority] -= 1
+
+            # Callers that gave up (e.g. client disconnected) are not embedded
+            batch = [(text, future) for _, _, text, future in batch if not future.done()]
+            if not batch:
+                self._slots.release()
+                continue
+
+            self.batches += 1
+            self.texts += len(batch)
+            self.batch_sizes[len(batch)] = self.batch_sizes.get(len(batch), 0) + 1
+            metrics.EMBEDDING_BATCH_SIZE.observe(len(batch))
+            self._loop.create_task(self._encode(batch))
+
+    async def _encode(self, batch: list):
+        try:
+            with metrics.timed("embedding", "encode"):
+                embeddings = await self._loop.run_in_executor(self.executor, model.encode, [text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                # Convert numpy array to list for database storage
+                future.set_result(embedding.tolist())
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queue_depth": {name: self.queue_depth(priority) for priority, name in PRIORITY_NAMES.items()},
+            "rejected": dict(self.rejected),
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
+
+
+# Without micro-batching there is no window: a batch is only what is already waiting when a worker frees up
+batcher = EmbeddingBatcher(settings.EMBEDDING_MAX_BATCH_SIZE,
+                           settings.EMBEDDING_BATCH_WINDOW_MS if settings.EMBEDDING_MICRO_BATCHING else 0,
+                           settings.EMBEDDING_WORKERS, settings.EMBEDDING_MAX_QUEUE)
+for _priority, _name in PRIORITY_NAMES.items():
+    metrics.watch_queue(f"embedding_{_name}", lambda priority=_priority: batcher.queue_depth(priority))
+metrics.watch_queue("embedding_executor", lambda: metrics.executor_queue_depth(batcher.executor))
+
+async def embed_text(text: str, priority: int = PRIORITY_INGEST):
+    # Every model call goes through the batcher's bounded executor, in priority order
+    return await batcher.embed(text, priority)
+
+async def embed_texts(texts: list, priority: int = PRIORITY_INGEST):
+    # Queued together, so they are split into batches of at most EMBEDDING_MAX_BATCH_SIZE
+    return list(await asyncio.gather(*(batcher.embed(text, priority) for text in texts)))
+
+
+def normalize_query(text: str) -> str:
+    """Cache key for a search query: lower-cased with collapsed whitespace.
+    The model's tokenizer lower-cases anyway, so this does not change the embedding."""
+    return " ".join(text.lower().split())
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU cache of query embeddings with an optional TTL (0 = entries never expire).
+    Embeddings are kept as float32 arrays (~3 KB each) rather than Python float lists.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (stored_at, embedding)
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        entry = self._entries.get(key)
+        if entry is None or (self.ttl and time.monotonic() - entry[0] > self.ttl):
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, embedding):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (time.monotonic(), np.asarray(embedding, dtype=np.float32))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def save(self, path: str):
+        """Write the cached queries and embeddings (least recently used first) to a warm file"""
+        keys = list(self._entries.keys())
+        matrix = np.stack([embedding for _, embedding in self._entries.values()]) if keys else np.zeros((0, 768), dtype=np.float32)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, model=np.array(MODEL_NAME), keys=np.array(keys, dtype=str), embeddings=matrix)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved {len(keys)} query embeddings to {path}")
+
+    def load(self, path: str):
+        """Fill the cache from a warm file written by `save`, ignoring files from another model"""
+        if not os.path.exists(path):
+            return
+        with np.load(path) as data:
+            if str(data["model"]) != MODEL_NAME:
+                logger.warning(f"Ignoring query embedding warm file {path}: built with model {data['model']}")
+                return
+            for key, embedding in zip(data["keys"], data["embeddings"]):
+                self.put(str(key), embedding)
+        logger.info(f"Loaded {len(self._entries)} query embeddings from {path}")
+
+
+query_cache = QueryEmbeddingCache(settings.QUERY_EMBEDDING_CACHE_SIZE, settings.QUERY_EMBEDDING_CACHE_TTL)
+
+# Concurrent misses for the same query share one model call
+_pending_queries = {}
+
+async def embed_query(query: str):
+    """Embed a search query, serving repeated queries from the LRU cache"""
+    key = normalize_query(query)
+    embedding = query_cache.get(key)
+    if embedding is not None:
+        return embedding.tolist()
+
+    future = _pending_queries.get(key)
+    if future is None:
+        batcher.check_capacity(PRIORITY_SEARCH)
+        future = asyncio.ensure_future(embed_text(key, PRIORITY_SEARCH))
+        _pending_queries[key] = future
+        future.add_done_callback(lambda _: _pending_queries.pop(key, None))
+    # shield: one caller giving up must not cancel the embedding for the others
+    embedding = await asyncio.shield(future)
+    query_cache.put(key, embedding)
+    return embedding
+
+async def embed_queries(queries: list):
+    """Embed many search queries: cached ones are reused, the rest go through one embed_texts call"""
+    keys = [normalize_query(query) for query in queries]
+    embeddings = {}
+    for key in keys:
+        embedding = query_cache.get(key)
+        if embedding is not None:
+            embeddings[key] = embedding.tolist()
+
+    missing = list(dict.fromkeys(key for key in keys if key not in embeddings))
+    if missing:
+        batcher.check_capacity(PRIORITY_SEARCH)
+        for key, embedding in zip(missing, await embed_texts(missing, PRIORITY_SEARCH)):
+            query_cache.put(key, embedding)
+            embeddings[key] = embedding
+
+    return [embeddings[key] for key in keys]
@@ -0,0 +1,104 @@
+from fastapi import HTTPException
+from app.embedding_utils import PRIORITY_INGEST, batcher, embed_texts
+from app.config import settings
+from app import metrics, search_cache
+from app.neighbors import refresh_neighbors_many
+from app.ingest_sql import content_hash, unchanged_items, upsert_items
+from app.models import BatchItemStatus
+from typing import Callable, List
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+async def ingest_items(item_type: str, items: list, text: Callable, record: Callable,
+                       index: Callable) -> List[BatchItemStatus]:
+    """
+    Shared body of POST /product/batch and POST /service/batch.
+    `text` and `record` build an item's embedded text and column values, `index` adds its typeahead suggestions.
+    Items without a name are reported as invalid; of repeated ids only the last item is stored.
+    Items whose content hash matches their stored embedding are not embedded again.
+    """
+
+    # Import pool inside the function to ensure it's initialized
+    from app.db import pool
+
+    # Check if database pool is initialized
+    if pool is None:
+        raise HTTPException(status_code=500, detail="Database pool is not initialized. Please check server logs for database connection errors. Make sure PostgreSQL is running and the database exists.")
+
+    if len(items) > settings.INGEST_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.INGEST_BATCH_MAX_ITEMS} items per batch")
+
+    statuses = [BatchItemStatus(id=item.id, status="invalid", detail="'name' is required") if not item.name
+                else BatchItemStatus(id=item.id, status="duplicate", detail="Replaced by a later item with the same id")
+                for item in items]
+    last = {item.id: n for n, item in enumerate(items) if item.name}
+    accepted = [items[n] for n in sorted(last.values())]
+    if not accepted:
+        return statuses
+
+    # 1️⃣ Items resent with unchanged content keep their stored embeddings
+    started = time.perf_counter()
+    texts = {item.id: text(item) for item in accepted}
+    hashes = {item_id: content_hash(item_text) for item_id, item_text in texts.items()}
+    async with metrics.acquire(pool, "ingest_batch", "lookup_hashes") as conn:
+        unchanged = await unchanged_items(conn, item_type, hashes)
+    changed = [item for item in accepted if item.id not in unchanged]
+
+    # Refuse (503) before embedding or writing anything when the embedding queue is full
+    if changed:
+        batcher.check_capacity(PRIORITY_INGEST)
+
+    # 2️⃣ Embed the others in chunks that fill one model call per embedding worker, so a large batch
+    # never holds the whole ingest queue and search embeddings keep running between chunks
+    embeddings = await embed_items(changed, texts)
+    embedded = time.perf_counter()
+
+    # 3️⃣ COPY rows and embeddings into a staging table and merge them in one statement
+    async with metrics.acquire(pool, "ingest_batch", "store_items") as conn:
+        inserted = await upsert_items(conn, item_type, [record(item) + [embeddings.get(item.id), hashes[item.id]]
+                                                        for item in accepted])
+
+    # Items whose stored content changed since the lookup were not merged: embed and store them now
+    missed = [item for item in accepted if item.id not in inserted]
+    if missed:
+        embeddings.update(await embed_items(missed, texts))
+        async with metrics.acquire(pool, "ingest_batch", "store_items") as conn:
+            inserted.update(await upsert_items(conn, item_type, [record(item) + [embeddings[item.id], hashes[item.id]]
+                                                                 for item in missed]))
+    skipped = len(accepted) - len(embeddings)
+    metrics.INGEST_EMBEDDINGS.labels("ingest_batch", "embedded").inc(len(embeddings))
+    metrics.INGEST_EMBEDDINGS.labels("ingest_batch", "skipped").inc(skipped)
+    logger.info(f"Batch ingest of {len(accepted)} {item_type}: {len(embeddings)} embedded, {skipped} unchanged; "
+                f"embedded in {(embedded - started) * 1000:.0f} ms, stored in {(time.perf_counter() - embedded) * 1000:.0f} ms")
+
+    # Cached search results may include old versions of these items
+    if any(written is not None for written in inserted.values()):
+        search_cache.invalidate()
+
+    # Keep their precomputed "similar items" lists in line with the new embeddings, in one statement per target type
+    with metrics.timed("ingest_batch", "neighbors"):
+        await refresh_neighbors_many(pool, item_type, [item.id for item in accepted if item.id in embeddings])
+    for item in accepted:
+        index(item)
+
+    for n in last.values():
+        item_id = items[n].id
+        if inserted[item_id] is None:
+            statuses[n] = BatchItemStatus(id=item_id, status="unchanged", detail="No field differs, nothing written")
+        else:
+            statuses[n] = BatchItemStatus(id=item_id, status="created" if inserted[item_id] else "updated",
+                                          detail=None if item_id in embeddings else "Content unchanged, embedding kept")
+    return statuses
+
+
+async def embed_items(items: list, texts: dict) -> dict:
+    """{item id: embedding} of `items`, in chunks of one model call per embedding worker"""
+    chunk = max(1, settings.EMBEDDING_MAX_BATCH_SIZE * settings.EMBEDDING_WORKERS)
+    embeddings = []
+    with metrics.timed("ingest_batch", "embed"):
+        for n in range(0, len(items), chunk):
+            embeddings += await embed_texts([texts[item.id] for item in items[n:n + chunk]])
+    return {item.id: embedding for item, embedding in zip(items, embeddings)}
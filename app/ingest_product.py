@@ -1,17 +1,49 @@
-from fastapi import APIRouter, HTTPException
-from app.embedding_utils import embed_text
-from app.models import Product
+from fastapi import APIRouter, HTTPException, Query, Response
+from app.embedding_utils import PRIORITY_INGEST, batcher, embed_text
+from app.config import settings
+from app import embedding_jobs, item_text, metrics, search_cache, suggest
+from app.neighbors import refresh_neighbors
+from app.ingest_sql import content_hash, enqueue_item_query, update_unchanged_item_query, upsert_item_query
+from app.ingest_batch import ingest_items
+from app.models import Product, ProductBatch, BatchIngestResponse
+from typing import List
 import json
 
 router = APIRouter()
 
+def product_text(product: Product) -> str:
+    """Unified text containing all relevant product information, embedded as one vector"""
+    return item_text.product_text(product.model_dump())
+
+
+def product_record(product: Product) -> list:
+    """Column values in ITEM_COLUMNS["products"] order"""
+    return [
+        product.id,
+        product.name,
+        product.barcode,
+        product.description,
+        product.basePrice,
+        product.categoryName,
+        product.brand,
+        json.dumps(product.tags or []),
+        json.dumps([v.dict() for v in product.variants] or []),
+        json.dumps([a.dict() for a in product.attributes] or []),
+    ]
+
+
 @router.post("/")
-async def ingest_product(product: Product):
+async def ingest_product(product: Product, response: Response,
+                         async_: bool = Query(False, alias="async",
+                                              description="Store now, embed in the background and answer 202 with a job id")):
     """
     Ingest a product at `/product` endpoint:
-    - Store the product JSON as-is
     - Generate a single unified embedding from all product data
-    - Store embedding using pgvector
+    - Store the product JSON as-is and the embedding (pgvector) in one statement
+    A product resent with unchanged content keeps its stored embedding: only its row is updated, if any
+    field differs ("status": "fields_updated", e.g. stock or prices with EMBEDDING_EXCLUDE_VOLATILE_FIELDS)
+    With `?async=true` the product is stored with a pending embedding job instead (GET /jobs/{job_id});
+    search leaves it out until the job is done
     """
     
     # Import pool inside the function to ensure it's initialized
@@ -25,73 +57,106 @@ async def ingest_product(product: Product):
     if not product.name:
         raise HTTPException(status_code=400, detail="Product 'name' is required")
 
-    # Store product JSON in DB
-    async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO products (id, name, barcode, description, basePrice, categoryName, brand, tags, variants, attributes)
-            VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10)
-            ON CONFLICT (id) DO UPDATE SET
-                name=EXCLUDED.name,
-                barcode=EXCLUDED.barcode,
-                description=EXCLUDED.description,
-                basePrice=EXCLUDED.basePrice,
-                categoryName=EXCLUDED.categoryName,
-                brand=EXCLUDED.brand,
-                tags=EXCLUDED.tags,
-                variants=EXCLUDED.variants,
-                attributes=EXCLUDED.attributes
-        """,
-        product_id,
-        product.name,
-        product.barcode,
-        product.description,
-        product.basePrice,
-        product.categoryName,
-        product.brand,
-        json.dumps(product.tags or []),
-        json.dumps([v.dict() for v in product.variants] or []),
-        json.dumps([a.dict() for a in product.attributes] or [])
-        )
-
-    # Build a unified text containing all relevant product information
-    variants_text = ""
-    for v in product.variants:
-        v_parts = [f"SKU: {v.sku}", f"Price: {v.price}", f"Stock: {v.stock}"]
-        attr_text = []
-        for a in v.attributes:
-            val = a.stringValue or a.numberValue or a.booleanValue or a.dateValue or ""
-            attr_text.append(f"{a.name}: {val}")
-        if attr_text:
-            v_parts.append(" | ".join(attr_text))
-        variants_text += " | ".join(v_parts) + "\n"
-    
-    # Format product attributes
-    product_attributes_text = ""
-    for a in product.attributes:
-        val = a.stringValue or a.numberValue or a.booleanValue or a.dateValue or ""
-        product_attributes_text += f"{a.name}: {val}\n"
-
-    full_text = f"""
-Name: {product.name}
-Description: {product.description}
-Base Price: {product.basePrice}
-Category: {product.categoryName}
-Brand: {product.brand}
-Tags: {', '.join(product.tags or [])}
-Variants:
-{variants_text}
-Product Attributes:
-{product_attributes_text}
-"""
+    full_text = product_text(product)
+    digest = content_hash(full_text)
+
+    # Unchanged content (same hash as the stored embedding): update the changed fields, if any, and skip the model
+    async with metrics.acquire(pool, "ingest", "store_unchanged") as conn:
+        stored = await conn.fetchrow(update_unchanged_item_query("products"), *product_record(product), digest)
+    if stored["unchanged_content"]:
+        metrics.INGEST_EMBEDDINGS.labels("ingest", "skipped").inc()
+        if stored["updated"]:
+            # Cached search results may include the old field values
+            search_cache.invalidate()
+        return {"status": "fields_updated" if stored["updated"] else "unchanged", "product_id": product_id}
+
+    if async_:
+        # Store the product JSON with a job for the embedding worker (app/embedding_jobs.py)
+        async with metrics.acquire(pool, "ingest", "enqueue") as conn:
+            job = await conn.fetchrow(enqueue_item_query("products"), *product_record(product), full_text)
+        embedding_jobs.notify()
+
+        # Cached search results may include the old version of this product
+        search_cache.invalidate()
+        suggest.index_item("products", product_id, product.name, product.brand, product.categoryName, product.tags)
+
+        response.status_code = 202
+        return {"status": "pending", "product_id": product_id, "job_id": job["job_id"]}
+
+    # Refuse (503) before writing anything when the embedding queue is full
+    batcher.check_capacity(PRIORITY_INGEST)
 
     # Generate a single embedding for the entire product
-    embedding = await embed_text(full_text)
+    with metrics.timed("ingest", "embed"):
+        embedding = await embed_text(full_text)
     
+    # Store the product JSON and its embedding in one statement
+    async with metrics.acquire(pool, "ingest", "store_item") as conn:
+        await conn.fetchval(upsert_item_query("products"), *product_record(product), embedding, digest)
+    metrics.INGEST_EMBEDDINGS.labels("ingest", "embedded").inc()
+
+    # Cached search results may include the old version of this product
+    search_cache.invalidate()
+
+    # Keep its precomputed "similar items" lists in line with the new embedding
+    with metrics.timed("ingest", "neighbors"):
+        await refresh_neighbors(pool, "products", product_id)
+
+    # Typeahead suggestions for its name, brand, category and tags
+    suggest.index_item("products", product_id, product.name, product.brand, product.categoryName, product.tags)
+
+    return {"status": "embedded", "product_id": product_id}
+
+
+@router.post("/batch", response_model=BatchIngestResponse)
+async def ingest_products(batch: ProductBatch):
+    """
+    Ingest many products at `/product/batch` (up to INGEST_BATCH_MAX_ITEMS):
+    - Embeddings are computed together, EMBEDDING_MAX_BATCH_SIZE texts per model call
+    - Rows and embeddings are COPYed into a staging table and merged in one statement
+    Returns one status per submitted product, in request order
+    """
+    statuses = await ingest_items("products", batch.products, product_text, product_record,
+                                  lambda product: suggest.index_item("products", product.id, product.name, product.brand,
+                                                                     product.categoryName, product.tags))
+    return BatchIngestResponse(items=statuses)
+
+
+@router.get("/")
+async def get_products(ids: List[str] = Query(..., description="Product ids, comma-separated or repeated")):
+    """
+    Bulk lookup at `/product?ids=a,b,c`: hydrate search results in one request.
+    Returns the stored products in the requested order; unknown ids are listed in `missing`
+    """
+
+    # Reads go to a read replica when DATABASE_READ_URL is set (else the primary)
+    from app.db import read_pool
+    pool = read_pool()
+
+    # Check if database pool is initialized
+    if pool is None:
+        raise HTTPException(status_code=500, detail="Database pool is not initialized. Please check server logs for database connection errors. Make sure PostgreSQL is running and the database exists.")
+
+    product_ids = list(dict.fromkeys(product_id for value in ids for product_id in value.split(",") if product_id))
+    if len(product_ids) > settings.BULK_LOOKUP_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BULK_LOOKUP_MAX_IDS} ids per request")
+
     async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO product_embeddings (product_id, embedding)
-            VALUES ($1,$2)
-            ON CONFLICT (product_id) DO UPDATE SET embedding=EXCLUDED.embedding
-        """, product_id, embedding)
+        rows = await conn.fetch("""
+            SELECT id, name, barcode, description, basePrice AS "basePrice", categoryName AS "categoryName", brand, tags, variants, attributes
+            FROM products
+            WHERE id = ANY($1::text[])
+        """, product_ids)
+
+    found = {}
+    for row in rows:
+        product = dict(row)
+        # JSONB columns arrive as JSON text
+        for column in ["tags", "variants", "attributes"]:
+            product[column] = json.loads(product[column]) if product[column] is not None else []
+        found[product["id"]] = product
 
-    return {"status": "embedded", "product_id": product_id}
\ No newline at end of file
+    return {
+        "products": [found[product_id] for product_id in product_ids if product_id in found],
+        "missing": [product_id for product_id in product_ids if product_id not in found],
+    }
@@ -1,17 +1,47 @@
-from fastapi import APIRouter, HTTPException
-from app.embedding_utils import embed_text
-from app.models import Service
+from fastapi import APIRouter, HTTPException, Query, Response
+from app.embedding_utils import PRIORITY_INGEST, batcher, embed_text
+from app.config import settings
+from app import embedding_jobs, item_text, metrics, search_cache, suggest
+from app.neighbors import refresh_neighbors
+from app.ingest_sql import content_hash, enqueue_item_query, update_unchanged_item_query, upsert_item_query
+from app.ingest_batch import ingest_items
+from app.models import Service, ServiceBatch, BatchIngestResponse
+from typing import List
 import json
 
 router = APIRouter()
 
+def service_text(service: Service) -> str:
+    """Unified text containing all relevant service information, embedded as one vector"""
+    return item_text.service_text(service.model_dump())
+
+
+def service_record(service: Service) -> list:
+    """Column values in ITEM_COLUMNS["services"] order"""
+    return [
+        service.id,
+        service.name,
+        service.description,
+        service.basePrice,
+        service.categoryName,
+        json.dumps(service.tags or []),
+        json.dumps([p.dict() for p in service.packages] or []),
+        json.dumps([a.dict() for a in service.attributes] or []),
+    ]
+
+
 @router.post("/")
-async def ingest_service(service: Service):
+async def ingest_service(service: Service, response: Response,
+                         async_: bool = Query(False, alias="async",
+                                              description="Store now, embed in the background and answer 202 with a job id")):
     """
     Ingest a service at `/service` endpoint:
-    - Store the service JSON as-is
     - Generate a single unified embedding from all service data
-    - Store embedding using pgvector
+    - Store the service JSON as-is and the embedding (pgvector) in one statement
+    A service resent with unchanged content keeps its stored embedding: only its row is updated, if any
+    field differs ("status": "fields_updated", e.g. package prices with EMBEDDING_EXCLUDE_VOLATILE_FIELDS)
+    With `?async=true` the service is stored with a pending embedding job instead (GET /jobs/{job_id});
+    search leaves it out until the job is done
     """
     
     # Import pool inside the function to ensure it's initialized
@@ -25,68 +55,106 @@ async def ingest_service(service: Service):
     if not service.name:
         raise HTTPException(status_code=400, detail="Service 'name' is required")
 
-    # Store service JSON in DB
-    async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO services (id, name, description, basePrice, categoryName, tags, packages, attributes)
-            VALUES ($1,$2,$3,$4,$5,$6,$7,$8)
-            ON CONFLICT (id) DO UPDATE SET
-                name=EXCLUDED.name,
-                description=EXCLUDED.description,
-                basePrice=EXCLUDED.basePrice,
-                categoryName=EXCLUDED.categoryName,
-                tags=EXCLUDED.tags,
-                packages=EXCLUDED.packages,
-                attributes=EXCLUDED.attributes
-        """,
-        service_id,
-        service.name,
-        service.description,
-        service.basePrice,
-        service.categoryName,
-        json.dumps(service.tags or []),
-        json.dumps([p.dict() for p in service.packages] or []),
-        json.dumps([a.dict() for a in service.attributes] or [])
-        )
-
-    # Build a unified text containing all relevant service information
-    packages_text = ""
-    for p in service.packages:
-        p_parts = [f"Package: {p.name}", f"Price: {p.price}", f"Description: {p.description}"]
-        attr_text = []
-        for a in p.attributes:
-            val = a.stringValue or a.numberValue or a.booleanValue or a.dateValue or ""
-            attr_text.append(f"{a.name}: {val}")
-        if attr_text:
-            p_parts.append(" | ".join(attr_text))
-        packages_text += " | ".join(p_parts) + "\n"
-    
-    # Format service attributes
-    service_attributes_text = ""
-    for a in service.attributes:
-        val = a.stringValue or a.numberValue or a.booleanValue or a.dateValue or ""
-        service_attributes_text += f"{a.name}: {val}\n"
-
-    full_text = f"""
-Name: {service.name}
-Description: {service.description}
-Base Price: {service.basePrice}
-Category: {service.categoryName}
-Tags: {', '.join(service.tags or [])}
-Packages:
-{packages_text}
-Service Attributes:
-{service_attributes_text}
-"""
+    full_text = service_text(service)
+    digest = content_hash(full_text)
+
+    # Unchanged content (same hash as the stored embedding): update the changed fields, if any, and skip the model
+    async with metrics.acquire(pool, "ingest", "store_unchanged") as conn:
+        stored = await conn.fetchrow(update_unchanged_item_query("services"), *service_record(service), digest)
+    if stored["unchanged_content"]:
+        metrics.INGEST_EMBEDDINGS.labels("ingest", "skipped").inc()
+        if stored["updated"]:
+            # Cached search results may include the old field values
+            search_cache.invalidate()
+        return {"status": "fields_updated" if stored["updated"] else "unchanged", "service_id": service_id}
+
+    if async_:
+        # Store the service JSON with a job for the embedding worker (app/embedding_jobs.py)
+        async with metrics.acquire(pool, "ingest", "enqueue") as conn:
+            job = await conn.fetchrow(enqueue_item_query("services"), *service_record(service), full_text)
+        embedding_jobs.notify()
+
+        # Cached search results may include the old version of this service
+        search_cache.invalidate()
+        suggest.index_item("services", service_id, service.name, None, service.categoryName, service.tags)
+
+        response.status_code = 202
+        return {"status": "pending", "service_id": service_id, "job_id": job["job_id"]}
+
+    # Refuse (503) before writing anything when the embedding queue is full
+    batcher.check_capacity(PRIORITY_INGEST)
 
     # Generate a single embedding for the entire service
-    embedding = await embed_text(full_text)
+    with metrics.timed("ingest", "embed"):
+        embedding = await embed_text(full_text)
     
+    # Store the service JSON and its embedding in one statement
+    async with metrics.acquire(pool, "ingest", "store_item") as conn:
+        await conn.fetchval(upsert_item_query("services"), *service_record(service), embedding, digest)
+    metrics.INGEST_EMBEDDINGS.labels("ingest", "embedded").inc()
+
+    # Cached search results may include the old version of this service
+    search_cache.invalidate()
+
+    # Keep its precomputed "similar items" lists in line with the new embedding
+    with metrics.timed("ingest", "neighbors"):
+        await refresh_neighbors(pool, "services", service_id)
+
+    # Typeahead suggestions for its name, category and tags
+    suggest.index_item("services", service_id, service.name, None, service.categoryName, service.tags)
+
+    return {"status": "embedded", "service_id": service_id}
+
+
+@router.post("/batch", response_model=BatchIngestResponse)
+async def ingest_services(batch: ServiceBatch):
+    """
+    Ingest many services at `/service/batch` (up to INGEST_BATCH_MAX_ITEMS):
+    - Embeddings are computed together, EMBEDDING_MAX_BATCH_SIZE texts per model call
+    - Rows and embeddings are COPYed into a staging table and merged in one statement
+    Returns one status per submitted service, in request order
+    """
+    statuses = await ingest_items("services", batch.services, service_text, service_record,
+                                  lambda service: suggest.index_item("services", service.id, service.name, None,
+                                                                     service.categoryName, service.tags))
+    return BatchIngestResponse(items=statuses)
+
+
+@router.get("/")
+async def get_services(ids: List[str] = Query(..., description="Service ids, comma-separated or repeated")):
+    """
+    Bulk lookup at `/service?ids=a,b,c`: hydrate search results in one request.
+    Returns the stored services in the requested order; unknown ids are listed in `missing`
+    """
+
+    # Reads go to a read replica when DATABASE_READ_URL is set (else the primary)
+    from app.db import read_pool
+    pool = read_pool()
+
+    # Check if database pool is initialized
+    if pool is None:
+        raise HTTPException(status_code=500, detail="Database pool is not initialized. Please check server logs for database connection errors. Make sure PostgreSQL is running and the database exists.")
+
+    service_ids = list(dict.fromkeys(service_id for value in ids for service_id in value.split(",") if service_id))
+    if len(service_ids) > settings.BULK_LOOKUP_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.BULK_LOOKUP_MAX_IDS} ids per request")
+
     async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO service_embeddings (service_id, embedding)
-            VALUES ($1,$2)
-            ON CONFLICT (service_id) DO UPDATE SET embedding=EXCLUDED.embedding
-        """, service_id, embedding)
+        rows = await conn.fetch("""
+            SELECT id, name, description, basePrice AS "basePrice", categoryName AS "categoryName", tags, packages, attributes
+            FROM services
+            WHERE id = ANY($1::text[])
+        """, service_ids)
+
+    found = {}
+    for row in rows:
+        service = dict(row)
+        # JSONB columns arrive as JSON text
+        for column in ["tags", "packages", "attributes"]:
+            service[column] = json.loads(service[column]) if service[column] is not None else []
+        found[service["id"]] = service
 
-    return {"status": "embedded", "service_id": service_id}
\ No newline at end of file
+    return {
+        "services": [found[service_id] for service_id in service_ids if service_id in found],
+        "missing": [service_id for service_id in service_ids if service_id not in found],
+    }
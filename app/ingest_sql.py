@@ -0,0 +1,223 @@
+"""
+SQL for storing an item row together with its embedding. The ingest endpoints, the RabbitMQ
+consumer and bulk_import.py embed first, then write both in one statement: one round trip and one
+implicit transaction, so an item is never stored without its embedding. Batch ingest COPYs many
+items into a staging table and merges them the same way. Asynchronous ingest stores the row with
+an embedding job instead (embedding_jobs.py writes the embedding later).
+
+Each embedding is stored with the content_hash of its text (migration 011). Writers compare it first:
+an item resent with the same content only has its row updated, without running the model. With
+EMBEDDING_EXCLUDE_VOLATILE_FIELDS stock and prices are not part of that text, so inventory and price
+updates take this path too.
+"""
+
+from app.embedding_utils import MODEL_NAME
+from app.search_sql import ITEM_TYPES
+import hashlib
+
+# Item columns in parameter order ($1 = id); the embedding and its content hash are the parameters after the last column
+ITEM_COLUMNS = {
+    "products": ["id", "name", "barcode", "description", "basePrice", "categoryName", "brand", "tags", "variants", "attributes"],
+    "services": ["id", "name", "description", "basePrice", "categoryName", "tags", "packages", "attributes"],
+}
+
+
+def update_columns(item_type: str) -> str:
+    return ", ".join(f"{column}=EXCLUDED.{column}" for column in ITEM_COLUMNS[item_type][1:])
+
+
+def content_hash(text: str) -> str:
+    """Hash of an embedded text and the model embedding it: an equal hash means an equal embedding"""
+    return hashlib.sha256(f"{MODEL_NAME}\n{text}".encode()).hexdigest()
+
+
+def update_unchanged_item_query(item_type: str) -> str:
+    """
+    Update of an item row whose stored embedding has the content hash given after the last column,
+    leaving the embedding as it is. Returns `unchanged_content` (false when the item is new or its
+    content changed: it then has to be embedded and stored with upsert_item_query) and `updated`
+    (false when no column differs either, so the row, its updated_at and the caches are left alone).
+    """
+    t = ITEM_TYPES[item_type]
+    columns = ITEM_COLUMNS[item_type]
+    assignments = ", ".join(f"{column}=${n}" for n, column in enumerate(columns[1:], start=2))
+    values = ", ".join(f"${n}" for n in range(2, len(columns) + 1))
+    return f"""
+        WITH stored AS (
+            SELECT EXISTS (
+                SELECT 1 FROM {t['embeddings']} e WHERE e.{t['key']} = $1 AND e.content_hash = ${len(columns) + 1}
+            ) AS unchanged_content
+        ), item AS (
+            UPDATE {t['table']} SET {assignments}
+            WHERE id = $1
+              AND (SELECT unchanged_content FROM stored)
+              AND ({', '.join(columns[1:])}) IS DISTINCT FROM ({values})
+            RETURNING id
+        )
+        SELECT unchanged_content, EXISTS (SELECT 1 FROM item) AS updated FROM stored
+    """
+
+
+def unchanged_items_query(item_type: str) -> str:
+    """Ids among $1 whose stored embedding has the matching content hash in $2"""
+    t = ITEM_TYPES[item_type]
+    return f"""
+        SELECT c.id
+        FROM unnest($1::text[], $2::text[]) AS c(id, content_hash)
+        JOIN {t['embeddings']} e ON e.{t['key']} = c.id AND e.content_hash = c.content_hash
+    """
+
+
+def upsert_item_query(item_type: str) -> str:
+    """
+    Upsert of an item row and its embedding. Returns `inserted`: true when the item is new,
+    false when it replaced an existing row (xmax is 0 only on a freshly inserted row version).
+    Open asynchronous-ingest jobs of the item are superseded so they cannot overwrite the newer embedding.
+    """
+    t = ITEM_TYPES[item_type]
+    columns = ITEM_COLUMNS[item_type]
+    values = ", ".join(f"${n}" for n in range(1, len(columns) + 1))
+    return f"""
+        WITH item AS (
+            INSERT INTO {t['table']} ({', '.join(columns)})
+            VALUES ({values})
+            ON CONFLICT (id) DO UPDATE SET {update_columns(item_type)}
+            RETURNING id, (xmax = 0) AS inserted
+        ), embedding AS (
+            INSERT INTO {t['embeddings']} ({t['key']}, embedding, content_hash)
+            SELECT id, ${len(columns) + 1}::vector, ${len(columns) + 2} FROM item
+            ON CONFLICT ({t['key']}) DO UPDATE SET embedding=EXCLUDED.embedding, content_hash=EXCLUDED.content_hash
+        ), superseded AS (
+            UPDATE embedding_jobs SET status = 'superseded', updated_at = NOW()
+            WHERE item_type = '{item_type}' AND item_id = $1 AND status IN ('pending', 'running')
+        )
+        SELECT inserted FROM item
+    """
+
+
+def staging_table(item_type: str) -> str:
+    return f"{ITEM_TYPES[item_type]['table']}_staging"
+
+
+def create_staging_query(item_type: str) -> str:
+    """Empty temporary table with the item columns, the embedding and its content hash, dropped at commit"""
+    t = ITEM_TYPES[item_type]
+    columns = ", ".join(f"i.{column}" for column in ITEM_COLUMNS[item_type])
+    return f"""
+        CREATE TEMP TABLE {staging_table(item_type)} ON COMMIT DROP AS
+        SELECT {columns}, e.embedding, e.content_hash FROM {t['table']} i, {t['embeddings']} e
+        WITH NO DATA
+    """
+
+
+def merge_staging_query(item_type: str) -> str:
+    """
+    Upsert of every staged item and its embedding; returns `id` and `inserted` per item.
+    Items staged without an embedding (unchanged content) keep the stored one; those whose stored
+    hash no longer matches are not written and not returned. A staged row equal to the stored one
+    (and without a new embedding) is not written either, leaving updated_at and the catalog version
+    alone: it is returned with `inserted` NULL.
+    """
+    t = ITEM_TYPES[item_type]
+    columns = ", ".join(ITEM_COLUMNS[item_type])
+    stored = ", ".join(f"{t['table']}.{column}" for column in ITEM_COLUMNS[item_type][1:])
+    excluded = ", ".join(f"EXCLUDED.{column}" for column in ITEM_COLUMNS[item_type][1:])
+    return f"""
+        WITH staged AS (
+            SELECT {columns}, s.embedding IS NOT NULL AS embedded FROM {staging_table(item_type)} s
+            WHERE s.embedding IS NOT NULL
+               OR EXISTS (SELECT 1 FROM {t['embeddings']} e WHERE e.{t['key']} = s.id AND e.content_hash = s.content_hash)
+        ), item AS (
+            INSERT INTO {t['table']} ({columns})
+            SELECT {columns} FROM staged
+            ON CONFLICT (id) DO UPDATE SET {update_columns(item_type)}
+            WHERE ({stored}) IS DISTINCT FROM ({excluded})
+               OR EXISTS (SELECT 1 FROM staged WHERE staged.id = EXCLUDED.id AND staged.embedded)
+            RETURNING id, (xmax = 0) AS inserted
+        ), embedding AS (
+            INSERT INTO {t['embeddings']} ({t['key']}, embedding, content_hash)
+            SELECT id, embedding, content_hash FROM {staging_table(item_type)}
+            WHERE embedding IS NOT NULL
+            ON CONFLICT ({t['key']}) DO UPDATE SET embedding=EXCLUDED.embedding, content_hash=EXCLUDED.content_hash
+        ), superseded AS (
+            UPDATE embedding_jobs SET status = 'superseded', updated_at = NOW()
+            WHERE item_type = '{item_type}' AND item_id IN (SELECT id FROM item) AND status IN ('pending', 'running')
+        )
+        SELECT staged.id, item.inserted FROM staged LEFT JOIN item ON item.id = staged.id
+    """
+
+
+async def unchanged_items(conn, item_type: str, hashes: dict) -> set:
+    """Ids of `hashes` ({item id: content hash}) whose stored embedding has that hash"""
+    rows = await conn.fetch(unchanged_items_query(item_type), list(hashes), list(hashes.values()))
+    return {row["id"] for row in rows}
+
+
+async def upsert_items(conn, item_type: str, records: list) -> dict:
+    """
+    Batch form of upsert_item_query: `records` (item columns in ITEM_COLUMNS order, then the embedding
+    or None to keep the stored one, then the content hash; ids unique) are COPYed into a staging table
+    and merged in one statement.
+    Returns {item id: True if the item is new, False if it was updated, None if nothing differed}
+    for the items merged; items whose stored content changed meanwhile are left out
+    """
+    async with conn.transaction():
+        await conn.execute(create_staging_query(item_type))
+        # COPY quotes column names: the staging table has the lower-cased names of the unquoted columns
+        await conn.copy_records_to_table(staging_table(item_type), records=records,
+                                         columns=[column.lower() for column in ITEM_COLUMNS[item_type]] + ["embedding", "content_hash"])
+        rows = await conn.fetch(merge_staging_query(item_type))
+    return {row["id"]: row["inserted"] for row in rows}
+
+
+def enqueue_item_query(item_type: str) -> str:
+    """
+    Asynchronous-ingest form of upsert_item_query (the text to embed replaces the embedding parameter):
+    the item row is upserted, its now stale embedding deleted so search leaves the item out, its open
+    embedding jobs superseded and a new job queued (migration 010). Returns `job_id` and `inserted`.
+    """
+    t = ITEM_TYPES[item_type]
+    columns = ITEM_COLUMNS[item_type]
+    values = ", ".join(f"${n}" for n in range(1, len(columns) + 1))
+    return f"""
+        WITH item AS (
+            INSERT INTO {t['table']} ({', '.join(columns)})
+            VALUES ({values})
+            ON CONFLICT (id) DO UPDATE SET {update_columns(item_type)}
+            RETURNING id, (xmax = 0) AS inserted
+        ), stale AS (
+            DELETE FROM {t['embeddings']} WHERE {t['key']} = $1
+        ), superseded AS (
+            UPDATE embedding_jobs SET status = 'superseded', updated_at = NOW()
+            WHERE item_type = '{item_type}' AND item_id = $1 AND status IN ('pending', 'running')
+        ), job AS (
+            INSERT INTO embedding_jobs (item_type, item_id, text)
+            SELECT '{item_type}', id, ${len(columns) + 1} FROM item
+            RETURNING id
+        )
+        SELECT job.id AS job_id, item.inserted FROM job, item
+    """
+
+
+def complete_job_query(item_type: str) -> str:
+    """
+    Store the embedding of a running job ($1 = job id, $2 = embedding, $3 = content hash) and mark it done.
+    A job superseded meanwhile writes nothing: its item has a newer job. A job whose item was deleted
+    meanwhile is marked superseded and writes nothing either. Touching the item's updated_at lets
+    incremental memory-index refreshes pick up the new vector.
+    """
+    t = ITEM_TYPES[item_type]
+    return f"""
+        WITH job AS (
+            UPDATE embedding_jobs
+            SET status = CASE WHEN EXISTS (SELECT 1 FROM {t['table']} WHERE id = item_id) THEN 'done' ELSE 'superseded' END,
+                error = NULL, updated_at = NOW()
+            WHERE id = $1 AND status = 'running'
+            RETURNING item_id, status
+        ), embedding AS (
+            INSERT INTO {t['embeddings']} ({t['key']}, embedding, content_hash)
+            SELECT item_id, $2::vector, $3 FROM job WHERE status = 'done'
+            ON CONFLICT ({t['key']}) DO UPDATE SET embedding=EXCLUDED.embedding, content_hash=EXCLUDED.content_hash
+        )
+        UPDATE {t['table']} SET updated_at = NOW() WHERE id IN (SELECT item_id FROM job)
+    """
@@ -0,0 +1,105 @@
+"""
+The text embedded for a product or a service, built from its JSON the same way by every writer
+(the ingest endpoints, bulk_import.py and the RabbitMQ consumer). The content hash is taken over this
+text, so an item resent through another writer matches its stored hash and keeps its embedding.
+"""
+
+from app.config import settings
+
+
+def _text(value) -> str:
+    """An explicit null renders like a missing field, not as "None\""""
+    return "" if value is None else str(value)
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _int(value) -> int:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _attribute_value(attribute: dict):
+    """The attribute's first set value, numbers and booleans coerced as the API models coerce them"""
+    number = attribute.get("numberValue")
+    if isinstance(number, str):
+        try:
+            number = float(number)
+        except ValueError:
+            pass
+    elif isinstance(number, int) and not isinstance(number, bool):
+        number = float(number)
+    boolean = attribute.get("booleanValue")
+    if isinstance(boolean, str) and boolean.lower() in ("true", "false"):
+        boolean = boolean.lower() == "true"
+    return attribute.get("stringValue") or number or boolean or attribute.get("dateValue") or ""
+
+
+def _attributes_text(attributes) -> list:
+    """One "name: value" per attribute"""
+    return [f"{_text(a.get('name'))}: {_attribute_value(a)}" for a in attributes or []]
+
+
+def product_text(product: dict) -> str:
+    """Unified text containing all relevant product information, embedded as one vector"""
+    variants_text = ""
+    for v in product.get("variants") or []:
+        v_parts = [f"SKU: {_text(v.get('sku'))}", f"Price: {_float(v.get('price'))}", f"Stock: {_int(v.get('stock'))}"]
+        if settings.EMBEDDING_EXCLUDE_VOLATILE_FIELDS:
+            # Stock and prices stay stored and filterable, but out of the embedded text
+            v_parts = v_parts[:1]
+        attr_text = _attributes_text(v.get("attributes"))
+        if attr_text:
+            v_parts.append(" | ".join(attr_text))
+        variants_text += " | ".join(v_parts) + "\n"
+
+    product_attributes_text = "".join(f"{line}\n" for line in _attributes_text(product.get("attributes")))
+
+    base_price = "" if settings.EMBEDDING_EXCLUDE_VOLATILE_FIELDS else f"Base Price: {_float(product.get('basePrice'))}\n"
+    return f"""
+Name: {_text(product.get('name'))}
+Description: {_text(product.get('description'))}
+{base_price}Category: {_text(product.get('categoryName'))}
+Brand: {_text(product.get('brand'))}
+Tags: {', '.join(_text(tag) for tag in product.get('tags') or [])}
+Variants:
+{variants_text}
+Product Attributes:
+{product_attributes_text}
+"""
+
+
+def service_text(service: dict) -> str:
+    """Unified text containing all relevant service information, embedded as one vector"""
+    packages_text = ""
+    for p in service.get("packages") or []:
+        p_parts = [f"Package: {_text(p.get('name'))}", f"Price: {_float(p.get('price'))}",
+                   f"Description: {_text(p.get('description'))}"]
+        if settings.EMBEDDING_EXCLUDE_VOLATILE_FIELDS:
+            # Prices stay stored and filterable, but out of the embedded text
+            p_parts = [p_parts[0], p_parts[2]]
+        attr_text = _attributes_text(p.get("attributes"))
+        if attr_text:
+            p_parts.append(" | ".join(attr_text))
+        packages_text += " | ".join(p_parts) + "\n"
+
+    service_attributes_text = "".join(f"{line}\n" for line in _attributes_text(service.get("attributes")))
+
+    base_price = "" if settings.EMBEDDING_EXCLUDE_VOLATILE_FIELDS else f"Base Price: {_float(service.get('basePrice'))}\n"
+    return f"""
+Name: {_text(service.get('name'))}
+Description: {_text(service.get('description'))}
+{base_price}Category: {_text(service.get('categoryName'))}
+Tags: {', '.join(_text(tag) for tag in service.get('tags') or [])}
+Packages:
+{packages_text}
+Service Attributes:
+{service_attributes_text}
+"""
@@ -1,13 +1,22 @@
-from fastapi import FastAPI, HTTPException
-from app.db import init_db_pool, pool
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from app.db import init_db_pool, init_read_pools, close_read_pools, replica_stats, pool
 from app.ingest_product import router as ingest_product
 from app.ingest_service import router as ingest_service
 from app.search import router as search
+from app.similar import router as similar
+from app import suggest
+from app.embedding_utils import EmbeddingQueueFull, query_cache, batcher
+from app.search_cache import result_cache
+from app import vector_index, metrics, embedding_jobs
+from app.config import settings
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 import logging
 import asyncio
 import sys
 import os
+import time
 
 # Add the root directory to the Python path so we can import rabbitmq_consumer
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -31,6 +40,37 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"Failed to initialize database: {e}")
         raise
+    # Search and the other read endpoints use these; ingest stays on the primary
+    await init_read_pools()
+
+    # Warm the query embedding cache so a restarted pod starts with the hot queries
+    if settings.QUERY_EMBEDDING_CACHE_FILE:
+        try:
+            query_cache.load(settings.QUERY_EMBEDDING_CACHE_FILE)
+        except Exception as e:
+            logger.error(f"Failed to load query embedding cache: {e}")
+
+    from app.db import pool as db_pool
+    metrics.watch_pool("api", db_pool)
+    from app.db import read_pools
+    for position, replica in enumerate(read_pools):
+        metrics.watch_pool(f"replica_{position}", replica)
+
+    # An explicit default executor (same size as asyncio's) so its queue depth can be exported
+    executor = ThreadPoolExecutor()
+    asyncio.get_running_loop().set_default_executor(executor)
+    metrics.watch_queue("default_executor", lambda: metrics.executor_queue_depth(executor))
+
+    # Load the in-process vector index in the background; search uses Postgres until it is ready
+    if settings.SEARCH_BACKEND == "memory":
+        vector_index.start(db_pool)
+
+    # Typeahead suggestions are served from memory
+    suggest.start(db_pool)
+
+    # Embed items queued by asynchronous ingest (?async=true)
+    if settings.EMBEDDING_JOBS_WORKER:
+        embedding_jobs.start(db_pool)
 
     # Start RabbitMQ consumer
     try:
@@ -67,14 +107,44 @@ async def lifespan(app: FastAPI):
             await asyncio.gather(*consumer_tasks, return_exceptions=True)
         except Exception as e:
             logger.error(f"Error stopping consumers: {e}")
+
+    await vector_index.stop()
+    await suggest.stop()
+    await embedding_jobs.stop()
+    await close_read_pools()
+    logger.info(f"Query embedding cache stats: {query_cache.stats()}")
+    if settings.QUERY_EMBEDDING_CACHE_FILE:
+        try:
+            query_cache.save(settings.QUERY_EMBEDDING_CACHE_FILE)
+        except Exception as e:
+            logger.error(f"Failed to save query embedding cache: {e}")
     logger.info("Application shutdown complete")
 
 app = FastAPI(title="Homez AI Search API", lifespan=lifespan)
 
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    metrics.REQUEST_SECONDS.labels(request.method, metrics.route_template(request.scope),
+                                   str(response.status_code)).observe(time.perf_counter() - started)
+    return response
+
+# Load shedding: a full embedding queue fails fast instead of timing out
+@app.exception_handler(EmbeddingQueueFull)
+async def embedding_queue_full(request: Request, exc: EmbeddingQueueFull):
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
+
 # Include your routers
 app.include_router(ingest_product, prefix="/product")
 app.include_router(ingest_service, prefix="/service")
 app.include_router(search, prefix="/search")
+app.include_router(suggest.router, prefix="/search")
+# /product/{id}/similar and /service/{id}/similar
+app.include_router(similar)
+# /jobs/{id}: status of asynchronous ingest
+app.include_router(embedding_jobs.router)
 
 # Health check endpoint
 @app.get("/health")
@@ -85,6 +155,22 @@ async def health_check():
     try:
         async with pool.acquire() as conn:
             await conn.fetchval("SELECT 1")
-        return {"status": "healthy", "database": "connected"}
+        return {
+            "status": "healthy",
+            "database": "connected",
+            "read_replicas": replica_stats(),
+            "query_embedding_cache": query_cache.stats(),
+            "search_result_cache": result_cache.stats(),
+            "embedding_batcher": batcher.stats(),
+            "vector_index": vector_index.stats(),
+            "suggest_index": suggest.suggest_index.stats(),
+        }
     except Exception as e:
-        raise HTTPException(status_code=503, detail=f"Database connection failed: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=503, detail=f"Database connection failed: {str(e)}")
+
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
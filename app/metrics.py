@@ -0,0 +1,128 @@
+from contextlib import asynccontextmanager
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from typing import Optional
+import time
+
+# Prometheus metrics, exposed on /metrics.
+# Stage timings share one histogram labelled by operation (search, similar, ingest, consume, embedding)
+# and stage (embed, pool_wait, a search leg name such as products_vector, serialize, ...).
+
+# Seconds: from sub-millisecond cache and index lookups to cold model calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+STAGE_SECONDS = Histogram(
+    "homez_stage_duration_seconds", "Time spent in each stage of search and ingest",
+    ["operation", "stage"], buckets=LATENCY_BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "homez_http_request_duration_seconds", "HTTP request latency by route template",
+    ["method", "route", "status"], buckets=LATENCY_BUCKETS,
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "homez_embedding_batch_size", "Texts per model.encode call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+EMBEDDING_REJECTED = Counter(
+    "homez_embedding_rejected_total", "Embeddings refused with a 503 because the embedding queue was full",
+    ["priority"],
+)
+INGEST_EMBEDDINGS = Counter(
+    "homez_ingest_embeddings_total", "Ingested items by whether the model ran (embedded) or the stored embedding "
+    "was kept because the content hash was unchanged (skipped)",
+    ["operation", "outcome"],
+)
+EMBEDDING_JOBS = Counter(
+    "homez_embedding_jobs_total", "Asynchronous-ingest embedding jobs finished by this process (done, retried, failed)",
+    ["item_type", "outcome"],
+)
+SEARCH_SERVED = Counter(
+    "homez_search_served_total", "Searches by what served them (full, cache, stale_cache, reduced_recall, lexical, unavailable)",
+    ["served_by"],
+)
+CONSUMER_MESSAGES = Counter(
+    "homez_consumer_messages_total", "RabbitMQ messages handled by the consumer",
+    ["queue", "outcome"],
+)
+
+# Sampled on every scrape: name -> asyncpg pool, name -> callable returning the number of waiting tasks
+_pools = {}
+_queues = {}
+
+
+def watch_pool(name: str, pool):
+    _pools[name] = pool
+
+
+def watch_queue(name: str, depth):
+    _queues[name] = depth
+
+
+def executor_queue_depth(executor) -> int:
+    """Work items waiting for a thread of a ThreadPoolExecutor (it has no public accessor)"""
+    queue = getattr(executor, "_work_queue", None)
+    return queue.qsize() if queue is not None else 0
+
+
+def route_template(scope) -> str:
+    """
+    Path template of the route that matched, e.g. /product/{product_id}/similar, so label values
+    stay bounded; requests that matched no route share one value
+    """
+    route = scope.get("route")
+    return getattr(route, "path", "unmatched")
+
+
+def timed(operation: str, stage: str):
+    """`with timed("search", "embed"):` records the block's duration"""
+    return STAGE_SECONDS.labels(operation, stage).time()
+
+
+def observe(operation: str, stage: str, seconds: float):
+    STAGE_SECONDS.labels(operation, stage).observe(seconds)
+
+
+@asynccontextmanager
+async def acquire(pool, operation: str, stage: Optional[str] = None):
+    """
+    pool.acquire() that records how long the caller waited for a connection and,
+    with a `stage`, how long the connection was then used
+    """
+    started = time.perf_counter()
+    async with pool.acquire() as conn:
+        acquired = time.perf_counter()
+        observe(operation, "pool_wait", acquired - started)
+        yield conn
+        if stage:
+            observe(operation, stage, time.perf_counter() - acquired)
+
+
+class RuntimeCollector:
+    """Pool saturation and queue depths, read when Prometheus scrapes"""
+
+    def collect(self):
+        connections = GaugeMetricFamily("homez_db_pool_connections", "Open connections in an asyncpg pool",
+                                        labels=["pool", "state"])
+        max_connections = GaugeMetricFamily("homez_db_pool_max_connections", "Maximum size of an asyncpg pool",
+                                            labels=["pool"])
+        for name, pool in _pools.items():
+            size, idle = pool.get_size(), pool.get_idle_size()
+            connections.add_metric([name, "in_use"], size - idle)
+            connections.add_metric([name, "idle"], idle)
+            max_connections.add_metric([name], pool.get_max_size())
+        yield connections
+        yield max_connections
+
+        depth = GaugeMetricFamily("homez_queue_depth", "Texts waiting for the embedding model and tasks waiting for a worker thread",
+                                  labels=["queue"])
+        for name, queue_depth in _queues.items():
+            depth.add_metric([name], queue_depth())
+        yield depth
+
+
+REGISTRY.register(RuntimeCollector())
+
+
+def render() -> tuple:
+    """Body and content type of the /metrics response"""
+    return generate_latest(), CONTENT_TYPE_LATEST
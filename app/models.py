@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from datetime import datetime
 from typing import Optional, List, Dict, Any
 
 class VariantAttribute(BaseModel):
@@ -66,3 +67,31 @@ class Service(BaseModel):
     tags: Optional[List[str]] = []
     packages: Optional[List[Package]] = []
     attributes: Optional[List[PackageAttribute]] = []
+
+class ProductBatch(BaseModel):
+    products: List[Product]
+
+class ServiceBatch(BaseModel):
+    services: List[Service]
+
+class BatchItemStatus(BaseModel):
+    id: str
+    # created, updated, unchanged (no field differs, not written), invalid (not stored)
+    # or duplicate (a later item in the batch has the same id)
+    status: str
+    detail: Optional[str] = None
+
+class BatchIngestResponse(BaseModel):
+    # One status per submitted item, in request order
+    items: List[BatchItemStatus] = []
+
+class EmbeddingJob(BaseModel):
+    # Asynchronous ingest job (GET /jobs/{id}): pending, running, done, failed or superseded
+    id: int
+    item_type: str
+    item_id: str
+    status: str
+    attempts: int
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
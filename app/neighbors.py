@@ -0,0 +1,44 @@
+"""
+Upkeep of the precomputed similar-items lists (item_neighbors, migration 009) read by app/similar.py.
+Kept apart from the search endpoints so writers like rebuild_neighbors.py never load the embedding model.
+"""
+
+from app.config import settings
+from app import metrics
+from app.search_sql import ITEM_TYPES, apply_recall_settings, refresh_neighbors_query
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+async def refresh_neighbors(pool, item_type: str, item_id: str):
+    """
+    Recompute the precomputed neighbour lists of an item that was just (re-)embedded.
+    Lists of other items that should now include it are picked up by the next rebuild_neighbors.py run.
+    A failure is logged and never fails the ingest.
+    """
+    await refresh_neighbors_many(pool, item_type, [item_id])
+
+
+async def refresh_neighbors_many(pool, item_type: str, item_ids: list) -> bool:
+    """
+    refresh_neighbors for many items of one type: one transaction, one statement per target type
+    whatever the number of items (batch ingest sends up to INGEST_BATCH_MAX_ITEMS).
+    Returns False when the refresh failed, so rebuild_neighbors.py can report it.
+    """
+    if not settings.SIMILAR_ITEMS_PRECOMPUTED or not item_ids:
+        return True
+    try:
+        async with metrics.acquire(pool, "similar_refresh") as conn, conn.transaction():
+            # The item itself is excluded from its own list, so the index must return one more row
+            await apply_recall_settings(conn, settings.SIMILAR_ITEMS_PRECOMPUTED_K + 1)
+            await conn.execute("DELETE FROM item_neighbors WHERE source_type = $1 AND source_id = ANY($2::text[])",
+                               item_type, list(item_ids))
+            for target_type in ITEM_TYPES:
+                sql, args = refresh_neighbors_query(item_type, target_type, item_ids, settings.SIMILAR_ITEMS_PRECOMPUTED_K)
+                await conn.execute(sql, *args)
+    except Exception as e:
+        described = f"{item_type[:-1]} {item_ids[0]}" if len(item_ids) == 1 else f"{len(item_ids)} {item_type}"
+        logger.warning(f"Could not refresh neighbors of {described}: {e}")
+        return False
+    return True
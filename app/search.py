@@ -1,10 +1,26 @@
-from fastapi import APIRouter, Query
-from app.embedding_utils import embed_text
-from pydantic import BaseModel
-from typing import List
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from app.embedding_utils import EmbeddingQueueFull, embed_query, embed_queries, normalize_query
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional, NamedTuple, Literal
 from app.models import Product, Service
+from app.config import settings
+from app import metrics, search_cache, vector_index
+from app.search_sql import (
+    ITEM_TYPES, FILTER_SQL, BATCH_QUERY_COLUMNS,
+    RESULT_FIELDS, vector_query, unified_vector_query, lexical_query, batch_vector_query, rescore_ids_query,
+    active_filters, supports_filters, ann_limit, used_indexes, seq_scanned_tables,
+    effective_ef_search, apply_recall_settings,
+)
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
 import json
 import logging
+import random
+import re
+import time
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -13,84 +29,629 @@ logger.setLevel(logging.INFO)
 class SearchResultItem(BaseModel):
     id: str
     similarity: float
+    # Item columns requested with `fields=`, e.g. {"name": ..., "basePrice": ...}
+    fields: Optional[Dict[str, Any]] = None
+
+class UnifiedSearchResultItem(SearchResultItem):
+    type: Literal["product", "service"]
 
 class SearchResponse(BaseModel):
     products: List[SearchResultItem] = []
     services: List[SearchResultItem] = []
+    # mode=unified: one list across products and services, best first (products/services stay empty)
+    results: List[UnifiedSearchResultItem] = []
+    # Ranking that produced the results: vector, lexical, hybrid, identifier (exact-term fast path)
+    # or similar (neighbours of a stored item)
+    ranking: str = "vector"
+    # Pass as `cursor` (with the same query and filters) to get the next page; None on the last page
+    next_cursor: Optional[str] = None
+    # debug=true only: stage timings, candidate counts and the query plan of each SQL leg
+    debug: Optional[Dict[str, Any]] = None
+    # What produced the results: full, cache, stale_cache (the search ran out of time or failed and an
+    # earlier result was reused), reduced_recall (vector legs retried with lower ANN recall) or
+    # lexical (full-text/trigram matching stood in for the vector search)
+    served_by: str = "full"
+
+
+class SearchFilters(BaseModel):
+    """Optional filters, applied inside the search SQL. Brand and stock only exist on products,
+    so setting them excludes services from the results."""
+    category: Optional[str] = Field(None, description="Exact categoryName")
+    brand: Optional[str] = Field(None, description="Exact product brand")
+    min_price: Optional[float] = Field(None, ge=0, description="Minimum basePrice")
+    max_price: Optional[float] = Field(None, ge=0, description="Maximum basePrice")
+    in_stock: Optional[bool] = Field(None, description="Only products with (true) or without (false) a variant in stock")
+
+
+class BatchSearchQuery(SearchFilters):
+    query: str
+    limit: int = Field(20, ge=1, le=1000, description="Number of results per type")
+
+
+class BatchSearchRequest(BaseModel):
+    queries: List[BatchSearchQuery]
+
+
+class BatchSearchResponse(BaseModel):
+    # One response per query, in request order
+    results: List[SearchResponse] = []
+
+
+class SearchLeg(NamedTuple):
+    """One SQL statement of a search request, e.g. the products or the services lookup"""
+    name: str
+    sql: str
+    args: tuple
+    # Rows the ANN index must return when more than the limit (over-fetch for quantized rescoring)
+    ann_limit: Optional[int] = None
 
 
 router = APIRouter()
 
-@router.get("/", response_model=SearchResponse)
-async def search(query: str = Query(..., description="Search query"),
-                 limit: int = Query(20, description="Number of results per type")):
+# Share of a search's time budget held back for the degraded attempts when the full-quality one runs out
+FALLBACK_BUDGET_SHARE = 0.25
+# A degraded attempt is only started with at least this much of the budget left
+MIN_RETRY_SECONDS = 0.02
+# Recall settings of the reduced-recall retry (hnsw.ef_search is still raised to the limit)
+DEGRADED_EF_SEARCH = 1
+DEGRADED_PROBES = 1
+
+def remaining_seconds(deadline: Optional[float]) -> Optional[float]:
+    """Time left before `deadline` (a time.perf_counter() value); None without a deadline"""
+    return None if deadline is None else max(deadline - time.perf_counter(), 0.001)
+
+def has_time_left(deadline: Optional[float]) -> bool:
+    return deadline is None or deadline - time.perf_counter() >= MIN_RETRY_SECONDS
+
+async def run_search_legs(pool, legs: List[SearchLeg], limit: int,
+                          ef_search: Optional[int] = None, probes: Optional[int] = None, filtered: bool = False,
+                          operation: str = "search", deadline: Optional[float] = None):
+    """
+    Run the legs concurrently, each on its own pooled connection.
+    At most SEARCH_MAX_CONNECTIONS_PER_REQUEST legs hold a connection at the same time.
+    Returns `{leg name: rows}` and `{leg name: elapsed ms}`; a failed leg is logged and yields no rows.
+    The pool wait and each statement are recorded in the `operation` stage metrics.
+    With a `deadline` (a time.perf_counter() value) legs still waiting or running then are cancelled and fail.
+    """
+    from app.db import report_failure
+
+    fanout = asyncio.Semaphore(max(1, settings.SEARCH_MAX_CONNECTIONS_PER_REQUEST))
+
+    async def run(leg: SearchLeg):
+        async with fanout:
+            started = time.perf_counter()
+            async with metrics.acquire(pool, operation) as conn, conn.transaction():
+                statement_started = time.perf_counter()
+                # Recall settings are transaction-local, so they never leak to other requests
+                await apply_recall_settings(conn, max(limit, leg.ann_limit or 0), ef_search, probes, filtered,
+                                            remaining_seconds(deadline))
+                rows = await conn.fetch(leg.sql, *leg.args)
+                metrics.observe(operation, leg.name, time.perf_counter() - statement_started)
+            return rows, (time.perf_counter() - started) * 1000
+
+    outcomes = await asyncio.gather(*(asyncio.wait_for(run(leg), remaining_seconds(deadline)) for leg in legs),
+                                    return_exceptions=True)
+
+    rows_by_leg = {}
+    timings = {}
+    for leg, outcome in zip(legs, outcomes):
+        if isinstance(outcome, BaseException):
+            # If there's any database error (e.g., tables don't exist yet),
+            # return an empty list for this leg instead of throwing an error
+            logger.warning(f"Database error during search ({leg.name}): {type(outcome).__name__}: {outcome}")
+            report_failure(pool, outcome)
+            rows_by_leg[leg.name] = []
+            continue
+        rows_by_leg[leg.name], timings[leg.name] = outcome
+    return rows_by_leg, timings
+
+async def explain_legs(pool, legs: List[SearchLeg], limit: int,
+                       ef_search: Optional[int] = None, probes: Optional[int] = None, filtered: bool = False) -> dict:
     """
-    Search both products and services using semantic embeddings + cosine similarity
-    Returns top `limit` products and top `limit` services
+    EXPLAIN (ANALYZE, BUFFERS) each leg under the same recall settings it ran with (debug=true).
+    ANALYZE executes the statement again, one leg at a time.
     """
+    explained = {}
+    for leg in legs:
+        rows_needed = max(limit, leg.ann_limit or 0)
+        try:
+            async with pool.acquire() as conn, conn.transaction():
+                await apply_recall_settings(conn, rows_needed, ef_search, probes, filtered)
+                plan = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {leg.sql}", *leg.args)
+        except Exception as e:
+            explained[leg.name] = {"error": str(e)}
+            continue
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        explained[leg.name] = {
+            "ann_limit": rows_needed,
+            "ef_search": effective_ef_search(rows_needed, ef_search),
+            "indexes": sorted(used_indexes(plan)),
+            "seq_scans": sorted(seq_scanned_tables(plan)),
+            "execution_ms": plan[0].get("Execution Time"),
+            "plan": plan,
+        }
+    return explained
+
+def check_debug_token(token: Optional[str]):
+    """debug=true exposes query plans and timings: only for callers presenting SEARCH_DEBUG_TOKEN"""
+    if not settings.SEARCH_DEBUG_TOKEN:
+        raise HTTPException(status_code=403, detail="Search debug mode is disabled (SEARCH_DEBUG_TOKEN is not set)")
+    if token is None or not hmac.compare_digest(token.encode(), settings.SEARCH_DEBUG_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Debug-Token")
+
+def server_timing_header(timings: dict) -> str:
+    """Format per-leg timings for the Server-Timing response header"""
+    return ", ".join(f"{name};dur={elapsed:.1f}" for name, elapsed in timings.items())
+
+# A single token with a digit and only SKU/barcode characters, e.g. "WH-001-BLK" or "1234567890123"
+IDENTIFIER_PATTERN = re.compile(r"^(?=.*\d)[A-Za-z0-9][A-Za-z0-9\-_./]{3,}$")
+
+def looks_like_identifier(query: str) -> bool:
+    return bool(IDENTIFIER_PATTERN.match(query.strip()))
+
+def reciprocal_rank_fusion(ranked_lists: list, limit: int, k: Optional[int] = None) -> list:
+    """
+    Fuse ranked row lists with RRF: score(id) = sum of 1 / (k + rank) over the lists containing it.
+    Returns up to `limit` (row, fused score) pairs, best first.
+    """
+    k = k or settings.RRF_K
+    scores = {}
+    rows = {}
+    for ranked in ranked_lists:
+        for rank, row in enumerate(ranked, start=1):
+            scores[row["id"]] = scores.get(row["id"], 0.0) + 1.0 / (k + rank)
+            rows.setdefault(row["id"], row)
+    best = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [(rows[item_id], scores[item_id]) for item_id in best]
+
+def lexical_legs(query: str, limit: int, filters: Optional[SearchFilters] = None, fields: List[str] = ()) -> List[SearchLeg]:
+    return [SearchLeg(f"{item_type}_lexical", *lexical_query(item_type, query, limit, filters, fields))
+            for item_type in ITEM_TYPES if supports_filters(item_type, filters)]
+
+def vector_legs(query_embedding, limit: int, filters: Optional[SearchFilters] = None,
+                page: Optional[dict] = None, fields: List[str] = ()) -> List[SearchLeg]:
+    """Vector legs; with a decoded cursor `page` each type continues after its last row and exhausted types are skipped"""
+    legs = []
+    for item_type in ITEM_TYPES:
+        if not supports_filters(item_type, filters):
+            continue
+        after = None
+        rows_needed = ann_limit(item_type, limit)
+        if page is not None:
+            if page["after"].get(item_type) is None:
+                continue
+            after = tuple(page["after"][item_type])
+            if settings.ANN_ITERATIVE_SCAN == "off":
+                # Without iterative scans the index must return the skipped rows as well
+                rows_needed += page["served"]
+        legs.append(SearchLeg(f"{item_type}_vector", *vector_query(item_type, query_embedding, limit, filters, after=after, fields=fields),
+                              ann_limit=rows_needed))
+    return legs
+
+def unified_vector_leg(query_embedding, limit: int, filters: Optional[SearchFilters] = None,
+                       fields: List[str] = ()) -> SearchLeg:
+    """One leg ranking products and services together, `limit` rows in total"""
+    item_types = [item_type for item_type in ITEM_TYPES if supports_filters(item_type, filters)]
+    return SearchLeg("unified_vector", *unified_vector_query(item_types, query_embedding, limit, filters, fields),
+                     ann_limit=max(ann_limit(item_type, limit) for item_type in item_types))
 
-    # 1️⃣ Generate a single embedding for the query
-    query_embedding = await embed_text(query)
-    
-    # Import pool inside the function to ensure it's initialized
-    from app.db import pool
+def unified_result_items(rows_by_leg: dict, results: dict, limit: int,
+                         fields: List[str] = ()) -> List[UnifiedSearchResultItem]:
+    """The single ranked list of mode=unified: from the unified leg, or else merged from the per-type results by score"""
+    if "unified_vector" in rows_by_leg:
+        return [UnifiedSearchResultItem(type=row["item_type"][:-1], id=row["id"], similarity=row["score"],
+                                        fields=result_fields(row, fields))
+                for row in rows_by_leg["unified_vector"]]
+    ranked = sorted(((item_type, item) for item_type, items in results.items() for item in items),
+                    key=lambda entry: entry[1].similarity, reverse=True)
+    return [UnifiedSearchResultItem(type=item_type[:-1], **item.dict()) for item_type, item in ranked[:limit]]
 
-    # Initialize empty lists for results
-    products = []
-    services = []
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """Validate the comma-separated `fields` parameter"""
+    if not fields:
+        return []
+    requested = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in requested if field not in RESULT_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown}; available: {', '.join(RESULT_FIELDS)}")
+    return requested
 
+def result_fields(row, fields: List[str]) -> Optional[Dict[str, Any]]:
+    return {field: row[field] for field in fields} if fields else None
+
+# Position before the first row: every (distance, id) sorts after it
+CURSOR_START = [-1.0, ""]
+
+def filters_fingerprint(filters: SearchFilters) -> str:
+    return hashlib.sha1(json.dumps(vars(filters), sort_keys=True).encode()).hexdigest()[:16]
+
+def encode_cursor(query: str, filters: SearchFilters, after: dict, served: int) -> str:
+    """
+    Opaque next-page cursor: the query embedding cache key, the filters it applies to,
+    the number of rows served so far and the (distance, id) of the last row per type
+    (None once a type has no more rows).
+    """
+    state = {"key": normalize_query(query), "filters": filters_fingerprint(filters), "after": after, "served": served}
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(",", ":")).encode()).decode()
+
+def decode_cursor(cursor: str, query: str, filters: SearchFilters) -> dict:
     try:
-        async with pool.acquire() as conn:
-
-            # 2️⃣ Search products (single cosine similarity using pgvector)
-            products_rows = await conn.fetch("""
-                SELECT p.*, 1 - (pe.embedding <=> $1) AS score
-                FROM product_embeddings pe
-                JOIN products p ON pe.product_id = p.id
-                ORDER BY 1 - (embedding <=> $1) DESC
-                LIMIT $2
-            """, query_embedding, limit)
-
-            # 3️⃣ Search services (single cosine similarity using pgvector)
-            services_rows = await conn.fetch("""
-                SELECT s.*, 1 - (se.embedding <=> $1) AS score
-                FROM service_embeddings se
-                JOIN services s ON se.service_id = s.id
-                ORDER BY 1 - (embedding <=> $1) DESC
-                LIMIT $2
-            """, query_embedding, limit)
-
-        # 4️⃣ Convert DB rows to simplified search result items
-        products = []
-        for row in products_rows:
-            row_dict = dict(row)
-            # Get the score and ID
-            score = row_dict.get('score', 0)
-            product_id = row_dict.get('id', 'unknown')
-            logger.info(f"Product '{row_dict.get('name', 'Unknown')}' score: {score}")
-            products.append(SearchResultItem(id=product_id, similarity=score))
-        
-        services = []
-        for row in services_rows:
-            row_dict = dict(row)
-            # Get the score and ID
-            score = row_dict.get('score', 0)
-            service_id = row_dict.get('id', 'unknown')
-            logger.info(f"Service '{row_dict.get('name', 'Unknown')}' score: {score}")
-            services.append(SearchResultItem(id=service_id, similarity=score))
-
-    except Exception as e:
-        # If there's any database error (e.g., tables don't exist yet),
-        # return empty arrays instead of throwing an error
-        logger.warning(f"Database error during search: {e}")
-        # Continue with empty arrays
-
-    # 5️⃣ Log results and return typed response
-    # Will return empty arrays if no items found or if there was a database error
-    logger.info(f"Search completed. Products found: {len(products)}, Services found: {len(services)}")
-    if products:
-        logger.info(f"Top product IDs: {[p.id for p in products[:5]]}")
-    if services:
-        logger.info(f"Top service IDs: {[s.id for s in services[:5]]}")
-    
-    return SearchResponse(products=products, services=services)
\ No newline at end of file
+        page = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        valid = (isinstance(page, dict) and isinstance(page.get("after"), dict) and isinstance(page.get("served"), int)
+                 and all(position is None or (isinstance(position, list) and len(position) == 2
+                                              and isinstance(position[0], (int, float)) and isinstance(position[1], str))
+                         for position in page["after"].values()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        valid = False
+    if not valid:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if page.get("key") != normalize_query(query) or page.get("filters") != filters_fingerprint(filters):
+        raise HTTPException(status_code=400, detail="Cursor does not belong to this query and filters")
+    return page
+
+def next_page_cursor(query: str, filters: SearchFilters, rows_by_leg: dict, failed: set,
+                     limit: int, page: Optional[dict]) -> Optional[str]:
+    """Cursor for the page after this one, or None when no type can have more rows"""
+    after = {}
+    for item_type in ITEM_TYPES:
+        previous = page["after"].get(item_type) if page is not None else CURSOR_START
+        leg_name = next((name for name in rows_by_leg if name.startswith(f"{item_type}_")), None)
+        if leg_name is None or previous is None:
+            # Type excluded by the filters or already exhausted
+            after[item_type] = None
+        elif leg_name in failed:
+            # The leg failed: retry the same page of this type next time
+            after[item_type] = previous
+        else:
+            rows = rows_by_leg[leg_name][:limit]
+            after[item_type] = [rows[-1]["distance"], rows[-1]["id"]] if rows and len(rows) == limit else None
+    if not any(position is not None for position in after.values()):
+        return None
+    served = (page["served"] if page is not None else 0) + limit
+    return encode_cursor(query, filters, after, served)
+
+# Extra candidates taken from the memory index to make up for items deleted since its last refresh
+MEMORY_INDEX_OVERFETCH = 10
+
+def use_memory_index(ranking: str, filtered: bool) -> bool:
+    """Unfiltered vector searches are ranked in-process when SEARCH_BACKEND=memory and the index is loaded"""
+    return settings.SEARCH_BACKEND == "memory" and ranking == "vector" and not filtered and vector_index.is_ready()
+
+async def memory_vector_search(pool, query_embedding, limit: int, fields: List[str] = ()):
+    """
+    Rank with the in-process vector index, then rescore its candidates with the exact distance
+    in one primary-key lookup, which also drops ids deleted since the last refresh.
+    Returns `{leg name: rows}` and `{stage: elapsed ms}` like run_search_legs.
+    """
+    started = time.perf_counter()
+    ranked = await vector_index.search(query_embedding, limit + MEMORY_INDEX_OVERFETCH)
+    timings = {"memory_index": (time.perf_counter() - started) * 1000}
+
+    started = time.perf_counter()
+    async with metrics.acquire(pool, "search") as conn:
+        rows = await conn.fetch(rescore_ids_query(ranked, fields), query_embedding,
+                                *([item_id for item_id, _ in pairs] for pairs in ranked.values()))
+    timings["hydrate"] = (time.perf_counter() - started) * 1000
+    for stage in timings:
+        metrics.observe("search", stage, timings[stage] / 1000)
+
+    # Same (distance, id) order as the Postgres legs, so cursors continue seamlessly there
+    rows_by_leg = {f"{item_type}_memory": [] for item_type in ranked}
+    for row in sorted(rows, key=lambda row: (row["distance"], row["id"])):
+        rows_by_leg[f"{row['item_type']}_memory"].append({**dict(row), "score": 1 - row["distance"]})
+    return {name: rows[:limit] for name, rows in rows_by_leg.items()}, timings
+
+def to_result_items(item_type: str, scored_rows: list, fields: List[str] = ()) -> List[SearchResultItem]:
+    """Convert (row, score) pairs to simplified search result items"""
+    return [SearchResultItem(id=row["id"], similarity=score, fields=result_fields(row, fields))
+            for row, score in scored_rows]
+
+def log_search(elapsed_ms: float, **details):
+    """
+    One structured (JSON) log line for a sample of searches, SEARCH_LOG_SAMPLE_RATE of them,
+    plus every search slower than SEARCH_SLOW_LOG_MS
+    """
+    if elapsed_ms >= settings.SEARCH_SLOW_LOG_MS or random.random() < settings.SEARCH_LOG_SAMPLE_RATE:
+        logger.info(json.dumps({"event": "search", "elapsed_ms": round(elapsed_ms, 1), **details}, default=str))
+
+@router.get("/", response_model=SearchResponse)
+async def search(response: Response,
+                 query: str = Query(..., description="Search query"),
+                 limit: int = Query(20, ge=1, le=1000, description="Number of results per type"),
+                 ranking: Literal["vector", "lexical", "hybrid"] = Query("vector", description="vector (embeddings), lexical (full-text/trigram) or hybrid (reciprocal rank fusion of both)"),
+                 ef_search: Optional[int] = Query(None, ge=1, le=1000, description="HNSW recall override (hnsw.ef_search)"),
+                 probes: Optional[int] = Query(None, ge=1, le=1000, description="IVFFlat recall override (ivfflat.probes)"),
+                 cursor: Optional[str] = Query(None, description="next_cursor of the previous page (vector ranking only)"),
+                 mode: Literal["split", "unified"] = Query("split", description="split (top `limit` products and top `limit` services) or unified (one list of `limit` results across both)"),
+                 fields: Optional[str] = Query(None, description="Comma-separated item fields to return inline: " + ", ".join(RESULT_FIELDS)),
+                 deadline_ms: Optional[int] = Query(None, ge=50, le=60000, description="Time budget in ms (default SEARCH_DEADLINE_MS)"),
+                 debug: bool = Query(False, description="Return stage timings, candidate counts and EXPLAIN ANALYZE of each SQL leg (requires X-Debug-Token)"),
+                 x_debug_token: Optional[str] = Header(None, description="SEARCH_DEBUG_TOKEN, required with debug=true"),
+                 filters: SearchFilters = Depends()):
+    """
+    Search both products and services using semantic embeddings + cosine similarity,
+    full-text/trigram matching, or a reciprocal rank fusion of the two.
+    Returns top `limit` products and top `limit` services matching the optional filters.
+    Vector results are paged with `next_cursor`: each page continues after the last row of the
+    previous one (keyset pagination), so deep pages cost the same as the first.
+    With mode=unified the top `limit` results across both types are returned as one list in `results`.
+    With debug=true (and a valid X-Debug-Token) the cache is bypassed and `debug` explains the search.
+    Each search has a time budget; when it runs out (or the vector search fails) a stale cached result,
+    a lower-recall vector search or lexical matching is served instead, as reported by `served_by`.
+    """
+
+    # Reads go to a read replica when DATABASE_READ_URL is set (else the primary)
+    from app.db import read_pool, pool as primary_pool
+    pool = read_pool()
+
+    started = time.perf_counter()
+    if debug:
+        check_debug_token(x_debug_token)
+    fields = parse_fields(fields)
+    page = None
+    if cursor is not None:
+        if ranking != "vector" or mode != "split":
+            raise HTTPException(status_code=400, detail="Cursor pagination is only supported for vector ranking in split mode")
+        page = decode_cursor(cursor, query, filters)
+
+    # Serve identical searches from the result cache while the catalog is unchanged.
+    # The version is read before searching so a concurrent write makes this result uncacheable.
+    cache_key = search_cache.make_key(query, limit=limit, ranking=ranking, ef_search=ef_search, probes=probes,
+                                      cursor=cursor, mode=mode, fields=tuple(fields), **vars(filters))
+    filtered = bool(active_filters(filters))
+    # Always from the primary: a standby sees catalog_version_seq advance only every 32 nextval calls
+    catalog_version = await search_cache.current_version(primary_pool)
+    cached = search_cache.result_cache.get(cache_key, catalog_version) if not debug else None
+    if cached is not None:
+        response.headers["Server-Timing"] = "cache;desc=hit"
+        log_search((time.perf_counter() - started) * 1000, query=query, ranking=ranking, mode=mode, cache="hit")
+        metrics.SEARCH_SERVED.labels("cache").inc()
+        return cached.model_copy(update={"served_by": "cache"})
+
+    # Time budget: the full-quality attempt must finish by `primary_deadline`, leaving the rest of the
+    # budget to the degradation ladder (stale cached result, lower ANN recall, lexical-only)
+    budget_ms = deadline_ms or settings.SEARCH_DEADLINE_MS
+    deadline = started + budget_ms / 1000 if budget_ms else None
+    primary_deadline = deadline - budget_ms / 1000 * FALLBACK_BUDGET_SHARE if deadline else None
+    served_by = "full"
+
+    rows_by_leg = None
+    # Legs that failed, leaving the results partial
+    failed = set()
+    # Stages before the SQL legs, e.g. the query embedding
+    stage_timings = {}
+    # Arguments of the last run_search_legs call, explained again with debug=true
+    executed = None
+    # Vector rows and failed vector legs when lexical results replaced them (the cursor then retries that page)
+    vector_attempt = None
+    embedding_unavailable = False
+
+    # 1️⃣ Exact identifiers (SKUs, barcodes) are answered lexically without running the model
+    # (later pages of a vector search never took this path)
+    if settings.SEARCH_IDENTIFIER_FAST_PATH and page is None and looks_like_identifier(query):
+        legs = lexical_legs(query, limit, filters, fields)
+        rows_by_leg, timings = await run_search_legs(pool, legs, limit, ef_search, probes, filtered,
+                                                     deadline=primary_deadline)
+        executed = (legs, limit, filtered)
+        if any(rows_by_leg.values()):
+            ranking = "identifier"
+            failed = set(rows_by_leg) - set(timings)
+        else:
+            rows_by_leg = None
+
+    if rows_by_leg is None:
+        # Hybrid ranking fuses a deeper candidate list from each leg
+        candidates = max(limit, settings.HYBRID_CANDIDATES) if ranking == "hybrid" else limit
+        legs = []
+        query_embedding = None
+        if ranking != "lexical":
+            # 2️⃣ Generate a single embedding for the query (cached for repeated queries,
+            # so later pages normally reuse the embedding of the first one)
+            embed_started = time.perf_counter()
+            try:
+                query_embedding = await asyncio.wait_for(embed_query(query), remaining_seconds(primary_deadline))
+            except asyncio.TimeoutError:
+                embedding_unavailable = True
+                logger.warning(f"Query embedding did not finish within the search budget of {budget_ms:.0f} ms")
+            except EmbeddingQueueFull as e:
+                # Shed at once instead of queueing behind the backlog: the ladder below needs no model call
+                embedding_unavailable = True
+                logger.warning(str(e))
+            stage_timings["embed"] = (time.perf_counter() - embed_started) * 1000
+            metrics.observe("search", "embed", stage_timings["embed"] / 1000)
+
+        if query_embedding is not None:
+            # Rank in-process when the memory index serves this search; Postgres only rescores the top ids
+            if page is None and use_memory_index(ranking, filtered):
+                try:
+                    rows_by_leg, timings = await memory_vector_search(pool, query_embedding, limit, fields)
+                    executed = None
+                except Exception as e:
+                    logger.warning(f"Memory index search failed, falling back to Postgres: {e}")
+
+            if rows_by_leg is None and mode == "unified" and ranking == "vector":
+                # One statement over both embedding tables returning `limit` rows in total
+                legs.append(unified_vector_leg(query_embedding, limit, filters, fields))
+            elif rows_by_leg is None:
+                legs += vector_legs(query_embedding, candidates, filters, page, fields)
+        if ranking != "vector":
+            legs += lexical_legs(query, candidates, filters, fields)
+
+        # 3️⃣ Search products and services in parallel on separate connections
+        # Later pages skip rows with a keyset filter, which needs an iterative index scan
+        if rows_by_leg is None:
+            rows_by_leg, timings = await run_search_legs(pool, legs, candidates, ef_search, probes,
+                                                         filtered or page is not None, deadline=primary_deadline)
+            executed = (legs, candidates, filtered or page is not None)
+            failed = set(rows_by_leg) - set(timings)
+
+        # Degradation ladder when the query could not be embedded (in time) or vector legs timed out / failed.
+        # Reduced recall comes before lexical matching, unlike the cached > lexical > reduced recall order
+        # first asked for: when only the index scan timed out, a faster scan keeps the semantic ranking.
+        # Without an embedding there is nothing to retry and the ladder goes from the cache to lexical.
+        failed_vector = [leg for leg in legs if leg.name in failed and leg.name.endswith("_vector")]
+        if embedding_unavailable or failed_vector:
+            # A replica evicted for losing its connection is not picked again
+            pool = read_pool()
+
+            # a) The last result computed for this exact search, even if the catalog changed since
+            stale = search_cache.result_cache.get_stale(cache_key) if not debug else None
+            if stale is not None:
+                metrics.SEARCH_SERVED.labels("stale_cache").inc()
+                timing = server_timing_header({**stage_timings, **timings})
+                response.headers["Server-Timing"] = f"{timing}, cache;desc=stale" if timing else "cache;desc=stale"
+                log_search((time.perf_counter() - started) * 1000, query=query, ranking=ranking, mode=mode, cache="stale")
+                return stale.model_copy(update={"served_by": "stale_cache"})
+
+            # b) Retry the failed vector legs with the lowest ANN recall settings, in half of the time left
+            if failed_vector and has_time_left(deadline):
+                retry_deadline = time.perf_counter() + remaining_seconds(deadline) / 2 if deadline else None
+                retry_rows, retry_timings = await run_search_legs(pool, failed_vector, candidates, DEGRADED_EF_SEARCH,
+                                                                  DEGRADED_PROBES, filtered or page is not None,
+                                                                  deadline=retry_deadline)
+                if retry_timings:
+                    served_by = "reduced_recall"
+                    rows_by_leg.update({name: retry_rows[name] for name in retry_timings})
+                    timings.update({f"{name}_retry": elapsed for name, elapsed in retry_timings.items()})
+                    failed -= set(retry_timings)
+                    failed_vector = [leg for leg in failed_vector if leg.name not in retry_timings]
+
+            # c) Lexical matching (no model call) for the types still without vector results
+            if embedding_unavailable or failed_vector:
+                types = {item_type for item_type in ITEM_TYPES
+                         if embedding_unavailable or any(leg.name in (f"{item_type}_vector", "unified_vector") for leg in failed_vector)}
+                fallback = [leg for leg in lexical_legs(query, limit, filters, fields)
+                            if leg.name[:-len("_lexical")] in types and leg.name not in rows_by_leg]
+                if fallback and has_time_left(deadline):
+                    fallback_rows, fallback_timings = await run_search_legs(pool, fallback, limit, ef_search, probes,
+                                                                            filtered, deadline=deadline)
+                    rows_by_leg.update(fallback_rows)
+                    timings.update(fallback_timings)
+                    failed |= set(fallback_rows) - set(fallback_timings)
+                if any(name.endswith("_lexical") and name not in failed for name in rows_by_leg):
+                    served_by = "lexical"
+                    if embedding_unavailable:
+                        skipped = {f"{item_type}_vector": [] for item_type in ITEM_TYPES if supports_filters(item_type, filters)}
+                        vector_attempt = (skipped, set(skipped))
+                    else:
+                        vector_attempt = ({name: rows for name, rows in rows_by_leg.items() if name.endswith("_vector")},
+                                          {leg.name for leg in failed_vector})
+                    for leg in failed_vector:
+                        del rows_by_leg[leg.name]
+                        failed.discard(leg.name)
+
+    # Nothing could be searched in time: an honest 503 rather than empty lists
+    if not set(rows_by_leg) - failed and (failed or embedding_unavailable):
+        metrics.SEARCH_SERVED.labels("unavailable").inc()
+        raise HTTPException(status_code=503, detail="Search is overloaded or could not be completed within its time budget",
+                            headers={"Retry-After": str(EmbeddingQueueFull.retry_after)})
+    metrics.SEARCH_SERVED.labels(served_by).inc()
+
+    # 4️⃣ Rank each result type, fusing the vector and lexical legs in hybrid mode
+    serialize_started = time.perf_counter()
+    results = {}
+    for item_type in ITEM_TYPES:
+        ranked_lists = [rows for name, rows in rows_by_leg.items() if name.startswith(f"{item_type}_")]
+        if len(ranked_lists) > 1:
+            scored_rows = reciprocal_rank_fusion(ranked_lists, limit)
+        else:
+            # No list when the filters exclude this type
+            scored_rows = [(row, row["score"]) for ranked in ranked_lists for row in ranked[:limit]]
+        results[item_type] = to_result_items(item_type, scored_rows, fields)
+    unified = []
+    if mode == "unified":
+        unified = unified_result_items(rows_by_leg, results, limit, fields)
+        results = {item_type: [] for item_type in ITEM_TYPES}
+    products = results["products"]
+    services = results["services"]
+
+    # 5️⃣ Build the typed response (empty arrays if no items found or if there was a database error)
+    result = SearchResponse(products=products, services=services, results=unified, ranking=ranking, served_by=served_by)
+    if ranking == "vector" and mode == "split":
+        # After a lexical fallback the cursor asks for the same vector page again
+        result.next_cursor = next_page_cursor(query, filters, *(vector_attempt or (rows_by_leg, failed)), limit, page)
+    metrics.observe("search", "serialize", time.perf_counter() - serialize_started)
+
+    timings = {**stage_timings, **timings}
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    response.headers["Server-Timing"] = server_timing_header(timings)
+    log_search(elapsed_ms, query=query, ranking=ranking, mode=mode, cache="miss", served_by=served_by,
+               products=len(products), services=len(services), results=len(unified), failed=sorted(failed),
+               timings_ms={name: round(elapsed, 1) for name, elapsed in timings.items()},
+               top_products=[p.id for p in products[:5]], top_services=[s.id for s in services[:5]])
+
+    if debug:
+        # Debug responses are never cached; the plans are collected after the timings above
+        explained = {}
+        if executed:
+            explained_legs, explained_limit, explained_filtered = executed
+            explained = await explain_legs(pool, explained_legs, explained_limit, ef_search=ef_search, probes=probes,
+                                           filtered=explained_filtered)
+        result.debug = {
+            "total_ms": round(elapsed_ms, 1),
+            "timings_ms": {name: round(elapsed, 1) for name, elapsed in timings.items()},
+            # Rows each leg returned before ranking (hybrid fuses up to HYBRID_CANDIDATES per leg)
+            "candidates": {name: len(rows) for name, rows in rows_by_leg.items()},
+            "failed": sorted(failed),
+            "backend": "memory" if executed is None and ranking == "vector" else "postgres",
+            "legs": explained,
+        }
+    # Partial (a leg failed) and degraded results are not cached
+    elif not failed and served_by == "full":
+        search_cache.result_cache.put(cache_key, catalog_version, result)
+    return result
+
+
+def vector_text(embedding) -> str:
+    """pgvector text form of an embedding, e.g. [0.1,0.2]"""
+    return "[" + ",".join(str(value) for value in embedding) + "]"
+
+@router.post("/batch", response_model=BatchSearchResponse)
+async def search_batch(request: BatchSearchRequest,
+                       ef_search: Optional[int] = Query(None, ge=1, le=1000, description="HNSW recall override (hnsw.ef_search)"),
+                       probes: Optional[int] = Query(None, ge=1, le=1000, description="IVFFlat recall override (ivfflat.probes)")):
+    """
+    Vector search for many queries at once:
+    - All query embeddings are computed together, in batches of EMBEDDING_MAX_BATCH_SIZE (cached queries are reused)
+    - Products and services for every query are fetched in one SQL round trip
+    Results are returned in the order of the request's `queries`
+    """
+    queries = request.queries
+    if not queries:
+        return BatchSearchResponse()
+    if len(queries) > settings.SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {settings.SEARCH_BATCH_MAX_QUERIES} queries per batch")
+
+    # Reads go to a read replica when DATABASE_READ_URL is set (else the primary)
+    from app.db import read_pool
+    pool = read_pool()
+
+    # 1️⃣ Embed every query at search priority (503 when the embedding queue is full)
+    with metrics.timed("batch_search", "embed"):
+        embeddings = await embed_queries([q.query for q in queries])
+
+    # 2️⃣ One LATERAL lookup per query and result type, all in a single statement
+    # Each unnest() column is passed as an array with one entry per query
+    columns = {
+        "embedding": [vector_text(embedding) for embedding in embeddings],
+        "lim": [q.limit for q in queries],
+    }
+    args = [columns[name] if name in columns else [getattr(q, name) for q in queries]
+            for name in BATCH_QUERY_COLUMNS]
+    filtered = any(getattr(q, name) is not None for q in queries for name in FILTER_SQL)
+
+    started = time.perf_counter()
+    async with metrics.acquire(pool, "batch_search") as conn, conn.transaction():
+        max_limit = max(q.limit for q in queries)
+        await apply_recall_settings(conn, max(ann_limit(item_type, max_limit) for item_type in ITEM_TYPES),
+                                    ef_search, probes, filtered)
+        with metrics.timed("batch_search", "batch_vector"):
+            rows = await conn.fetch(batch_vector_query(ITEM_TYPES), *args)
+    logger.info(f"Batch search of {len(queries)} queries returned {len(rows)} rows in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    # 3️⃣ Rows arrive ordered by query position, type and score
+    results = [SearchResponse() for _ in queries]
+    for row in rows:
+        response = results[row["ord"] - 1]
+        getattr(response, row["item_type"]).append(SearchResultItem(id=row["id"], similarity=row["score"]))
+    return BatchSearchResponse(results=results)
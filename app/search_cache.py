@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from typing import Any, Optional
+from app.config import settings
+from app.embedding_utils import normalize_query
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Catalog version = (local generation, database version).
+# The local generation is bumped immediately by writers in this process (REST ingest,
+# RabbitMQ consumer). The database version is `catalog_version_seq`, bumped by triggers on
+# every write from any process (e.g. bulk_import.py); it is re-read at most every
+# SEARCH_CACHE_MAX_STALENESS seconds, which bounds how long a cached result can outlive a change.
+_local_generation = 0
+_db_version: Optional[int] = None
+_db_checked_at = float("-inf")
+_db_check_lock: Optional[asyncio.Lock] = None
+
+
+def invalidate():
+    """Called after a catalog write in this process: cached results stop being served at once"""
+    global _local_generation
+    _local_generation += 1
+
+
+async def current_version(pool) -> tuple:
+    """
+    Current catalog version, polling the database version when it is due.
+    `pool` must be the primary: sequences are WAL-logged in steps of 32 values, so a replica lags behind.
+    """
+    global _db_version, _db_checked_at, _db_check_lock
+
+    if time.monotonic() - _db_checked_at >= settings.SEARCH_CACHE_MAX_STALENESS:
+        if _db_check_lock is None:
+            _db_check_lock = asyncio.Lock()
+        async with _db_check_lock:
+            # Another request may have refreshed it while we waited for the lock
+            if time.monotonic() - _db_checked_at >= settings.SEARCH_CACHE_MAX_STALENESS:
+                try:
+                    async with pool.acquire() as conn:
+                        row = await conn.fetchrow("SELECT last_value, is_called FROM catalog_version_seq")
+                    _db_version = row["last_value"] if row["is_called"] else 0
+                except Exception as e:
+                    # Without the sequence (migration 005 not applied) only local writes and the TTL invalidate
+                    logger.warning(f"Could not read catalog version: {e}")
+                    _db_version = None
+                _db_checked_at = time.monotonic()
+
+    return (_local_generation, _db_version)
+
+
+def make_key(query: str, **params) -> tuple:
+    """Cache key from the normalized query plus every parameter that changes the result"""
+    return (normalize_query(query), tuple(sorted(params.items())))
+
+
+class SearchResultCache:
+    """
+    Bounded LRU cache of search responses with a TTL.
+    Each entry remembers the catalog version it was computed at and only matches that version.
+    Outdated entries stay until evicted: a search that runs out of time can still fall back to them.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (stored_at, version, value)
+
+    def get(self, key: tuple, version: tuple) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] != version or (self.ttl and time.monotonic() - entry[0] > self.ttl):
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def get_stale(self, key: tuple) -> Optional[Any]:
+        """The last value stored for `key`, whatever its catalog version or age"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self.stale_hits += 1
+        return entry[2]
+
+    def put(self, key: tuple, version: tuple, value: Any):
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (time.monotonic(), version, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_hits": self.stale_hits,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+result_cache = SearchResultCache(settings.SEARCH_CACHE_SIZE, settings.SEARCH_CACHE_TTL)
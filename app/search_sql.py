@@ -0,0 +1,398 @@
+"""
+SQL for the search legs. Products and services share the same statements;
+`ITEM_TYPES` maps each result type to its item table, embedding table, supported filters
+and the columns it can return inline. Items are aliased `i` and their embeddings `e` in every statement.
+Statements only select the item id plus requested fields, never the JSONB blobs.
+They run under the ANN recall settings of apply_recall_settings. Nothing here loads the embedding model.
+"""
+
+from typing import Optional
+from app.config import settings
+
+ITEM_TYPES = {
+    "products": {
+        "table": "products", "embeddings": "product_embeddings", "key": "product_id",
+        "filters": {"category", "brand", "min_price", "max_price", "in_stock"},
+        "fields": {"name", "description", "basePrice", "categoryName", "brand", "barcode"},
+    },
+    "services": {
+        "table": "services", "embeddings": "service_embeddings", "key": "service_id",
+        "filters": {"category", "min_price", "max_price"},
+        "fields": {"name", "description", "basePrice", "categoryName"},
+    },
+}
+
+# Item columns a search can return inline (`fields=`), in response order
+RESULT_FIELDS = ["name", "description", "basePrice", "categoryName", "brand", "barcode"]
+
+
+def projection(item_type: str, fields=()) -> str:
+    """
+    `i.id` plus the requested result fields, keeping their camelCase names as column labels.
+    Fields the type does not have are NULL, so the columns of UNION ALL branches line up.
+    """
+    columns = ["i.id"]
+    for field in fields:
+        column = f"i.{field}" if field in ITEM_TYPES[item_type]["fields"] else "NULL"
+        columns.append(f'{column} AS "{field}"')
+    return ", ".join(columns)
+
+
+def active_filters(filters) -> dict:
+    """The filters that are set on a request, as {name: value}"""
+    if filters is None:
+        return {}
+    return {name: value for name, value in vars(filters).items() if value is not None}
+
+
+def supports_filters(item_type: str, filters) -> bool:
+    """False when a filter is set that this type does not have (e.g. brand on services):
+    no row could match, so the leg is skipped instead of scanned"""
+    return set(active_filters(filters)) <= ITEM_TYPES[item_type]["filters"]
+
+
+# Filter name -> SQL condition on the item row, formatted with the value expression
+FILTER_SQL = {
+    "category": "i.categoryName = {}",
+    "brand": "i.brand = {}",
+    "min_price": "i.basePrice >= {}",
+    "max_price": "i.basePrice <= {}",
+    "in_stock": "i.in_stock = {}",
+}
+
+
+def filter_clauses(filters, args: list) -> list:
+    """WHERE conditions for the active filters, appending their values to `args`"""
+    clauses = []
+    for name, value in active_filters(filters).items():
+        if name == "in_stock":
+            # Literal so the planner can match the partial in-stock index
+            clauses.append("i.in_stock" if value else "NOT i.in_stock")
+            continue
+        args.append(value)
+        clauses.append(FILTER_SQL[name].format(f"${len(args)}"))
+    return clauses
+
+
+def where_sql(clauses: list) -> str:
+    return f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+
+# Distance on a quantized copy of the embedding, formatted with the query vector expression.
+# Each matches an expression index of migration 008, so only the compact index is scanned.
+QUANTIZED_DISTANCE = {
+    "halfvec": "e.embedding::halfvec(768) <=> {}::halfvec(768)",
+    "binary": "binary_quantize(e.embedding)::bit(768) <~> binary_quantize({})::bit(768)",
+}
+QUANTIZATION_LEVELS = ["none", *QUANTIZED_DISTANCE]
+
+
+def quantization(item_type: str) -> str:
+    """Configured quantization level of a type's embeddings (VECTOR_QUANTIZATION_PRODUCTS / _SERVICES)"""
+    return getattr(settings, f"VECTOR_QUANTIZATION_{item_type.upper()}")
+
+
+def ann_limit(item_type: str, limit: int, level: Optional[str] = None) -> int:
+    """Rows the ANN index has to return for `limit` results: quantized searches over-fetch for rescoring"""
+    level = level or quantization(item_type)
+    return limit * max(1, settings.QUANTIZATION_RESCORE_FACTOR) if level in QUANTIZED_DISTANCE else limit
+
+
+# pgvector rejects larger hnsw.ef_search values
+HNSW_MAX_EF_SEARCH = 1000
+
+
+def effective_ef_search(limit: int, ef_search: Optional[int] = None) -> int:
+    return min(max(ef_search or settings.HNSW_EF_SEARCH, limit), HNSW_MAX_EF_SEARCH)
+
+
+async def apply_recall_settings(conn, limit: int, ef_search: Optional[int] = None, probes: Optional[int] = None,
+                                filtered: bool = False, statement_timeout: Optional[float] = None):
+    """
+    Set the pgvector ANN recall knobs for the current transaction.
+    HNSW can never return more than `ef_search` rows, so it is raised to at least `limit`.
+    Filtered searches enable iterative index scans (pgvector >= 0.8), which keep walking the
+    index until `limit` rows pass the filters instead of returning whatever survived.
+    A `statement_timeout` (seconds) makes Postgres cancel search statements that outlive it.
+    """
+    ann_settings = {
+        "hnsw.ef_search": str(effective_ef_search(limit, ef_search)),
+        "ivfflat.probes": str(probes or settings.IVFFLAT_PROBES),
+    }
+    if filtered and settings.ANN_ITERATIVE_SCAN != "off":
+        ann_settings["hnsw.iterative_scan"] = settings.ANN_ITERATIVE_SCAN
+        # IVFFlat only supports relaxed ordering; the search SQL re-sorts its rows either way
+        ann_settings["ivfflat.iterative_scan"] = "relaxed_order"
+    if statement_timeout is not None:
+        ann_settings["statement_timeout"] = str(max(1, int(statement_timeout * 1000)))
+
+    # One statement for all settings: set_config(name, value, is_local => true)
+    args = [part for name, value in ann_settings.items() for part in (name, value)]
+    calls = ", ".join(f"set_config(${n}, ${n + 1}, true)" for n in range(1, len(args), 2))
+    await conn.execute(f"SELECT {calls}", *args)
+
+
+def vector_query(item_type: str, query_embedding, limit: int, filters=None, level: Optional[str] = None,
+                 after: Optional[tuple] = None, fields=()):
+    """
+    Nearest neighbours by cosine distance, with the filters applied inside the same scan.
+    ORDER BY the raw distance so the planner can serve it from the ANN index; the outer
+    ORDER BY restores exact order (ties broken by id) when the index uses a relaxed iterative scan.
+    With a quantized `level` (default: the configured one) the index scan orders by the
+    quantized distance and over-fetches; the outer query rescores with the full vectors.
+    `after` = (distance, id) of the last row of the previous page (keyset pagination).
+    Returns (sql, args).
+    """
+    t = ITEM_TYPES[item_type]
+    level = level or quantization(item_type)
+    args = [query_embedding, limit]
+    if level in QUANTIZED_DISTANCE:
+        args.append(ann_limit(item_type, limit, level))
+        order, inner_limit, outer_limit = QUANTIZED_DISTANCE[level].format("$1::vector"), "$3", "LIMIT $2"
+    else:
+        order, inner_limit, outer_limit = "e.embedding <=> $1", "$2", ""
+    clauses = filter_clauses(filters, args)
+    if after is not None:
+        # Rows past the previous page; the index scan skips them like any other filter
+        args.extend(after)
+        clauses.append(f"(e.embedding <=> $1, i.id) > (${len(args) - 1}::float8, ${len(args)}::text)")
+    where = where_sql(clauses)
+    sql = f"""
+        SELECT nn.*, 1 - nn.distance AS score
+        FROM (
+            SELECT {projection(item_type, fields)}, e.embedding <=> $1 AS distance
+            FROM {t['embeddings']} e
+            JOIN {t['table']} i ON e.{t['key']} = i.id
+            {where}
+            ORDER BY {order}
+            LIMIT {inner_limit}
+        ) nn
+        ORDER BY nn.distance, nn.id
+        {outer_limit}
+    """
+    return sql, tuple(args)
+
+
+def unified_vector_query(item_types, query_embedding, limit: int, filters=None, fields=()):
+    """
+    Nearest neighbours across several item types in one statement, best first, `limit` rows in total.
+    Each UNION ALL branch is an index-ordered lookup of at most `limit` rows (the global top
+    `limit` is always among them); the outer query merges them by distance.
+    Returns (sql, args); rows are (item_type, id, *fields, distance, score).
+    """
+    args = [query_embedding, limit]
+    if any(quantization(item_type) in QUANTIZED_DISTANCE for item_type in item_types):
+        args.append(max(ann_limit(item_type, limit) for item_type in item_types))
+    # The filter conditions only reference the item alias, so every branch shares them
+    where = where_sql(filter_clauses(filters, args))
+    branches = []
+    for item_type in item_types:
+        t = ITEM_TYPES[item_type]
+        level = quantization(item_type)
+        if level in QUANTIZED_DISTANCE:
+            order, inner_limit = QUANTIZED_DISTANCE[level].format("$1::vector"), "$3"
+        else:
+            order, inner_limit = "e.embedding <=> $1", "$2"
+        branches.append(f"""(
+            SELECT '{item_type}' AS item_type, nn.*
+            FROM (
+                SELECT {projection(item_type, fields)}, e.embedding <=> $1 AS distance
+                FROM {t['embeddings']} e
+                JOIN {t['table']} i ON e.{t['key']} = i.id
+                {where}
+                ORDER BY {order}
+                LIMIT {inner_limit}
+            ) nn
+            ORDER BY nn.distance
+            LIMIT $2
+        )""")
+    sql = f"""
+        SELECT u.*, 1 - u.distance AS score
+        FROM ({" UNION ALL ".join(branches)}) u
+        ORDER BY u.distance, u.id
+        LIMIT $2
+    """
+    return sql, tuple(args)
+
+
+def lexical_query(item_type: str, query: str, limit: int, filters=None, fields=()):
+    """
+    Full-text match on `search_document` or fuzzy word match on `search_text` (migration 006).
+    Items still waiting for their embedding (asynchronous ingest) are left out, as in the vector legs.
+    Returns (sql, args).
+    """
+    t = ITEM_TYPES[item_type]
+    args = [query, limit]
+    clauses = ["(i.search_document @@ q.tsq OR i.search_text %> $1)",
+               f"EXISTS (SELECT 1 FROM {t['embeddings']} e WHERE e.{t['key']} = i.id)"] + filter_clauses(filters, args)
+    sql = f"""
+        SELECT {projection(item_type, fields)},
+               ts_rank_cd(i.search_document, q.tsq) + word_similarity($1, i.search_text) AS score
+        FROM {t['table']} i, websearch_to_tsquery('simple', $1) AS q(tsq)
+        {where_sql(clauses)}
+        ORDER BY score DESC
+        LIMIT $2
+    """
+    return sql, tuple(args)
+
+
+def rescore_ids_query(item_types, fields=()) -> str:
+    """
+    Exact cosine distance of the given ids, for candidates ranked outside Postgres (the memory index).
+    Deleted ids are simply absent. $1 = query embedding, $2.. = one text[] of ids per item type;
+    returns (item_type, id, *fields, distance) rows.
+    """
+    return " UNION ALL ".join(
+        f"""SELECT '{item_type}' AS item_type, {projection(item_type, fields)}, e.embedding <=> $1 AS distance
+            FROM {ITEM_TYPES[item_type]['table']} i
+            JOIN {ITEM_TYPES[item_type]['embeddings']} e ON e.{ITEM_TYPES[item_type]['key']} = i.id
+            WHERE i.id = ANY(${n}::text[])"""
+        for n, item_type in enumerate(item_types, start=2)
+    )
+
+
+def similar_query(source_type: str, target_type: str, item_id: str, limit: int, fields=()):
+    """
+    Nearest neighbours of a stored item's embedding, without running the model.
+    The source vector is a scalar subquery, evaluated once before the scan, so the ANN index can
+    order by it. The item itself is excluded, so the index has to return `limit + 1` rows.
+    Returns (sql, args).
+    """
+    s, t = ITEM_TYPES[source_type], ITEM_TYPES[target_type]
+    source = f"(SELECT embedding FROM {s['embeddings']} WHERE {s['key']} = $1)"
+    sql = f"""
+        SELECT nn.*, 1 - nn.distance AS score
+        FROM (
+            SELECT {projection(target_type, fields)}, e.embedding <=> {source} AS distance
+            FROM {t['embeddings']} e
+            JOIN {t['table']} i ON e.{t['key']} = i.id
+            {"WHERE i.id <> $1" if source_type == target_type else ""}
+            ORDER BY e.embedding <=> {source}
+            LIMIT $2
+        ) nn
+        ORDER BY nn.distance, nn.id
+    """
+    return sql, (item_id, limit)
+
+
+def neighbors_query(source_type: str, target_type: str, item_id: str, limit: int, fields=()):
+    """
+    Precomputed neighbours of an item from item_neighbors (migration 009).
+    Joining the target table and its embeddings drops neighbours deleted since the list was computed
+    and those re-ingested asynchronously and still waiting for their new embedding.
+    Returns (sql, args).
+    """
+    t = ITEM_TYPES[target_type]
+    sql = f"""
+        SELECT {projection(target_type, fields)}, n.score
+        FROM item_neighbors n
+        JOIN {t['table']} i ON i.id = n.target_id
+        JOIN {t['embeddings']} e ON e.{t['key']} = i.id
+        WHERE n.source_type = '{source_type}' AND n.source_id = $1 AND n.target_type = '{target_type}'
+        ORDER BY n.rank
+        LIMIT $2
+    """
+    return sql, (item_id, limit)
+
+
+def refresh_neighbors_query(source_type: str, target_type: str, item_ids: list, limit: int):
+    """
+    Recompute the neighbour lists of many items from the live similarity query, in one statement:
+    every source embedding runs its own index-ordered LATERAL lookup, as in similar_query.
+    Run after deleting the items' previous lists in the same transaction. Returns (sql, args).
+    """
+    s, t = ITEM_TYPES[source_type], ITEM_TYPES[target_type]
+    sql = f"""
+        INSERT INTO item_neighbors (source_type, source_id, target_type, rank, target_id, score)
+        SELECT '{source_type}', src.{s['key']}, '{target_type}',
+               row_number() OVER (PARTITION BY src.{s['key']} ORDER BY nn.distance, nn.id), nn.id, 1 - nn.distance
+        FROM {s['embeddings']} src
+        CROSS JOIN LATERAL (
+            SELECT i.id, e.embedding <=> src.embedding AS distance
+            FROM {t['embeddings']} e
+            JOIN {t['table']} i ON e.{t['key']} = i.id
+            {f"WHERE i.id <> src.{s['key']}" if source_type == target_type else ""}
+            ORDER BY e.embedding <=> src.embedding
+            LIMIT $2
+        ) nn
+        WHERE src.{s['key']} = ANY($1::text[])
+    """
+    return sql, (list(item_ids), limit)
+
+
+# Per-query parameters of a batch search, in unnest() column order
+BATCH_QUERY_COLUMNS = ["embedding", "lim", "category", "brand", "min_price", "max_price", "in_stock"]
+BATCH_QUERY_TYPES = ["text", "int", "text", "text", "float8", "float8", "bool"]
+
+
+def batch_vector_query(item_types) -> str:
+    """
+    Nearest neighbours for many queries in one statement: every query row of the unnest()
+    runs its own index-ordered LATERAL lookup per result type, with its own limit and filters.
+    $1.. = one array per BATCH_QUERY_COLUMNS entry; embeddings are passed as vector text.
+    """
+    lookups = []
+    for item_type in item_types:
+        t = ITEM_TYPES[item_type]
+        clauses = []
+        for name in FILTER_SQL:
+            if name in t["filters"]:
+                clauses.append(f"(q.{name} IS NULL OR {FILTER_SQL[name].format(f'q.{name}')})")
+            else:
+                # Filter the type does not have: only queries without it can match
+                clauses.append(f"q.{name} IS NULL")
+        level = quantization(item_type)
+        if level in QUANTIZED_DISTANCE:
+            # Over-fetch on the quantized index, rescore with the full vectors
+            order = QUANTIZED_DISTANCE[level].format("q.embedding")
+            inner_limit = f"q.lim * {max(1, settings.QUANTIZATION_RESCORE_FACTOR)}"
+            outer = "ORDER BY nn.distance LIMIT q.lim"
+        else:
+            order, inner_limit, outer = "e.embedding <=> q.embedding", "q.lim", ""
+        lookups.append(f"""
+            SELECT '{item_type}' AS item_type, nn.id, 1 - nn.distance AS score
+            FROM (
+                SELECT i.id, e.embedding <=> q.embedding AS distance
+                FROM {t['embeddings']} e
+                JOIN {t['table']} i ON e.{t['key']} = i.id
+                {where_sql(clauses)}
+                ORDER BY {order}
+                LIMIT {inner_limit}
+            ) nn
+            {outer}
+        """)
+    arrays = ", ".join(
+        f"${n}::{sql_type}[]" + ("::vector[]" if column == "embedding" else "")
+        for n, (column, sql_type) in enumerate(zip(BATCH_QUERY_COLUMNS, BATCH_QUERY_TYPES), start=1)
+    )
+    return f"""
+        SELECT q.ord, r.item_type, r.id, r.score
+        FROM unnest({arrays}) WITH ORDINALITY AS q({", ".join(BATCH_QUERY_COLUMNS)}, ord)
+        CROSS JOIN LATERAL ({" UNION ALL ".join(f"({lookup})" for lookup in lookups)}) r
+        ORDER BY q.ord, r.item_type, r.score DESC
+    """
+
+
+def plan_nodes(plan) -> list:
+    """Every node of an EXPLAIN (FORMAT JSON) plan"""
+    nodes = []
+    pending = [plan]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, dict):
+            if "Node Type" in node:
+                nodes.append(node)
+            pending.extend(node.values())
+        elif isinstance(node, list):
+            pending.extend(node)
+    return nodes
+
+
+def used_indexes(plan) -> set:
+    """Index names that appear in an EXPLAIN (FORMAT JSON) plan"""
+    return {node["Index Name"] for node in plan_nodes(plan) if "Index Name" in node}
+
+
+def seq_scanned_tables(plan) -> set:
+    """Tables an EXPLAIN (FORMAT JSON) plan reads with a sequential scan"""
+    return {node["Relation Name"] for node in plan_nodes(plan) if node["Node Type"] == "Seq Scan"}
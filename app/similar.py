@@ -0,0 +1,94 @@
+from fastapi import APIRouter, HTTPException, Query, Response
+from typing import Literal, Optional
+from app.config import settings
+from app import metrics
+from app.search import (
+    SearchLeg, SearchResponse, RESULT_FIELDS,
+    run_search_legs, server_timing_header, to_result_items, parse_fields,
+)
+from app.search_sql import ITEM_TYPES, similar_query, neighbors_query
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+async def similar_items(response: Response, source_type: str, item_id: str, limit: int,
+                        target: Optional[str], fields: Optional[str]) -> SearchResponse:
+    """Neighbours of a stored item, from item_neighbors when available, else from a live ANN query"""
+
+    # Reads go to a read replica when DATABASE_READ_URL is set (else the primary)
+    from app.db import read_pool
+    pool = read_pool()
+
+    fields = parse_fields(fields)
+    target_types = list(ITEM_TYPES) if target == "all" else [target or source_type]
+
+    rows_by_type = {}
+    timings = {}
+    if settings.SIMILAR_ITEMS_PRECOMPUTED and limit <= settings.SIMILAR_ITEMS_PRECOMPUTED_K:
+        started = time.perf_counter()
+        try:
+            async with metrics.acquire(pool, "similar") as conn:
+                for target_type in target_types:
+                    sql, args = neighbors_query(source_type, target_type, item_id, limit, fields)
+                    rows = await conn.fetch(sql, *args)
+                    # No list yet (item not refreshed since migration 009): query it live below
+                    if rows:
+                        rows_by_type[target_type] = rows
+            timings["neighbors"] = (time.perf_counter() - started) * 1000
+            metrics.observe("similar", "neighbors", timings["neighbors"] / 1000)
+        except Exception as e:
+            logger.warning(f"Database error reading precomputed neighbors: {e}")
+
+    legs = [SearchLeg(f"{target_type}_similar", *similar_query(source_type, target_type, item_id, limit, fields),
+                      ann_limit=limit + 1)
+            for target_type in target_types if target_type not in rows_by_type]
+    if legs:
+        leg_rows, leg_timings = await run_search_legs(pool, legs, limit, operation="similar")
+        timings.update(leg_timings)
+        for leg in legs:
+            rows_by_type[leg.name[:-len("_similar")]] = leg_rows[leg.name]
+
+    if not any(rows_by_type.values()):
+        # Either the item has no neighbours or it does not exist (or has no embedding yet)
+        t = ITEM_TYPES[source_type]
+        async with pool.acquire() as conn:
+            exists = await conn.fetchval(f"SELECT EXISTS (SELECT 1 FROM {t['embeddings']} WHERE {t['key']} = $1)", item_id)
+        if not exists:
+            raise HTTPException(status_code=404, detail=f"{source_type[:-1].capitalize()} '{item_id}' not found or not embedded")
+
+    results = {item_type: to_result_items(item_type, [(row, row["score"]) for row in rows_by_type.get(item_type, [])], fields)
+               for item_type in ITEM_TYPES}
+    response.headers["Server-Timing"] = server_timing_header(timings)
+    logger.info(f"Similar to {source_type[:-1]} {item_id}: {len(results['products'])} products, {len(results['services'])} services")
+    return SearchResponse(products=results["products"], services=results["services"], ranking="similar")
+
+
+TARGET_DESCRIPTION = "products, services or all (both lists); defaults to the item's own type"
+FIELDS_DESCRIPTION = "Comma-separated item fields to return inline: " + ", ".join(RESULT_FIELDS)
+
+@router.get("/product/{product_id}/similar", response_model=SearchResponse)
+async def similar_to_product(response: Response, product_id: str,
+                             limit: int = Query(10, ge=1, le=1000, description="Number of results per type"),
+                             target: Optional[Literal["products", "services", "all"]] = Query(None, description=TARGET_DESCRIPTION),
+                             fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)):
+    """
+    "More like this" for a product, using its stored embedding (no model inference).
+    `target=services` returns related services instead.
+    """
+    return await similar_items(response, "products", product_id, limit, target, fields)
+
+
+@router.get("/service/{service_id}/similar", response_model=SearchResponse)
+async def similar_to_service(response: Response, service_id: str,
+                             limit: int = Query(10, ge=1, le=1000, description="Number of results per type"),
+                             target: Optional[Literal["products", "services", "all"]] = Query(None, description=TARGET_DESCRIPTION),
+                             fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION)):
+    """
+    Similar services for a service, using its stored embedding (no model inference).
+    `target=products` returns related products instead.
+    """
+    return await similar_items(response, "services", service_id, limit, target, fields)
@@ -0,0 +1,276 @@
+from fastapi import APIRouter, Query, Response
+from pydantic import BaseModel
+from typing import List, Optional
+from app.config import settings
+import asyncio
+import bisect
+import heapq
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Suggestion kinds, best first: ties in popularity go to the earlier kind
+KINDS = ["name", "brand", "category", "tag"]
+
+
+def normalize(text: str) -> str:
+    """Lookup key: lower-cased with collapsed whitespace"""
+    return " ".join(text.lower().split())
+
+
+def trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[n:n + 3] for n in range(len(padded) - 2)}
+
+
+class Suggestion(BaseModel):
+    text: str
+    kind: str
+    # Number of products and services carrying this name, brand, category or tag
+    count: int
+
+
+class SuggestResponse(BaseModel):
+    suggestions: List[Suggestion] = []
+
+
+class SuggestIndex:
+    """
+    In-memory typeahead index over product and service names, brands, categories and tags.
+    Each distinct phrase (case-insensitive) is one suggestion. Lookups match a prefix of the
+    phrase or of any word in it with a binary search over the sorted word suffixes, and fall
+    back to trigram similarity for misspelled queries. Items are re-indexed on ingest.
+    """
+
+    def __init__(self):
+        self.phrases = {}  # key -> {"text", "kinds": {kind: item count}, "items": set of (type, id), "rank", "trigrams"}
+        self.items = {}  # (item type, item id) -> [(key, kind)] it contributed
+        self._suffixes = []  # sorted (word suffix of a key, key)
+        self._trigrams = {}  # trigram -> set of keys
+        self._results = {}  # memoized lookups, cleared on every change
+        self._building = False  # build(): suffixes are appended unsorted and sorted once at the end
+
+    @classmethod
+    def build(cls, items) -> "SuggestIndex":
+        """
+        Index of `items`, (item type, item id, name, brand, category, tags) tuples.
+        Word suffixes are sorted once at the end instead of inserted one by one.
+        """
+        index = cls()
+        index._building = True
+        for item in items:
+            index.index_item(*item)
+        index._building = False
+        index._suffixes.sort()
+        return index
+
+    def _add_phrase(self, key: str, text: str):
+        self.phrases[key] = {"text": text, "kinds": {}, "items": set(), "trigrams": trigrams(key)}
+        words = key.split(" ")
+        for n in range(len(words)):
+            if self._building:
+                self._suffixes.append((" ".join(words[n:]), key))
+            else:
+                bisect.insort(self._suffixes, (" ".join(words[n:]), key))
+        for trigram in self.phrases[key]["trigrams"]:
+            self._trigrams.setdefault(trigram, set()).add(key)
+
+    def _remove_phrase(self, key: str):
+        phrase = self.phrases.pop(key)
+        words = key.split(" ")
+        for n in range(len(words)):
+            entry = (" ".join(words[n:]), key)
+            if self._building:
+                self._suffixes.remove(entry)
+                continue
+            position = bisect.bisect_left(self._suffixes, entry)
+            if position < len(self._suffixes) and self._suffixes[position] == entry:
+                del self._suffixes[position]
+        for trigram in phrase["trigrams"]:
+            keys = self._trigrams.get(trigram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._trigrams[trigram]
+
+    def remove_item(self, item_type: str, item_id: str):
+        for key, kind in self.items.pop((item_type, item_id), []):
+            phrase = self.phrases[key]
+            phrase["items"].discard((item_type, item_id))
+            phrase["kinds"][kind] -= 1
+            if not phrase["kinds"][kind]:
+                del phrase["kinds"][kind]
+            if phrase["items"]:
+                self._update_rank(key)
+            else:
+                self._remove_phrase(key)
+        self._results.clear()
+
+    def index_item(self, item_type: str, item_id: str, name: Optional[str] = None, brand: Optional[str] = None,
+                   category: Optional[str] = None, tags: Optional[list] = None):
+        """Add an item's phrases, replacing whatever it contributed before"""
+        self.remove_item(item_type, item_id)
+        contributed = []
+        for kind, values in (("name", [name]), ("brand", [brand]), ("category", [category]), ("tag", tags or [])):
+            for text in values:
+                if not isinstance(text, str) or not text.strip():
+                    continue
+                key = normalize(text)
+                if (key, kind) in contributed:
+                    continue
+                if key not in self.phrases:
+                    self._add_phrase(key, " ".join(text.split()))
+                phrase = self.phrases[key]
+                phrase["items"].add((item_type, item_id))
+                phrase["kinds"][kind] = phrase["kinds"].get(kind, 0) + 1
+                self._update_rank(key)
+                contributed.append((key, kind))
+        self.items[(item_type, item_id)] = contributed
+
+    def _update_rank(self, key: str):
+        # Query-independent order: popularity, then kind, then shorter phrases
+        phrase = self.phrases[key]
+        phrase["rank"] = (-len(phrase["items"]), min(KINDS.index(kind) for kind in phrase["kinds"]), len(key), key)
+
+    def _suggestion(self, key: str) -> Suggestion:
+        phrase = self.phrases[key]
+        return Suggestion(text=phrase["text"], kind=KINDS[phrase["rank"][1]], count=len(phrase["items"]))
+
+    def lookup(self, query: str, limit: int) -> List[Suggestion]:
+        query = normalize(query)
+        if not query:
+            return []
+        memo_key = (query, limit)
+        if memo_key in self._results:
+            return self._results[memo_key]
+
+        # Prefix matches: every word suffix starting with the query (scan bounded for very short queries).
+        # Phrases starting with the query come before those with a later word starting with it.
+        matches = set()
+        position = bisect.bisect_left(self._suffixes, (query,))
+        for suffix, key in self._suffixes[position:position + settings.SUGGEST_MAX_SCAN]:
+            if not suffix.startswith(query):
+                break
+            matches.add(key)
+        phrases = self.phrases
+        ranked = heapq.nsmallest(limit, matches, key=lambda key: (not key.startswith(query), phrases[key]["rank"]))
+
+        # Fuzzy fallback for typos: phrases sharing the most trigrams with the query.
+        # Rare trigrams are counted first and at most SUGGEST_MAX_SCAN postings are read.
+        if len(ranked) < limit and len(query) >= 3:
+            query_trigrams = trigrams(query)
+            shared = {}
+            budget = settings.SUGGEST_MAX_SCAN
+            for trigram in sorted(query_trigrams, key=lambda trigram: len(self._trigrams.get(trigram, ()))):
+                keys = self._trigrams.get(trigram, ())
+                if budget <= 0 or (shared and len(keys) > budget):
+                    break
+                budget -= len(keys)
+                for key in keys:
+                    shared[key] = shared.get(key, 0) + 1
+            candidates = heapq.nlargest(limit * 5, (key for key in shared if key not in matches), key=shared.get)
+            similarity = {key: len(query_trigrams & phrases[key]["trigrams"]) / len(query_trigrams | phrases[key]["trigrams"])
+                          for key in candidates}
+            fuzzy = [key for key in candidates if similarity[key] >= settings.SUGGEST_MIN_SIMILARITY]
+            fuzzy.sort(key=lambda key: (-similarity[key], phrases[key]["rank"]))
+            ranked += fuzzy[:limit - len(ranked)]
+
+        suggestions = [self._suggestion(key) for key in ranked]
+        if len(self._results) >= 10000:
+            self._results.clear()
+        self._results[memo_key] = suggestions
+        return suggestions
+
+    def stats(self) -> dict:
+        return {"phrases": len(self.phrases), "items": len(self.items)}
+
+
+suggest_index = SuggestIndex()
+_reload_task: Optional[asyncio.Task] = None
+# While load() builds a new index: items ingested meanwhile, replayed onto it before the swap
+_ingested_during_load: Optional[list] = None
+
+
+def parse_tags(tags) -> list:
+    """Tags as stored: a JSONB array, returned by asyncpg as JSON text"""
+    if isinstance(tags, str):
+        tags = json.loads(tags)
+    return tags if isinstance(tags, list) else []
+
+
+def index_item(item_type: str, item_id: str, name: Optional[str] = None, brand: Optional[str] = None,
+               category: Optional[str] = None, tags: Optional[list] = None):
+    """Called after an item is ingested, so its suggestions are live at once"""
+    suggest_index.index_item(item_type, item_id, name, brand, category, tags)
+    if _ingested_during_load is not None:
+        _ingested_during_load.append((item_type, item_id, name, brand, category, tags))
+
+
+def _build(products: list, services: list) -> SuggestIndex:
+    items = [("products", row["id"], row["name"], row["brand"], row["categoryname"], parse_tags(row["tags"]))
+             for row in products]
+    items += [("services", row["id"], row["name"], None, row["categoryname"], parse_tags(row["tags"]))
+              for row in services]
+    return SuggestIndex.build(items)
+
+
+async def load(pool):
+    """
+    Build a fresh index from the products and services tables and swap it in.
+    The build runs in the default executor so lookups keep being served from the current index.
+    """
+    global suggest_index, _ingested_during_load
+    started = time.perf_counter()
+    _ingested_during_load = []
+    try:
+        async with pool.acquire() as conn:
+            products = await conn.fetch("SELECT id, name, brand, categoryName, tags FROM products")
+            services = await conn.fetch("SELECT id, name, categoryName, tags FROM services")
+        index = await asyncio.get_running_loop().run_in_executor(None, _build, products, services)
+        # Back on the event loop: nothing is ingested between the replay and the swap
+        for item in _ingested_during_load:
+            index.index_item(*item)
+    finally:
+        _ingested_during_load = None
+    suggest_index = index
+    logger.info(f"Loaded {len(index.phrases)} suggestions from {len(products)} products and {len(services)} services "
+                f"in {time.perf_counter() - started:.1f}s")
+
+
+async def _reload_loop(pool):
+    # Ingest updates the index directly; the reload picks up writes from other processes (bulk_import.py)
+    while True:
+        try:
+            await load(pool)
+        except Exception as e:
+            logger.error(f"Failed to load the suggest index: {e}")
+        await asyncio.sleep(settings.SUGGEST_RELOAD_INTERVAL)
+
+
+def start(pool):
+    global _reload_task
+    _reload_task = asyncio.create_task(_reload_loop(pool))
+
+
+async def stop():
+    if _reload_task is not None:
+        _reload_task.cancel()
+        await asyncio.gather(_reload_task, return_exceptions=True)
+
+
+@router.get("/suggest", response_model=SuggestResponse)
+async def suggest(response: Response,
+                  q: str = Query(..., description="What the user has typed so far"),
+                  limit: int = Query(10, ge=1, le=50, description="Number of suggestions")):
+    """
+    Typeahead suggestions from product and service names, brands, categories and tags.
+    Served from memory; no embedding model or database call.
+    """
+    started = time.perf_counter()
+    suggestions = suggest_index.lookup(q, limit)
+    response.headers["Server-Timing"] = f"suggest;dur={(time.perf_counter() - started) * 1000:.3f}"
+    return SuggestResponse(suggestions=suggestions)
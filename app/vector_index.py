@@ -0,0 +1,225 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from app.config import settings
+from app.search_sql import ITEM_TYPES
+import numpy as np
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_DIMENSIONS = 768
+# Rows copied per chunk when converting a float16 matrix for scoring
+SCORE_CHUNK_ROWS = 65536
+# Incremental refreshes re-read this far behind the watermark: updated_at is the writer's
+# transaction start time, so a slow writer can commit rows older than what we last saw
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+def _as_array(vector) -> np.ndarray:
+    # pgvector decodes to a Vector object in recent versions and to a numpy array in older ones
+    return np.asarray(vector.to_numpy() if hasattr(vector, "to_numpy") else vector, dtype=np.float32)
+
+
+class MemoryVectorIndex:
+    """
+    All embeddings of one item type in a contiguous, memory-mapped matrix (float32 or float16).
+    Rows are L2-normalized, so cosine similarity is a single matrix-vector product.
+    Updated rows are overwritten in place, new rows appended and deleted rows masked out.
+    """
+
+    def __init__(self, item_type: str, directory: str, dtype: str):
+        self.item_type = item_type
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.ids = []
+        self.positions = {}  # item id -> row
+        self.count = 0
+        self.matrix: Optional[np.memmap] = None
+        self.live = np.zeros(0, dtype=bool)
+        self.watermark: Optional[datetime] = None
+        self._generation = 0
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"{self.item_type}-{os.getpid()}-{self._generation}.{self.dtype.name}.mmap")
+
+    def _ensure_capacity(self, rows: int):
+        capacity = 0 if self.matrix is None else self.matrix.shape[0]
+        if rows <= capacity:
+            return
+        new_capacity = max(rows, capacity * 2, 1024)
+        old_matrix, old_path = self.matrix, self.matrix.filename if self.matrix is not None else None
+        self._generation += 1
+        matrix = np.memmap(self._path(), dtype=self.dtype, mode="w+", shape=(new_capacity, EMBEDDING_DIMENSIONS))
+        live = np.zeros(new_capacity, dtype=bool)
+        if old_matrix is not None:
+            matrix[:self.count] = old_matrix[:self.count]
+            live[:self.count] = self.live[:self.count]
+        # Searches running in other threads keep their reference to the old matrix until they finish
+        self.matrix, self.live = matrix, live
+        if old_path:
+            os.remove(old_path)
+
+    def upsert(self, ids: list, vectors: np.ndarray):
+        if not ids:
+            return
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        self._ensure_capacity(self.count + len(ids))
+        for item_id, vector in zip(ids, vectors):
+            row = self.positions.get(item_id)
+            if row is None:
+                row = self.count
+                self.positions[item_id] = row
+                self.ids.append(item_id)
+                self.count += 1
+            self.matrix[row] = vector
+            self.live[row] = True
+
+    def remove(self, item_id: str):
+        row = self.positions.pop(item_id, None)
+        if row is not None:
+            self.live[row] = False
+
+    def search(self, query: np.ndarray, limit: int) -> list:
+        """Top `limit` (id, cosine similarity) pairs; CPU-bound, run it in an executor"""
+        matrix, live, count, ids = self.matrix, self.live, self.count, self.ids
+        if matrix is None or count == 0:
+            return []
+        query = query / (np.linalg.norm(query) or 1)
+        if self.dtype == np.float32:
+            scores = matrix[:count] @ query
+        else:
+            # NumPy has no fast float16 matmul; convert chunk by chunk instead of the whole matrix
+            scores = np.empty(count, dtype=np.float32)
+            for start in range(0, count, SCORE_CHUNK_ROWS):
+                end = min(start + SCORE_CHUNK_ROWS, count)
+                scores[start:end] = matrix[start:end].astype(np.float32) @ query
+        scores[~live[:count]] = -np.inf
+
+        k = min(limit, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(ids[row], float(scores[row])) for row in top if np.isfinite(scores[row])]
+
+    def close(self):
+        if self.matrix is not None:
+            path = self.matrix.filename
+            self.matrix = None
+            os.remove(path)
+
+
+# item type -> loaded index; empty until the first load completes
+indexes = {}
+_refresh_task: Optional[asyncio.Task] = None
+
+
+def is_ready() -> bool:
+    return len(indexes) == len(ITEM_TYPES)
+
+
+async def _load(pool, index: MemoryVectorIndex, since: Optional[datetime] = None):
+    """Stream embeddings (all, or those of items updated since `since`) into the index"""
+    t = ITEM_TYPES[index.item_type]
+    sql = f"""
+        SELECT i.id, e.embedding, i.updated_at
+        FROM {t['embeddings']} e
+        JOIN {t['table']} i ON e.{t['key']} = i.id
+        {"WHERE i.updated_at >= $1" if since else ""}
+    """
+    args = (since - REFRESH_OVERLAP,) if since else ()
+    loaded = 0
+    async with pool.acquire() as conn, conn.transaction():
+        chunk = []
+        async for record in conn.cursor(sql, *args, prefetch=2000):
+            chunk.append(record)
+            if len(chunk) == 2000:
+                loaded += _apply_chunk(index, chunk)
+                chunk = []
+        loaded += _apply_chunk(index, chunk)
+    return loaded
+
+
+def _apply_chunk(index: MemoryVectorIndex, records: list) -> int:
+    if not records:
+        return 0
+    index.upsert([r["id"] for r in records], np.stack([_as_array(r["embedding"]) for r in records]))
+    newest = max(r["updated_at"] for r in records)
+    if index.watermark is None or newest > index.watermark:
+        index.watermark = newest
+    return len(records)
+
+
+async def full_reload(pool):
+    """Build fresh indexes (dropping deleted items) and swap them in"""
+    for item_type in ITEM_TYPES:
+        started = time.perf_counter()
+        index = MemoryVectorIndex(item_type, settings.VECTOR_INDEX_DIR, settings.VECTOR_INDEX_DTYPE)
+        loaded = await _load(pool, index)
+        old_index = indexes.get(item_type)
+        indexes[item_type] = index
+        if old_index is not None:
+            old_index.close()
+        logger.info(f"Loaded {loaded} {item_type} embeddings into the memory index in {time.perf_counter() - started:.1f}s")
+
+
+async def refresh(pool):
+    """Pull embeddings of items updated since the last load"""
+    for item_type, index in indexes.items():
+        # An index that loaded nothing has no watermark yet and is simply reloaded
+        loaded = await _load(pool, index, since=index.watermark)
+        if loaded:
+            logger.info(f"Refreshed {loaded} {item_type} embeddings in the memory index")
+
+
+async def _refresh_loop(pool):
+    last_full_reload = float("-inf")
+    while True:
+        try:
+            if time.monotonic() - last_full_reload >= settings.VECTOR_INDEX_FULL_RELOAD_INTERVAL:
+                await full_reload(pool)
+                last_full_reload = time.monotonic()
+            else:
+                await refresh(pool)
+        except Exception as e:
+            logger.error(f"Memory vector index refresh failed: {e}", exc_info=True)
+        await asyncio.sleep(settings.VECTOR_INDEX_REFRESH_INTERVAL)
+
+
+def start(pool):
+    """Load the indexes in the background and keep them fresh"""
+    global _refresh_task
+    os.makedirs(settings.VECTOR_INDEX_DIR, exist_ok=True)
+    _refresh_task = asyncio.create_task(_refresh_loop(pool))
+
+
+async def stop():
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        await asyncio.gather(_refresh_task, return_exceptions=True)
+    for index in indexes.values():
+        index.close()
+    indexes.clear()
+
+
+def stats() -> dict:
+    return {
+        item_type: {
+            "items": len(index.positions),
+            "dtype": index.dtype.name,
+            "watermark": index.watermark.isoformat() if index.watermark else None,
+        }
+        for item_type, index in indexes.items()
+    }
+
+
+async def search(query_embedding, limit: int) -> dict:
+    """Top `limit` (id, similarity) pairs per item type, scored in a worker thread"""
+    query = _as_array(query_embedding)
+    loop = asyncio.get_running_loop()
+    results = {}
+    for item_type, index in list(indexes.items()):
+        results[item_type] = await loop.run_in_executor(None, index.search, query, limit)
+    return results
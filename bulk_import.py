@@ -4,31 +4,13 @@ import os
 import asyncpg
 from app.db import init_db_pool, pool
 from app.embedding_utils import embed_text
+from app.ingest_sql import content_hash, update_unchanged_item_query, upsert_item_query
+from app.item_text import product_text, service_text
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-def format_product_attributes(attributes):
-    """Format product attributes for embedding text"""
-    if not attributes:
-        return ""
-    attr_text = ""
-    for attr in attributes:
-        val = attr.get('stringValue') or attr.get('numberValue') or attr.get('booleanValue') or attr.get('dateValue') or ""
-        attr_text += f"{attr.get('name', '')}: {val}\n"
-    return attr_text
-
-def format_service_attributes(attributes):
-    """Format service attributes for embedding text"""
-    if not attributes:
-        return ""
-    attr_text = ""
-    for attr in attributes:
-        val = attr.get('stringValue') or attr.get('numberValue') or attr.get('booleanValue') or attr.get('dateValue') or ""
-        attr_text += f"{attr.get('name', '')}: {val}\n"
-    return attr_text
-
 async def insert_products_and_services(json_file_path):
     """Insert products and services from a JSON file"""
     
@@ -48,14 +30,21 @@ async def insert_products_and_services(json_file_path):
     services = data.get('services', [])
     
     print(f"Found {len(products)} products and {len(services)} services to import")
+
+    # Items whose content is unchanged since their last import keep their embeddings
+    embedded = skipped = 0
     
     # Insert products
     if products:
         print("Inserting products...")
         for product_data in products:
             try:
-                await insert_product(product_data)
-                print(f"  ✓ Inserted product: {product_data.get('name', 'Unknown')}")
+                if await insert_product(product_data):
+                    embedded += 1
+                    print(f"  ✓ Inserted product: {product_data.get('name', 'Unknown')}")
+                else:
+                    skipped += 1
+                    print(f"  = Unchanged product: {product_data.get('name', 'Unknown')}")
             except Exception as e:
                 print(f"  ✗ Failed to insert product {product_data.get('name', 'Unknown')}: {e}")
     
@@ -64,15 +53,22 @@ async def insert_products_and_services(json_file_path):
         print("Inserting services...")
         for service_data in services:
             try:
-                await insert_service(service_data)
-                print(f"  ✓ Inserted service: {service_data.get('name', 'Unknown')}")
+                if await insert_service(service_data):
+                    embedded += 1
+                    print(f"  ✓ Inserted service: {service_data.get('name', 'Unknown')}")
+                else:
+                    skipped += 1
+                    print(f"  = Unchanged service: {service_data.get('name', 'Unknown')}")
             except Exception as e:
                 print(f"  ✗ Failed to insert service {service_data.get('name', 'Unknown')}: {e}")
     
-    print("Import completed!")
+    print(f"Import completed! {embedded} embedded, {skipped} unchanged")
 
 async def insert_product(product_data):
-    """Insert a single product into the database with a single unified embedding"""
+    """
+    Insert a single product into the database with a single unified embedding.
+    Returns False when its content was unchanged and the stored embedding was kept
+    """
     product_id = product_data['id']
     
     # Check if pool is properly initialized
@@ -80,22 +76,11 @@ async def insert_product(product_data):
     if db_pool is None:
         raise RuntimeError("Database pool is not initialized")
     
-    # Store product JSON in DB
-    async with db_pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO products (id, name, barcode, description, basePrice, categoryName, brand, tags, variants, attributes)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-            ON CONFLICT (id) DO UPDATE SET
-                name=EXCLUDED.name,
-                barcode=EXCLUDED.barcode,
-                description=EXCLUDED.description,
-                basePrice=EXCLUDED.basePrice,
-                categoryName=EXCLUDED.categoryName,
-                brand=EXCLUDED.brand,
-                tags=EXCLUDED.tags,
-                variants=EXCLUDED.variants,
-                attributes=EXCLUDED.attributes
-        """,
+    # The same text as the ingest endpoints and the consumer build, so the content hash matches theirs
+    full_text = product_text(product_data)
+
+    # Column values in ITEM_COLUMNS["products"] order
+    record = [
         product_id,
         product_data.get('name', ''),
         product_data.get('barcode'),
@@ -105,46 +90,29 @@ async def insert_product(product_data):
         product_data.get('brand'),
         json.dumps(product_data.get('tags', [])),
         json.dumps(product_data.get('variants', [])),
-        json.dumps(product_data.get('attributes', []))
-        )
-    
-    # Build a unified text containing all relevant product information
-    variants_text = ""
-    for v in product_data.get('variants', []):
-        v_parts = [f"SKU: {v.get('sku', '')}", f"Price: {v.get('price', 0)}", f"Stock: {v.get('stock', 0)}"]
-        attr_text = []
-        for a in v.get('attributes', []):
-            val = a.get('stringValue') or a.get('numberValue') or a.get('booleanValue') or a.get('dateValue') or ""
-            attr_text.append(f"{a.get('name', '')}: {val}")
-        if attr_text:
-            v_parts.append(" | ".join(attr_text))
-        variants_text += " | ".join(v_parts) + "\n"
-    
-    full_text = f"""
-Name: {product_data.get('name', '')}
-Description: {product_data.get('description', '')}
-Base Price: {product_data.get('basePrice', 0)}
-Category: {product_data.get('categoryName', '')}
-Brand: {product_data.get('brand', '')}
-Tags: {', '.join(product_data.get('tags', []))}
-Variants:
-{variants_text}
-Product Attributes:
-{format_product_attributes(product_data.get('attributes', []))}
-"""
+        json.dumps(product_data.get('attributes', [])),
+    ]
+    digest = content_hash(full_text)
+
+    # Unchanged content (same hash as the stored embedding): update the changed fields, if any, and skip the model
+    async with db_pool.acquire() as conn:
+        stored = await conn.fetchrow(update_unchanged_item_query("products"), *record, digest)
+    if stored["unchanged_content"]:
+        return False
 
     # Generate a single embedding for the entire product
     embedding = await embed_text(full_text)
     
+    # Store the product JSON and its embedding in one statement
     async with db_pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO product_embeddings (product_id, embedding)
-            VALUES ($1, $2)
-            ON CONFLICT (product_id) DO UPDATE SET embedding=EXCLUDED.embedding
-        """, product_id, embedding)
+        await conn.fetchval(upsert_item_query("products"), *record, embedding, digest)
+    return True
 
 async def insert_service(service_data):
-    """Insert a single service into the database with a single unified embedding"""
+    """
+    Insert a single service into the database with a single unified embedding.
+    Returns False when its content was unchanged and the stored embedding was kept
+    """
     service_id = service_data['id']
     
     # Check if pool is properly initialized
@@ -152,20 +120,11 @@ async def insert_service(service_data):
     if db_pool is None:
         raise RuntimeError("Database pool is not initialized")
     
-    # Store service JSON in DB
-    async with db_pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO services (id, name, description, basePrice, categoryName, tags, packages, attributes)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-            ON CONFLICT (id) DO UPDATE SET
-                name=EXCLUDED.name,
-                description=EXCLUDED.description,
-                basePrice=EXCLUDED.basePrice,
-                categoryName=EXCLUDED.categoryName,
-                tags=EXCLUDED.tags,
-                packages=EXCLUDED.packages,
-                attributes=EXCLUDED.attributes
-        """,
+    # The same text as the ingest endpoints and the consumer build, so the content hash matches theirs
+    full_text = service_text(service_data)
+
+    # Column values in ITEM_COLUMNS["services"] order
+    record = [
         service_id,
         service_data.get('name', ''),
         service_data.get('description', ''),
@@ -173,42 +132,23 @@ async def insert_service(service_data):
         service_data.get('categoryName', ''),
         json.dumps(service_data.get('tags', [])),
         json.dumps(service_data.get('packages', [])),
-        json.dumps(service_data.get('attributes', []))
-        )
-    
-    # Build a unified text containing all relevant service information
-    packages_text = ""
-    for p in service_data.get('packages', []):
-        p_parts = [f"Package: {p.get('name', '')}", f"Price: {p.get('price', 0)}", f"Description: {p.get('description', '')}"]
-        attr_text = []
-        for a in p.get('attributes', []):
-            val = a.get('stringValue') or a.get('numberValue') or a.get('booleanValue') or a.get('dateValue') or ""
-            attr_text.append(f"{a.get('name', '')}: {val}")
-        if attr_text:
-            p_parts.append(" | ".join(attr_text))
-        packages_text += " | ".join(p_parts) + "\n"
-    
-    full_text = f"""
-Name: {service_data.get('name', '')}
-Description: {service_data.get('description', '')}
-Base Price: {service_data.get('basePrice', 0)}
-Category: {service_data.get('categoryName', '')}
-Tags: {', '.join(service_data.get('tags', []))}
-Packages:
-{packages_text}
-Service Attributes:
-{format_service_attributes(service_data.get('attributes', []))}
-"""
+        json.dumps(service_data.get('attributes', [])),
+    ]
+    digest = content_hash(full_text)
+
+    # Unchanged content (same hash as the stored embedding): update the changed fields, if any, and skip the model
+    async with db_pool.acquire() as conn:
+        stored = await conn.fetchrow(update_unchanged_item_query("services"), *record, digest)
+    if stored["unchanged_content"]:
+        return False
 
     # Generate a single embedding for the entire service
     embedding = await embed_text(full_text)
     
+    # Store the service JSON and its embedding in one statement
     async with db_pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO service_embeddings (service_id, embedding)
-            VALUES ($1, $2)
-            ON CONFLICT (service_id) DO UPDATE SET embedding=EXCLUDED.embedding
-        """, service_id, embedding)
+        await conn.fetchval(upsert_item_query("services"), *record, embedding, digest)
+    return True
 
 if __name__ == "__main__":
     import sys
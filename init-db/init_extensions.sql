@@ -1,2 +1,5 @@
 -- Enable pgvector extension on database initialization
 CREATE EXTENSION IF NOT EXISTS vector;
+
+-- Trigram matching for lexical / hybrid search
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
@@ -0,0 +1,13 @@
+-- Migration: Add ANN indexes on embedding tables
+-- Date: 2026-10-18
+-- Description: Build HNSW cosine indexes so vector search no longer scans every embedding.
+-- Indexes are built concurrently so ingest keeps working while they are created.
+-- Use migrations/rebuild_ann_indexes.py to rebuild them or switch to IVFFlat.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_embeddings_ann_idx
+    ON product_embeddings USING hnsw (embedding vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS service_embeddings_ann_idx
+    ON service_embeddings USING hnsw (embedding vector_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
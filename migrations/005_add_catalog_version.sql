@@ -0,0 +1,39 @@
+-- Migration: Add catalog version sequence
+-- Date: 2026-10-18
+-- Description: Bump a sequence on every write to the catalog tables so the API's search
+-- result cache can detect changes made by any writer (REST, RabbitMQ consumer, bulk_import.py).
+-- A sequence is used instead of a counter row so concurrent writers never contend on a lock.
+
+CREATE SEQUENCE IF NOT EXISTS catalog_version_seq;
+
+CREATE OR REPLACE FUNCTION bump_catalog_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM nextval('catalog_version_seq');
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS bump_catalog_version_products ON products;
+CREATE TRIGGER bump_catalog_version_products
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION bump_catalog_version();
+
+DROP TRIGGER IF EXISTS bump_catalog_version_product_embeddings ON product_embeddings;
+CREATE TRIGGER bump_catalog_version_product_embeddings
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON product_embeddings
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION bump_catalog_version();
+
+DROP TRIGGER IF EXISTS bump_catalog_version_services ON services;
+CREATE TRIGGER bump_catalog_version_services
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON services
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION bump_catalog_version();
+
+DROP TRIGGER IF EXISTS bump_catalog_version_service_embeddings ON service_embeddings;
+CREATE TRIGGER bump_catalog_version_service_embeddings
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON service_embeddings
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION bump_catalog_version();
@@ -0,0 +1,42 @@
+-- Migration: Add lexical search columns and indexes
+-- Date: 2026-10-18
+-- Description: Full-text (tsvector) and trigram search over the identifying fields of products
+-- and services (name, brand, barcode, tags, variant SKUs, package names), used by the lexical
+-- and hybrid ranking modes of /search. The columns are generated, so writers need no changes.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_document tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(brand, '') || ' ' || coalesce(barcode, '') || ' ' ||
+        coalesce(jsonb_path_query_array(variants, '$[*].sku')::text, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(categoryName, '') || ' ' || coalesce(tags::text, '')), 'B')
+) STORED;
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_text TEXT GENERATED ALWAYS AS (
+    coalesce(name, '') || ' ' || coalesce(brand, '') || ' ' || coalesce(barcode, '') || ' ' ||
+    coalesce(jsonb_path_query_array(variants, '$[*].sku')::text, '') || ' ' || coalesce(tags::text, '')
+) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_search_document_idx
+    ON products USING gin (search_document);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_search_text_trgm_idx
+    ON products USING gin (search_text gin_trgm_ops);
+
+ALTER TABLE services ADD COLUMN IF NOT EXISTS search_document tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(categoryName, '') || ' ' || coalesce(tags::text, '') || ' ' ||
+        coalesce(jsonb_path_query_array(packages, '$[*].name')::text, '')), 'B')
+) STORED;
+
+ALTER TABLE services ADD COLUMN IF NOT EXISTS search_text TEXT GENERATED ALWAYS AS (
+    coalesce(name, '') || ' ' || coalesce(tags::text, '') || ' ' ||
+    coalesce(jsonb_path_query_array(packages, '$[*].name')::text, '')
+) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS services_search_document_idx
+    ON services USING gin (search_document);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS services_search_text_trgm_idx
+    ON services USING gin (search_text gin_trgm_ops);
@@ -0,0 +1,22 @@
+-- Migration: Add search filter columns and indexes
+-- Date: 2026-10-18
+-- Description: Support filtered vector search (category, brand, price range, in stock).
+-- in_stock is derived from the variants JSON so writers need no changes; stock values sent
+-- as strings are converted, and products without variants count as out of stock.
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS in_stock BOOLEAN GENERATED ALWAYS AS (
+    coalesce(jsonb_path_exists(variants, '$[*] ? (@.stock.double() > 0)', '{}', true), false)
+) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_categoryname_idx ON products (categoryName);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_brand_idx ON products (brand);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_baseprice_idx ON products (basePrice);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS products_in_stock_idx
+    ON products (categoryName, basePrice) WHERE in_stock;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS services_categoryname_idx ON services (categoryName);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS services_baseprice_idx ON services (basePrice);
@@ -0,0 +1,23 @@
+-- Migration: Add quantized ANN indexes on embedding tables
+-- Date: 2026-10-18
+-- Description: HNSW expression indexes on half-precision (halfvec) and binary-quantized copies
+-- of the embeddings (pgvector >= 0.7). The full vectors stay in the embedding column and are
+-- used to rescore the over-fetched candidates; the quantized copies only live in the indexes.
+-- Search uses them when VECTOR_QUANTIZATION_PRODUCTS / VECTOR_QUANTIZATION_SERVICES is set to
+-- halfvec or binary. Indexes of a level no table uses can be dropped to save space.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_embeddings_halfvec_idx
+    ON product_embeddings USING hnsw ((embedding::halfvec(768)) halfvec_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS product_embeddings_binary_idx
+    ON product_embeddings USING hnsw ((binary_quantize(embedding)::bit(768)) bit_hamming_ops)
+    WITH (m = 16, ef_construction = 64);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS service_embeddings_halfvec_idx
+    ON service_embeddings USING hnsw ((embedding::halfvec(768)) halfvec_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS service_embeddings_binary_idx
+    ON service_embeddings USING hnsw ((binary_quantize(embedding)::bit(768)) bit_hamming_ops)
+    WITH (m = 16, ef_construction = 64);
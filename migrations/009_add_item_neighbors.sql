@@ -0,0 +1,17 @@
+-- Migration: Add precomputed item neighbors
+-- Date: 2026-10-18
+-- Description: Top-k most similar products and services of every item, used by the
+-- /product/{id}/similar and /service/{id}/similar endpoints when SIMILAR_ITEMS_PRECOMPUTED is on.
+-- An item's lists are recomputed whenever it is re-embedded; run rebuild_neighbors.py to
+-- (re)compute every list, e.g. after a bulk import.
+
+CREATE TABLE IF NOT EXISTS item_neighbors (
+    source_type TEXT NOT NULL,
+    source_id TEXT NOT NULL,
+    target_type TEXT NOT NULL,
+    rank INT NOT NULL,
+    target_id TEXT NOT NULL,
+    score FLOAT NOT NULL,
+    computed_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (source_type, source_id, target_type, rank)
+);
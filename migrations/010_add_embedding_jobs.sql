@@ -0,0 +1,28 @@
+-- Migration: Add embedding jobs
+-- Date: 2026-10-18
+-- Description: Queue of items waiting for their embedding, for asynchronous ingest
+-- (POST /product?async=true, POST /service?async=true). The item row is stored at once with a
+-- pending job and without an embedding, so search leaves it out until a worker has embedded it.
+-- Workers claim pending jobs with FOR UPDATE SKIP LOCKED, so several API processes can drain the queue.
+
+CREATE TABLE IF NOT EXISTS embedding_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    item_type TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    -- The unified text to embed, built when the item was ingested
+    text TEXT NOT NULL,
+    -- pending, running, done, failed, or superseded by a newer job for the same item
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Claiming scans only unfinished jobs, oldest first
+CREATE INDEX IF NOT EXISTS embedding_jobs_unfinished_idx
+    ON embedding_jobs (id) WHERE status IN ('pending', 'running');
+
+-- Superseding looks up the open jobs of one item
+CREATE INDEX IF NOT EXISTS embedding_jobs_item_idx
+    ON embedding_jobs (item_type, item_id) WHERE status IN ('pending', 'running');
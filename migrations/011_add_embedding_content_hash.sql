@@ -0,0 +1,9 @@
+-- Migration: Add embedding content hash
+-- Date: 2026-10-18
+-- Description: Hash of the model name and the text an embedding was computed from. Writers compare it
+-- before running the model, so an item resent with identical content (the nightly catalog republish)
+-- keeps its stored embedding. Existing rows have no hash and are re-embedded on their next write.
+
+ALTER TABLE product_embeddings ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+ALTER TABLE service_embeddings ADD COLUMN IF NOT EXISTS content_hash TEXT;
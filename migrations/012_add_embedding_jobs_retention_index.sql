@@ -0,0 +1,7 @@
+-- Migration: Add embedding jobs retention index
+-- Date: 2026-10-18
+-- Description: The embedding job worker deletes done and superseded jobs once they are older than
+-- EMBEDDING_JOBS_RETENTION; this index lets it find them without scanning the whole queue.
+
+CREATE INDEX IF NOT EXISTS embedding_jobs_finished_idx
+    ON embedding_jobs (updated_at) WHERE status IN ('done', 'superseded');
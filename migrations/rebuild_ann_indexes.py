@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Rebuild the ANN (HNSW / IVFFlat) indexes on the embedding tables online.
+
+The new index is built with CREATE INDEX CONCURRENTLY next to the old one,
+then both are renamed in one short transaction (old aside, new into place) and
+the old index is dropped concurrently. There is an ANN index at every moment,
+so search and ingest keep working for the whole rebuild.
+
+Examples:
+    python rebuild_ann_indexes.py
+    python rebuild_ann_indexes.py --type ivfflat --table product_embeddings
+    python rebuild_ann_indexes.py --type hnsw --m 24 --ef-construction 128
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import asyncpg
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+EMBEDDING_TABLES = ["product_embeddings", "service_embeddings"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rebuild ANN indexes on the embedding tables")
+    parser.add_argument("--type", choices=["hnsw", "ivfflat"], default=os.getenv("ANN_INDEX_TYPE", "hnsw"),
+                        help="Index type to build (default: ANN_INDEX_TYPE or hnsw)")
+    parser.add_argument("--table", choices=EMBEDDING_TABLES, action="append",
+                        help="Only rebuild the index on this table (can be repeated)")
+    parser.add_argument("--m", type=int, default=int(os.getenv("HNSW_M", "16")),
+                        help="HNSW: max connections per layer")
+    parser.add_argument("--ef-construction", type=int, default=int(os.getenv("HNSW_EF_CONSTRUCTION", "64")),
+                        help="HNSW: candidate list size while building")
+    parser.add_argument("--lists", type=int, default=None,
+                        help="IVFFlat: number of lists (default: derived from the row count)")
+    parser.add_argument("--maintenance-work-mem", default=os.getenv("ANN_MAINTENANCE_WORK_MEM", "1GB"),
+                        help="maintenance_work_mem for the build session")
+    return parser.parse_args()
+
+
+async def suggested_lists(conn, table):
+    """pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) above that"""
+    rows = await conn.fetchval(f"SELECT COUNT(*) FROM {table}")
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+
+async def rebuild_index(conn, table, args):
+    """Build a replacement index concurrently and swap it in"""
+    index_name = f"{table}_ann_idx"
+    new_index_name = f"{index_name}_new"
+    old_index_name = f"{index_name}_old"
+
+    if args.type == "hnsw":
+        method = f"hnsw (embedding vector_cosine_ops) WITH (m = {args.m}, ef_construction = {args.ef_construction})"
+    else:
+        lists = args.lists or await suggested_lists(conn, table)
+        method = f"ivfflat (embedding vector_cosine_ops) WITH (lists = {lists})"
+
+    print(f"Rebuilding {index_name} as {method}")
+
+    # A failed concurrent build leaves an INVALID index behind, and an interrupted run its old index; clean them up first
+    await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {new_index_name}")
+    await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {old_index_name}")
+    await conn.execute(f"CREATE INDEX CONCURRENTLY {new_index_name} ON {table} USING {method}")
+    # Swap the names in one transaction: queries never see the table without an ANN index
+    async with conn.transaction():
+        await conn.execute(f"ALTER INDEX IF EXISTS {index_name} RENAME TO {old_index_name}")
+        await conn.execute(f"ALTER INDEX {new_index_name} RENAME TO {index_name}")
+    await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {old_index_name}")
+    await conn.execute(f"ANALYZE {table}")
+
+    print(f"Index {index_name} rebuilt successfully!")
+
+
+async def rebuild():
+    args = parse_args()
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        await conn.execute(f"SET maintenance_work_mem = '{args.maintenance_work_mem}'")
+        for table in args.table or EMBEDDING_TABLES:
+            await rebuild_index(conn, table, args)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(rebuild())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Recall / latency report for quantized vector search (migration 008).
+
+Stored embeddings are sampled as queries. Each quantization level (none, halfvec,
+binary) and rescore factor runs the same SQL as /search and is compared with an
+exact, index-free scan. Use it to pick VECTOR_QUANTIZATION_PRODUCTS /
+VECTOR_QUANTIZATION_SERVICES and QUANTIZATION_RESCORE_FACTOR per table.
+
+Examples:
+    python quantization_report.py
+    python quantization_report.py --type products --samples 200 --limit 20 --rescore-factor 2 --rescore-factor 8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+import asyncpg
+from dotenv import load_dotenv
+from pgvector.asyncpg import register_vector
+from app.config import settings
+from app.search_sql import ITEM_TYPES, QUANTIZATION_LEVELS, vector_query, ann_limit, used_indexes
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare recall and latency of the vector quantization levels")
+    parser.add_argument("--type", choices=list(ITEM_TYPES), action="append",
+                        help="Only report on this item type (can be repeated)")
+    parser.add_argument("--samples", type=int, default=100, help="Number of sampled query vectors")
+    parser.add_argument("--limit", type=int, default=20, help="Results per query (recall@limit)")
+    parser.add_argument("--rescore-factor", type=int, action="append",
+                        help="Over-fetch factor to try for quantized levels (can be repeated, default: 1, 2, 4, 8)")
+    parser.add_argument("--ef-search", type=int, default=settings.HNSW_EF_SEARCH,
+                        help="hnsw.ef_search (raised to the number of candidates, as in /search)")
+    return parser.parse_args()
+
+
+async def run_query(conn, sql, args, ef_search, exact=False):
+    async with conn.transaction():
+        if exact:
+            # Force a sequential scan: the exact top-k every level is measured against
+            await conn.execute("SET LOCAL enable_indexscan = off")
+            await conn.execute("SET LOCAL enable_bitmapscan = off")
+        else:
+            await conn.execute(f"SET LOCAL hnsw.ef_search = {ef_search}")
+        started = time.perf_counter()
+        rows = await conn.fetch(sql, *args)
+        elapsed = (time.perf_counter() - started) * 1000
+    return [row["id"] for row in rows], elapsed
+
+
+async def explain_indexes(conn, sql, args, ef_search):
+    async with conn.transaction():
+        await conn.execute(f"SET LOCAL hnsw.ef_search = {ef_search}")
+        plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {sql}", *args)
+    return used_indexes(json.loads(plan) if isinstance(plan, str) else plan)
+
+
+async def index_sizes(conn, table):
+    rows = await conn.fetch(
+        "SELECT indexrelname, pg_relation_size(indexrelid) AS size FROM pg_stat_user_indexes WHERE relname = $1",
+        table,
+    )
+    return {row["indexrelname"]: row["size"] for row in rows}
+
+
+async def report_type(conn, item_type, args):
+    t = ITEM_TYPES[item_type]
+    queries = [row["embedding"] for row in await conn.fetch(
+        f"SELECT embedding FROM {t['embeddings']} ORDER BY random() LIMIT $1", args.samples)]
+    if not queries:
+        print(f"\n{item_type}: no embeddings, skipped")
+        return
+
+    print(f"\n{item_type}: {len(queries)} sampled queries, recall@{args.limit}")
+    for name, size in sorted((await index_sizes(conn, t['embeddings'])).items()):
+        print(f"  index {name}: {size / 1024 / 1024:.1f} MB")
+
+    exact = []
+    for query in queries:
+        sql, sql_args = vector_query(item_type, query, args.limit, level="none")
+        ids, _ = await run_query(conn, sql, sql_args, args.ef_search, exact=True)
+        exact.append(set(ids))
+
+    print(f"  {'level':<8} {'factor':>6} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8}  index used")
+    factors = args.rescore_factor or [1, 2, 4, 8]
+    for level in QUANTIZATION_LEVELS:
+        for factor in ([1] if level == "none" else factors):
+            settings.QUANTIZATION_RESCORE_FACTOR = factor
+            ef_search = max(args.ef_search, ann_limit(item_type, args.limit, level))
+            recalls, latencies = [], []
+            for query, expected in zip(queries, exact):
+                sql, sql_args = vector_query(item_type, query, args.limit, level=level)
+                ids, elapsed = await run_query(conn, sql, sql_args, ef_search)
+                recalls.append(len(expected & set(ids)) / len(expected) if expected else 1.0)
+                latencies.append(elapsed)
+            indexes = await explain_indexes(conn, sql, sql_args, ef_search)
+            p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+            print(f"  {level:<8} {factor:>6} {statistics.mean(recalls):>7.3f} {statistics.median(latencies):>8.2f} "
+                  f"{p95:>8.2f}  {', '.join(sorted(indexes)) or 'none (sequential scan)'}")
+
+
+async def report():
+    args = parse_args()
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        await register_vector(conn)
+        for item_type in args.type or ITEM_TYPES:
+            await report_type(conn, item_type, args)
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(report())
@@ -9,6 +9,7 @@ import json
 import logging
 import os
 import sys
+import time
 from typing import Dict, Any
 import aio_pika
 from dotenv import load_dotenv
@@ -21,9 +22,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+from app.config import settings
 from app.embedding_utils import embed_text
+from app import metrics, search_cache, suggest
+from app.neighbors import refresh_neighbors
+from app.ingest_sql import content_hash, update_unchanged_item_query, upsert_item_query
+from app.item_text import product_text, service_text
 import asyncpg
-from pgvector.asyncpg import register_vector
 
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "localhost")
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", "5672"))
@@ -34,6 +39,8 @@ RABBITMQ_PROTOCOL = os.getenv("RABBITMQ_PROTOCOL", "amqp")
 
 PRODUCT_QUEUE = os.getenv("PRODUCT_QUEUE_NAME", "product_queue")
 SERVICE_QUEUE = os.getenv("SERVICE_QUEUE_NAME", "service_queue")
+# Messages processed concurrently per queue; their embeddings run behind search embeddings
+RABBITMQ_PREFETCH_COUNT = int(os.getenv("RABBITMQ_PREFETCH_COUNT", "16"))
 
 # Global database pool and shutdown flag
 db_pool = None
@@ -64,31 +71,6 @@ def convert_to_int(value):
         return 0
 
 
-def get_attribute_value(attr):
-    """Get attribute value and convert to appropriate type"""
-    if attr.get('stringValue') is not None:
-        return attr.get('stringValue')
-    elif attr.get('numberValue') is not None:
-        # Convert string number values to actual numbers
-        num_val = attr.get('numberValue')
-        if isinstance(num_val, str):
-            try:
-                # Try to convert to int first, then float
-                if '.' in num_val:
-                    return float(num_val)
-                else:
-                    return int(num_val)
-            except (ValueError, TypeError):
-                return num_val  # Return as string if conversion fails
-        return num_val
-    elif attr.get('booleanValue') is not None:
-        return attr.get('booleanValue')
-    elif attr.get('dateValue') is not None:
-        return attr.get('dateValue')
-    else:
-        return ""
-
-
 def fix_attribute_data_type(attr):
     """Fix attribute data types for storing in JSON"""
     attr_type = attr.get('type')
@@ -109,22 +91,21 @@ async def get_db_pool():
     global db_pool
     if db_pool is None:
         # Import DATABASE_URL
-        from app.db import DATABASE_URL
+        from app.db import DATABASE_URL, pool_options
         
         logger.info("Creating database pool...")
         db_pool = await asyncpg.create_pool(
             dsn=DATABASE_URL,
-            min_size=1,
-            max_size=10,
-            init=register_vector  # Register pgvector extension
+            **pool_options(settings.DATABASE_POOL_MIN_SIZE, settings.DATABASE_POOL_MAX_SIZE)
         )
+        metrics.watch_pool("consumer", db_pool)
         logger.info("✅ Database pool created")
     return db_pool
 
 
 async def process_product_data(product_data: Dict[Any, Any]):
     """
-    Process product data: store in DB and generate embeddings.
+    Process product data: generate its embedding, then store both in one statement.
     This reuses your existing logic from bulk_import.py.
     """
     # Check if product_data is valid
@@ -147,14 +128,6 @@ async def process_product_data(product_data: Dict[Any, Any]):
         # Get database pool
         pool = await get_db_pool()
         
-        # Check if product already exists
-        async with pool.acquire() as conn:
-            existing_product = await conn.fetchrow("SELECT id FROM products WHERE id = $1", product_id)
-            
-        is_update = existing_product is not None
-        action = "Updating" if is_update else "Creating"
-        logger.info(f"{action} product: {product_id}")
-        
         # Fix attributes before storing
         fixed_variants = []
         for variant in product_data.get('variants', []):
@@ -165,22 +138,11 @@ async def process_product_data(product_data: Dict[Any, Any]):
         
         fixed_attributes = [fix_attribute_data_type(attr) for attr in product_data.get('attributes', [])]
         
-        # Store product JSON in DB
-        async with pool.acquire() as conn:
-            result = await conn.execute("""
-                INSERT INTO products (id, name, barcode, description, basePrice, categoryName, brand, tags, variants, attributes)
-                VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9,$10)
-                ON CONFLICT (id) DO UPDATE SET
-                    name=EXCLUDED.name,
-                    barcode=EXCLUDED.barcode,
-                    description=EXCLUDED.description,
-                    basePrice=EXCLUDED.basePrice,
-                    categoryName=EXCLUDED.categoryName,
-                    brand=EXCLUDED.brand,
-                    tags=EXCLUDED.tags,
-                    variants=EXCLUDED.variants,
-                    attributes=EXCLUDED.attributes
-            """,
+        # The same text as the ingest endpoints and bulk_import.py build, so the content hash matches theirs
+        full_text = product_text(product_data)
+
+        # Column values in ITEM_COLUMNS["products"] order
+        record = [
             product_id,
             product_data.get('name', ''),
             product_data.get('barcode'),
@@ -190,52 +152,45 @@ async def process_product_data(product_data: Dict[Any, Any]):
             product_data.get('brand'),
             json.dumps(product_data.get('tags', [])),
             json.dumps(fixed_variants),
-            json.dumps(fixed_attributes)
-            )
-            logger.info(f"Product DB insert result: {result}")
-
-        variants_text = ""
-        for v in product_data.get('variants', []):
-            v_parts = [f"SKU: {v.get('sku', '')}", f"Price: {convert_to_float(v.get('price', 0))}", f"Stock: {convert_to_int(v.get('stock', 0))}"]
-            attr_text = []
-            for a in v.get('attributes', []):
-                val = get_attribute_value(a)
-                attr_text.append(f"{a.get('name', '')}: {val}")
-            if attr_text:
-                v_parts.append(" | ".join(attr_text))
-            variants_text += " | ".join(v_parts) + "\n"
-        
-        product_attributes_text = ""
-        for a in product_data.get('attributes', []):
-            val = get_attribute_value(a)
-            product_attributes_text += f"{a.get('name', '')}: {val}\n"
-
-        full_text = f"""
-Name: {product_data.get('name', '')}
-Description: {product_data.get('description', '')}
-Base Price: {convert_to_float(product_data.get('basePrice', 0))}
-Category: {product_data.get('categoryName', '')}
-Brand: {product_data.get('brand', '')}
-Tags: {', '.join(product_data.get('tags', []))}
-Variants:
-{variants_text}
-Product Attributes:
-{product_attributes_text}
-"""
+            json.dumps(fixed_attributes),
+        ]
+        digest = content_hash(full_text)
+
+        # Unchanged content (same hash as the stored embedding): update the changed fields, if any, and skip the model
+        async with metrics.acquire(pool, "consume", "store_unchanged") as conn:
+            stored = await conn.fetchrow(update_unchanged_item_query("products"), *record, digest)
+        if stored["unchanged_content"]:
+            metrics.INGEST_EMBEDDINGS.labels("consume", "skipped").inc()
+            if stored["updated"]:
+                # Cached search results may include the old field values
+                search_cache.invalidate()
+            logger.info(f"✅ Product {product_id} {'fields updated' if stored['updated'] else 'unchanged'}, kept its embedding")
+            return True
 
         logger.info(f"Generating embedding for product {product_id} with text length: {len(full_text)}")
         
-        embedding = await embed_text(full_text)
+        with metrics.timed("consume", "embed"):
+            embedding = await embed_text(full_text)
         logger.info(f"Generated embedding for product {product_id}, dimensions: {len(embedding) if embedding else 0}")
         
-        async with pool.acquire() as conn:
-            result = await conn.execute("""
-                INSERT INTO product_embeddings (product_id, embedding)
-                VALUES ($1,$2)
-                ON CONFLICT (product_id) DO UPDATE SET embedding=EXCLUDED.embedding
-            """, product_id, embedding)
-            logger.info(f"Product embedding DB insert result: {result}")
-            
+        # Store the product JSON and its embedding in one statement; it reports whether the product is new
+        async with metrics.acquire(pool, "consume", "store_item") as conn:
+            inserted = await conn.fetchval(upsert_item_query("products"), *record, embedding, digest)
+        metrics.INGEST_EMBEDDINGS.labels("consume", "embedded").inc()
+        is_update = not inserted
+        logger.info(f"{'Updated' if is_update else 'Created'} product row and embedding: {product_id}")
+
+        # Cached search results may include the old version of this product
+        search_cache.invalidate()
+
+        # Keep its precomputed "similar items" lists in line with the new embedding
+        with metrics.timed("consume", "neighbors"):
+            await refresh_neighbors(pool, "products", product_id)
+
+        # Typeahead suggestions for its name, brand, category and tags
+        suggest.index_item("products", product_id, product_data.get('name'), product_data.get('brand'),
+                           product_data.get('categoryName'), product_data.get('tags'))
+
         action_past = "Updated" if is_update else "Created"
         logger.info(f"✅ Successfully {action_past.lower()} product: {product_id}")
         return True
@@ -246,7 +201,7 @@ Product Attributes:
 
 async def process_service_data(service_data: Dict[Any, Any]):
     """
-    Process service data: store in DB and generate embeddings.
+    Process service data: generate its embedding, then store both in one statement.
     This reuses your existing logic from bulk_import.py.
     """
     # Check if service_data is valid
@@ -269,14 +224,6 @@ async def process_service_data(service_data: Dict[Any, Any]):
         # Get database pool
         pool = await get_db_pool()
         
-        # Check if service already exists
-        async with pool.acquire() as conn:
-            existing_service = await conn.fetchrow("SELECT id FROM services WHERE id = $1", service_id)
-            
-        is_update = existing_service is not None
-        action = "Updating" if is_update else "Creating"
-        logger.info(f"{action} service: {service_id}")
-        
         # Fix attributes before storing
         fixed_packages = []
         for package in service_data.get('packages', []):
@@ -287,20 +234,11 @@ async def process_service_data(service_data: Dict[Any, Any]):
         
         fixed_attributes = [fix_attribute_data_type(attr) for attr in service_data.get('attributes', [])]
         
-        # Store service JSON in DB
-        async with pool.acquire() as conn:
-            result = await conn.execute("""
-                INSERT INTO services (id, name, description, basePrice, categoryName, tags, packages, attributes)
-                VALUES ($1,$2,$3,$4,$5,$6,$7,$8)
-                ON CONFLICT (id) DO UPDATE SET
-                    name=EXCLUDED.name,
-                    description=EXCLUDED.description,
-                    basePrice=EXCLUDED.basePrice,
-                    categoryName=EXCLUDED.categoryName,
-                    tags=EXCLUDED.tags,
-                    packages=EXCLUDED.packages,
-                    attributes=EXCLUDED.attributes
-            """,
+        # The same text as the ingest endpoints and bulk_import.py build, so the content hash matches theirs
+        full_text = service_text(service_data)
+
+        # Column values in ITEM_COLUMNS["services"] order
+        record = [
             service_id,
             service_data.get('name', ''),
             service_data.get('description', ''),
@@ -308,51 +246,45 @@ async def process_service_data(service_data: Dict[Any, Any]):
             service_data.get('categoryName', ''),
             json.dumps(service_data.get('tags', [])),
             json.dumps(fixed_packages),
-            json.dumps(fixed_attributes)
-            )
-            logger.info(f"Service DB insert result: {result}")
-
-        packages_text = ""
-        for p in service_data.get('packages', []):
-            p_parts = [f"Package: {p.get('name', '')}", f"Price: {convert_to_float(p.get('price', 0))}", f"Description: {p.get('description', '')}"]
-            attr_text = []
-            for a in p.get('attributes', []):
-                val = get_attribute_value(a)
-                attr_text.append(f"{a.get('name', '')}: {val}")
-            if attr_text:
-                p_parts.append(" | ".join(attr_text))
-            packages_text += " | ".join(p_parts) + "\n"
-        
-        service_attributes_text = ""
-        for a in service_data.get('attributes', []):
-            val = get_attribute_value(a)
-            service_attributes_text += f"{a.get('name', '')}: {val}\n"
-
-        full_text = f"""
-Name: {service_data.get('name', '')}
-Description: {service_data.get('description', '')}
-Base Price: {convert_to_float(service_data.get('basePrice', 0))}
-Category: {service_data.get('categoryName', '')}
-Tags: {', '.join(service_data.get('tags', []))}
-Packages:
-{packages_text}
-Service Attributes:
-{service_attributes_text}
-"""
+            json.dumps(fixed_attributes),
+        ]
+        digest = content_hash(full_text)
+
+        # Unchanged content (same hash as the stored embedding): update the changed fields, if any, and skip the model
+        async with metrics.acquire(pool, "consume", "store_unchanged") as conn:
+            stored = await conn.fetchrow(update_unchanged_item_query("services"), *record, digest)
+        if stored["unchanged_content"]:
+            metrics.INGEST_EMBEDDINGS.labels("consume", "skipped").inc()
+            if stored["updated"]:
+                # Cached search results may include the old field values
+                search_cache.invalidate()
+            logger.info(f"✅ Service {service_id} {'fields updated' if stored['updated'] else 'unchanged'}, kept its embedding")
+            return True
 
         logger.info(f"Generating embedding for service {service_id} with text length: {len(full_text)}")
         
-        embedding = await embed_text(full_text)
+        with metrics.timed("consume", "embed"):
+            embedding = await embed_text(full_text)
         logger.info(f"Generated embedding for service {service_id}, dimensions: {len(embedding) if embedding else 0}")
         
-        async with pool.acquire() as conn:
-            result = await conn.execute("""
-                INSERT INTO service_embeddings (service_id, embedding)
-                VALUES ($1,$2)
-                ON CONFLICT (service_id) DO UPDATE SET embedding=EXCLUDED.embedding
-            """, service_id, embedding)
-            logger.info(f"Service embedding DB insert result: {result}")
-            
+        # Store the service JSON and its embedding in one statement; it reports whether the service is new
+        async with metrics.acquire(pool, "consume", "store_item") as conn:
+            inserted = await conn.fetchval(upsert_item_query("services"), *record, embedding, digest)
+        metrics.INGEST_EMBEDDINGS.labels("consume", "embedded").inc()
+        is_update = not inserted
+        logger.info(f"{'Updated' if is_update else 'Created'} service row and embedding: {service_id}")
+
+        # Cached search results may include the old version of this service
+        search_cache.invalidate()
+
+        # Keep its precomputed "similar items" lists in line with the new embedding
+        with metrics.timed("consume", "neighbors"):
+            await refresh_neighbors(pool, "services", service_id)
+
+        # Typeahead suggestions for its name, category and tags
+        suggest.index_item("services", service_id, service_data.get('name'), None,
+                           service_data.get('categoryName'), service_data.get('tags'))
+
         action_past = "Updated" if is_update else "Created"
         logger.info(f"✅ Successfully {action_past.lower()} service: {service_id}")
         return True
@@ -363,6 +295,7 @@ Service Attributes:
 
 async def process_product_message(message: aio_pika.IncomingMessage):
     """Process a product message from RabbitMQ"""
+    started = time.perf_counter()
     try:
         # Log the raw message body for debugging
         raw_body = message.body.decode()
@@ -380,24 +313,31 @@ async def process_product_message(message: aio_pika.IncomingMessage):
         if success:
             # Acknowledge message after successful processing
             await message.ack()
+            metrics.CONSUMER_MESSAGES.labels(PRODUCT_QUEUE, "acked").inc()
             logger.info(f"✅ Acknowledged product message: {product_data.get('id')}")
         else:
             # Reject and requeue the message so it can be retried
             await message.nack(requeue=True)
+            metrics.CONSUMER_MESSAGES.labels(PRODUCT_QUEUE, "requeued").inc()
             logger.warning(f"❌ Rejected product message (will retry): {product_data.get('id')}")
     except json.JSONDecodeError as e:
         logger.error(f"💥 Invalid JSON in product message: {e}")
         logger.info(f"Raw message body: {message.body.decode()}")
         # Reject and don't requeue invalid JSON messages
         await message.nack(requeue=False)
+        metrics.CONSUMER_MESSAGES.labels(PRODUCT_QUEUE, "rejected").inc()
     except Exception as e:
         logger.error(f"💥 Error processing product message: {e}", exc_info=True)
         # Reject and requeue the message so it can be retried
         await message.nack(requeue=True)
+        metrics.CONSUMER_MESSAGES.labels(PRODUCT_QUEUE, "requeued").inc()
+    finally:
+        metrics.observe("consume", "product_message", time.perf_counter() - started)
 
 
 async def process_service_message(message: aio_pika.IncomingMessage):
     """Process a service message from RabbitMQ"""
+    started = time.perf_counter()
     try:
         # Log the raw message body for debugging
         raw_body = message.body.decode()
@@ -416,20 +356,26 @@ async def process_service_message(message: aio_pika.IncomingMessage):
         if success:
             # Acknowledge message after successful processing
             await message.ack()
+            metrics.CONSUMER_MESSAGES.labels(SERVICE_QUEUE, "acked").inc()
             logger.info(f"✅ Acknowledged service message: {service_data.get('id')}")
         else:
             # Reject and requeue the message so it can be retried
             await message.nack(requeue=True)
+            metrics.CONSUMER_MESSAGES.labels(SERVICE_QUEUE, "requeued").inc()
             logger.warning(f"❌ Rejected service message (will retry): {service_data.get('id')}")
     except json.JSONDecodeError as e:
         logger.error(f"💥 Invalid JSON in service message: {e}")
         logger.info(f"Raw message body: {message.body.decode()}")
         # Reject and don't requeue invalid JSON messages
         await message.nack(requeue=False)
+        metrics.CONSUMER_MESSAGES.labels(SERVICE_QUEUE, "rejected").inc()
     except Exception as e:
         logger.error(f"💥 Error processing service message: {e}", exc_info=True)
         # Reject and requeue the message so it can be retried
         await message.nack(requeue=True)
+        metrics.CONSUMER_MESSAGES.labels(SERVICE_QUEUE, "requeued").inc()
+    finally:
+        metrics.observe("consume", "service_message", time.perf_counter() - started)
 
 
 async def consume_products():
@@ -456,6 +402,8 @@ async def consume_products():
         )
     
     channel = await connection.channel()
+    # Bound unacknowledged messages, so the consumer cannot flood the embedding queue
+    await channel.set_qos(prefetch_count=RABBITMQ_PREFETCH_COUNT)
     
     # Declare queue (this will create it if it doesn't exist)
     queue = await channel.declare_queue(PRODUCT_QUEUE, durable=True)
@@ -497,6 +445,8 @@ async def consume_services():
         )
     
     channel = await connection.channel()
+    # Bound unacknowledged messages, so the consumer cannot flood the embedding queue
+    await channel.set_qos(prefetch_count=RABBITMQ_PREFETCH_COUNT)
     
     # Declare queue (this will create it if it doesn't exist)
     queue = await channel.declare_queue(SERVICE_QUEUE, durable=True)
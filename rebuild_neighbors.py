@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+(Re)compute the precomputed similar-items lists (item_neighbors, migration 009) of every item.
+
+Ingest refreshes an item's own lists when it is re-embedded, but not the lists of other
+items that should now include it; run this after a bulk import and periodically
+(e.g. nightly) to pick those up and drop lists of deleted items.
+
+Examples:
+    python rebuild_neighbors.py
+    python rebuild_neighbors.py --type products --concurrency 8 --chunk-size 200
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import asyncpg
+from dotenv import load_dotenv
+from pgvector.asyncpg import register_vector
+from app.config import settings
+from app.search_sql import ITEM_TYPES
+from app.neighbors import refresh_neighbors_many
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Recompute the precomputed similar-items lists")
+    parser.add_argument("--type", choices=list(ITEM_TYPES), action="append",
+                        help="Only rebuild the lists of this item type (can be repeated)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Chunks refreshed in parallel")
+    parser.add_argument("--chunk-size", type=int, default=100, help="Items refreshed per statement")
+    return parser.parse_args()
+
+
+async def rebuild_type(pool, item_type, concurrency, chunk_size) -> int:
+    """Rebuild the lists of every item of one type. Returns the chunks that failed"""
+    t = ITEM_TYPES[item_type]
+    async with pool.acquire() as conn:
+        # Lists of deleted items
+        await conn.execute(f"""
+            DELETE FROM item_neighbors n
+            WHERE n.source_type = $1 AND NOT EXISTS (SELECT 1 FROM {t['embeddings']} e WHERE e.{t['key']} = n.source_id)
+        """, item_type)
+        item_ids = [row[t['key']] for row in await conn.fetch(f"SELECT {t['key']} FROM {t['embeddings']}")]
+
+    print(f"Rebuilding neighbors of {len(item_ids)} {item_type}...")
+    started = time.perf_counter()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def refresh(chunk):
+        async with slots:
+            return await refresh_neighbors_many(pool, item_type, chunk)
+
+    chunks = [item_ids[n:n + chunk_size] for n in range(0, len(item_ids), chunk_size)]
+    refreshed = await asyncio.gather(*(refresh(chunk) for chunk in chunks))
+    failed = refreshed.count(False)
+    if failed:
+        print(f"Neighbors of {item_type}: {failed} of {len(chunks)} chunks failed (see the log) "
+              f"in {time.perf_counter() - started:.1f}s")
+    else:
+        print(f"Neighbors of {len(item_ids)} {item_type} rebuilt in {time.perf_counter() - started:.1f}s")
+    return failed
+
+
+async def rebuild() -> int:
+    """Returns the chunks that failed, over all item types"""
+    args = parse_args()
+    # refresh_neighbors_many only writes when precomputed lists are enabled
+    settings.SIMILAR_ITEMS_PRECOMPUTED = True
+    pool = await asyncpg.create_pool(dsn=DATABASE_URL, min_size=1, max_size=args.concurrency, init=register_vector)
+    failed = 0
+    try:
+        for item_type in args.type or ITEM_TYPES:
+            failed += await rebuild_type(pool, item_type, args.concurrency, args.chunk_size)
+    finally:
+        await pool.close()
+    return failed
+
+
+if __name__ == "__main__":
+    if asyncio.run(rebuild()):
+        sys.exit(1)
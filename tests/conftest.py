@@ -0,0 +1,88 @@
+"""
+Shared test doubles. FakePool / FakeConnection stand in for asyncpg: they record every statement
+and answer it through a `handler(sql, args)` the test provides, so no database is needed.
+"""
+
+import contextlib
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# app.db refuses to import without a DSN; the fakes below never connect to it
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/homez_test")
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _answer(self, kind, sql, args):
+        self.pool.calls.append((kind, sql, args))
+        return self.pool.handler(sql, args)
+
+    async def execute(self, sql, *args, timeout=None):
+        # The handler may answer a command tag such as "DELETE 3"
+        return self._answer("execute", sql, args) or "OK"
+
+    async def executemany(self, sql, args, timeout=None):
+        self._answer("executemany", sql, args)
+
+    async def fetch(self, sql, *args, timeout=None):
+        return self._answer("fetch", sql, args) or []
+
+    async def fetchrow(self, sql, *args, timeout=None):
+        return self._answer("fetchrow", sql, args)
+
+    async def fetchval(self, sql, *args, timeout=None):
+        return self._answer("fetchval", sql, args)
+
+    async def copy_records_to_table(self, table, records, columns=None):
+        self._answer("copy", table, (list(records), columns))
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+class FakePool:
+    def __init__(self, handler=None):
+        self.handler = handler or (lambda sql, args: None)
+        self.calls = []
+
+    def acquire(self):
+        @contextlib.asynccontextmanager
+        async def acquire():
+            yield FakeConnection(self)
+        return acquire()
+
+    def get_size(self):
+        return 1
+
+    def get_idle_size(self):
+        return 1
+
+    def get_max_size(self):
+        return 1
+
+    def statements(self, kind=None):
+        return [sql for call_kind, sql, _ in self.calls if kind is None or call_kind == kind]
+
+
+@pytest.fixture
+def fake_pool():
+    return FakePool()
+
+
+class FakeClock:
+    """Stands in for the `time` module of a cache: `monotonic()` only moves when a test advances it"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
@@ -0,0 +1,71 @@
+import asyncio
+import contextlib
+
+import pytest
+
+import app.db as db
+from app.config import settings
+from tests.conftest import FakeConnection, FakePool
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    primary, replicas = FakePool(), [FakePool(), FakePool()]
+    monkeypatch.setattr(db, "pool", primary)
+    monkeypatch.setattr(db, "read_pools", replicas)
+    monkeypatch.setattr(db, "_unhealthy_replicas", set())
+    return primary, replicas
+
+
+def test_reads_rotate_over_the_replicas(replicas):
+    primary, (first, second) = replicas
+    picked = [db.read_pool() for _ in range(4)]
+    assert {id(pool) for pool in picked} == {id(first), id(second)}
+    assert picked[0] is picked[2] and picked[1] is picked[3]
+
+
+def test_an_unreachable_replica_leaves_the_rotation_until_all_fall_back_to_the_primary(replicas):
+    primary, (first, second) = replicas
+    # A failing statement is not a connection problem
+    db.report_failure(first, ValueError("syntax error"))
+    assert db.replica_stats() == {"configured": 2, "healthy": 2}
+
+    db.report_failure(first, ConnectionRefusedError())
+    assert all(db.read_pool() is second for _ in range(3))
+    db.report_failure(second, OSError("network unreachable"))
+    assert db.read_pool() is primary
+    assert db.replica_stats() == {"configured": 2, "healthy": 0}
+
+
+class ReplicaPool(FakePool):
+    """FakePool taking the acquire timeout of the health check, failing while `down`"""
+
+    down = False
+
+    def acquire(self, timeout=None):
+        @contextlib.asynccontextmanager
+        async def acquire():
+            if self.down:
+                raise ConnectionRefusedError()
+            yield FakeConnection(self)
+        return acquire()
+
+
+def test_health_checks_evict_and_restore_replicas(monkeypatch):
+    replica = ReplicaPool()
+    monkeypatch.setattr(db, "read_pools", [replica])
+    monkeypatch.setattr(db, "_unhealthy_replicas", set())
+    monkeypatch.setattr(settings, "DATABASE_READ_HEALTH_INTERVAL", 0.01)
+
+    async def run():
+        checks = asyncio.ensure_future(db._check_replicas())
+        replica.down = True
+        await asyncio.sleep(0.03)
+        evicted = set(db._unhealthy_replicas)
+        replica.down = False
+        await asyncio.sleep(0.03)
+        checks.cancel()
+        return evicted
+
+    assert asyncio.run(run()) == {0}
+    assert db._unhealthy_replicas == set()
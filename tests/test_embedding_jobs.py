@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.db as db
+from app import embedding_jobs
+from app.config import settings
+from app.ingest_sql import complete_job_query, content_hash
+from app.main import app
+from tests.conftest import FakePool
+
+
+def deleting_pool(counts: list):
+    """Pool whose successive deletes of finished jobs remove `counts` rows"""
+    remaining = list(counts)
+
+    def handler(sql, args):
+        if sql is embedding_jobs.DELETE_FINISHED_JOBS_SQL:
+            return f"DELETE {remaining.pop(0)}"
+        return None
+    return FakePool(handler)
+
+
+def test_finished_jobs_are_deleted_in_chunks_until_none_are_left(monkeypatch):
+    monkeypatch.setattr(embedding_jobs, "DELETE_FINISHED_JOBS_CHUNK", 2)
+    monkeypatch.setattr(settings, "EMBEDDING_JOBS_RETENTION", 3600)
+    pool = deleting_pool([2, 2, 1])
+    assert asyncio.run(embedding_jobs.delete_finished_jobs(pool)) == 5
+    assert [args for kind, sql, args in pool.calls] == [(3600, 2)] * 3
+
+
+@pytest.mark.parametrize("retention, deletes", [(3600, 1), (0, 0)])
+def test_worker_deletes_finished_jobs_once_per_interval(monkeypatch, retention, deletes):
+    monkeypatch.setattr(settings, "EMBEDDING_JOBS_RETENTION", retention)
+    monkeypatch.setattr(settings, "EMBEDDING_JOBS_POLL_INTERVAL", 0)
+    pool = deleting_pool([0])
+    batches = []
+
+    async def process_batch(pool):
+        batches.append(1)
+        if len(batches) == 3:
+            raise asyncio.CancelledError
+        return 0
+    monkeypatch.setattr(embedding_jobs, "process_batch", process_batch)
+
+    async def run():
+        monkeypatch.setattr(embedding_jobs, "_wakeup", asyncio.Event())
+        with pytest.raises(asyncio.CancelledError):
+            await embedding_jobs._work_loop(pool)
+
+    asyncio.run(run())
+    assert len(batches) == 3
+    assert len(pool.statements("execute")) == deletes
+
+
+def claiming_pool(jobs: list):
+    def handler(sql, args):
+        if sql is embedding_jobs.CLAIM_JOBS_SQL:
+            return jobs
+        return None
+    return FakePool(handler)
+
+
+def job(job_id: int, item_type: str, attempts: int = 1) -> dict:
+    return {"id": job_id, "item_type": item_type, "item_id": f"{item_type[0]}{job_id}", "text": f"text {job_id}",
+            "attempts": attempts}
+
+
+def test_claimed_jobs_are_embedded_together_and_stored_per_type(monkeypatch):
+    embedded = []
+
+    async def embed_texts(texts):
+        embedded.append(texts)
+        return [[float(n)] * 3 for n in range(len(texts))]
+    monkeypatch.setattr(embedding_jobs, "embed_texts", embed_texts)
+    pool = claiming_pool([job(1, "products"), job(2, "services"), job(3, "products")])
+
+    assert asyncio.run(embedding_jobs.process_batch(pool)) == 3
+    assert embedded == [["text 1", "text 2", "text 3"]]
+    stored = {sql: args for kind, sql, args in pool.calls if kind == "executemany"}
+    assert [job_id for job_id, _, _ in stored[complete_job_query("products")]] == [1, 3]
+    assert stored[complete_job_query("services")] == [(2, [1.0] * 3, content_hash("text 2"))]
+
+
+def test_failed_jobs_go_back_to_pending_until_their_attempts_are_used_up(monkeypatch):
+    async def embed_texts(texts):
+        raise RuntimeError("model crashed")
+    monkeypatch.setattr(embedding_jobs, "embed_texts", embed_texts)
+    monkeypatch.setattr(settings, "EMBEDDING_JOBS_MAX_ATTEMPTS", 3)
+    pool = claiming_pool([job(1, "products", attempts=1), job(2, "products", attempts=3)])
+
+    assert asyncio.run(embedding_jobs.process_batch(pool)) == 2
+    (kind, sql, args), = [call for call in pool.calls if call[1] is embedding_jobs.FAIL_JOBS_SQL]
+    assert args == ([1, 2], 3, "model crashed")
+    assert not [call for call in pool.calls if call[0] == "executemany"]
+
+
+def test_a_job_failing_to_store_leaves_the_rest_of_its_batch_done(monkeypatch):
+    async def embed_texts(texts):
+        return [[0.5] * 3 for _ in texts]
+    monkeypatch.setattr(embedding_jobs, "embed_texts", embed_texts)
+    monkeypatch.setattr(settings, "EMBEDDING_JOBS_MAX_ATTEMPTS", 3)
+
+    def handler(sql, args):
+        if sql is embedding_jobs.CLAIM_JOBS_SQL:
+            return [job(1, "products"), job(2, "products"), job(3, "services")]
+        if sql == complete_job_query("products"):
+            # executemany passes the arguments of every job, execute those of one
+            job_ids = [row[0] for row in args] if isinstance(args, list) else [args[0]]
+            if 2 in job_ids:
+                raise RuntimeError("violates foreign key constraint")
+        return None
+    pool = FakePool(handler)
+    refreshed = []
+
+    async def refresh_neighbors_many(pool, item_type, item_ids):
+        refreshed.extend(item_ids)
+    monkeypatch.setattr(embedding_jobs, "refresh_neighbors_many", refresh_neighbors_many)
+
+    assert asyncio.run(embedding_jobs.process_batch(pool)) == 3
+    (_, _, args), = [call for call in pool.calls if call[1] is embedding_jobs.FAIL_JOBS_SQL]
+    assert args == ([2], 3, "violates foreign key constraint")
+    assert [args[0] for kind, sql, args in pool.calls if kind == "execute" and "embedding_jobs" in sql
+            and sql is not embedding_jobs.FAIL_JOBS_SQL] == [1, 2, 3]
+    assert refreshed == ["p1", "s3"]
+
+
+def test_a_job_whose_item_was_deleted_writes_no_embedding():
+    sql = complete_job_query("products")
+    assert "EXISTS (SELECT 1 FROM products WHERE id = item_id) THEN 'done' ELSE 'superseded'" in sql
+    assert "FROM job WHERE status = 'done'" in sql
+
+
+def test_async_ingest_answers_202_with_the_queued_job(monkeypatch):
+    pool = FakePool(lambda sql, args: {"unchanged_content": False, "updated": False} if "unchanged_content" in sql
+                    else {"job_id": 42, "inserted": True})
+    monkeypatch.setattr(db, "pool", pool)
+    response = TestClient(app).post("/product/", params={"async": "true"},
+                                    json={"id": "p1", "name": "Oak Table", "categoryName": "Tables"})
+    assert response.status_code == 202
+    assert response.json() == {"status": "pending", "product_id": "p1", "job_id": 42}
+    (kind, sql, args), = [call for call in pool.calls if "INSERT INTO embedding_jobs" in call[1]]
+    # The text to embed takes the place of the embedding
+    assert args[-1].startswith("\nName: Oak Table")
+
+
+def test_job_status(monkeypatch):
+    pool = FakePool(lambda sql, args: {"id": 42, "item_type": "products", "item_id": "p1", "status": "done",
+                                       "attempts": 1, "error": None, "created_at": None, "updated_at": None}
+                    if args == (42,) else None)
+    monkeypatch.setattr(db, "pool", pool)
+    client = TestClient(app)
+    assert client.get("/jobs/42").json()["status"] == "done"
+    assert client.get("/jobs/43").status_code == 404
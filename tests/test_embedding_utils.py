@@ -0,0 +1,159 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from app import embedding_utils
+from app.embedding_utils import (
+    PRIORITY_INGEST, PRIORITY_SEARCH, EmbeddingBatcher, EmbeddingQueueFull, QueryEmbeddingCache,
+)
+from tests.conftest import FakeClock
+
+
+def vector(value: float) -> list:
+    return [value] * 768
+
+
+def test_query_cache_evicts_the_least_recently_used_entry():
+    cache = QueryEmbeddingCache(max_size=2, ttl=0)
+    cache.put("sofa", vector(1))
+    cache.put("table", vector(2))
+    assert cache.get("sofa") is not None
+    cache.put("lamp", vector(3))
+    assert cache.get("table") is None
+    assert cache.get("sofa")[0] == 1 and cache.get("lamp")[0] == 3
+    assert cache.get("sofa").dtype == np.float32
+    assert cache.stats()["size"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_query_cache_entries_expire_after_the_ttl(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(embedding_utils, "time", clock)
+    cache = QueryEmbeddingCache(max_size=10, ttl=60)
+    cache.put("sofa", vector(1))
+    clock.advance(59)
+    assert cache.get("sofa") is not None
+    clock.advance(2)
+    assert cache.get("sofa") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_query_cache_warm_file_round_trip(tmp_path, monkeypatch):
+    path = str(tmp_path / "queries.npz")
+    cache = QueryEmbeddingCache(max_size=10, ttl=0)
+    cache.put("sofa", vector(1))
+    cache.put("table", vector(2))
+    cache.save(path)
+
+    warmed = QueryEmbeddingCache(max_size=10, ttl=0)
+    warmed.load(path)
+    assert list(warmed._entries) == ["sofa", "table"]
+    assert warmed.get("table")[0] == 2
+
+    # A file written for another model is ignored
+    monkeypatch.setattr(embedding_utils, "MODEL_NAME", "another-model")
+    other = QueryEmbeddingCache(max_size=10, ttl=0)
+    other.load(path)
+    assert other.stats()["size"] == 0
+
+
+def test_concurrent_misses_for_one_query_share_a_model_call(monkeypatch):
+    monkeypatch.setattr(embedding_utils, "query_cache", QueryEmbeddingCache(max_size=10, ttl=0))
+    calls = []
+
+    async def embed_text(text, priority):
+        calls.append(text)
+        await asyncio.sleep(0.01)
+        return vector(len(calls))
+    monkeypatch.setattr(embedding_utils, "embed_text", embed_text)
+
+    async def run():
+        first = await asyncio.gather(embedding_utils.embed_query("Velvet Sofa"), embedding_utils.embed_query("velvet  sofa"))
+        again = await embedding_utils.embed_query("VELVET SOFA")
+        return first, again
+
+    (a, b), again = asyncio.run(run())
+    assert calls == ["velvet sofa"]
+    assert a == b and again == a
+
+
+class RecordingModel:
+    """Model stand-in recording the texts of every encode call"""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, texts):
+        self.batches.append(list(texts))
+        return np.array([[float(len(text))] * 3 for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = RecordingModel()
+    monkeypatch.setattr(embedding_utils, "model", model)
+    return model
+
+
+def test_concurrent_texts_are_encoded_in_batches_of_at_most_the_maximum(model):
+    batcher = EmbeddingBatcher(max_batch_size=4, window_ms=50, workers=1, max_queue=0)
+
+    async def run():
+        return await asyncio.gather(*(batcher.embed(f"text {n:02}") for n in range(10)))
+
+    embeddings = asyncio.run(run())
+    assert [len(batch) for batch in model.batches] == [4, 4, 2]
+    assert embeddings[0] == [7.0] * 3
+    assert batcher.stats()["batch_sizes"] == {2: 1, 4: 2}
+
+
+def test_a_full_batch_is_encoded_without_waiting_out_the_window(model):
+    batcher = EmbeddingBatcher(max_batch_size=4, window_ms=10_000, workers=1, max_queue=0)
+
+    async def run():
+        first = asyncio.ensure_future(batcher.embed("text 0"))
+        # The worker takes the first text and opens its window
+        await asyncio.sleep(0.01)
+        rest = [batcher.embed(f"text {n}") for n in range(1, 4)]
+        await asyncio.wait_for(asyncio.gather(first, *rest), 1)
+
+    asyncio.run(run())
+    assert model.batches == [["text 0", "text 1", "text 2", "text 3"]]
+
+
+def test_search_texts_are_encoded_before_waiting_ingest_texts(model):
+    batcher = EmbeddingBatcher(max_batch_size=2, window_ms=0, workers=1, max_queue=0)
+
+    async def run():
+        ingest = [asyncio.ensure_future(batcher.embed(f"ingest {n}", PRIORITY_INGEST)) for n in range(4)]
+        await asyncio.sleep(0)
+        search = asyncio.ensure_future(batcher.embed("search", PRIORITY_SEARCH))
+        await asyncio.gather(search, *ingest)
+
+    asyncio.run(run())
+    # The first batch was taken before the search text arrived; it jumps the rest of the queue
+    assert model.batches[1][0] == "search"
+
+
+def test_admission_is_refused_per_priority_once_the_queue_is_full(model):
+    batcher = EmbeddingBatcher(max_batch_size=8, window_ms=1000, workers=1, max_queue=2)
+
+    async def run():
+        for n in range(2):
+            asyncio.ensure_future(batcher.embed(f"ingest {n}", PRIORITY_INGEST))
+        await asyncio.sleep(0)
+        assert batcher.queue_depth(PRIORITY_INGEST) == 2
+        with pytest.raises(EmbeddingQueueFull) as error:
+            batcher.check_capacity(PRIORITY_INGEST)
+        assert error.value.priority == PRIORITY_INGEST
+        # Searches have their own allowance
+        batcher.check_capacity(PRIORITY_SEARCH)
+
+    asyncio.run(run())
+    assert batcher.stats()["rejected"] == {"search": 0, "ingest": 1}
+
+
+def test_an_unbounded_queue_never_refuses(model):
+    batcher = EmbeddingBatcher(max_batch_size=8, window_ms=0, workers=1, max_queue=0)
+    batcher.check_capacity(PRIORITY_SEARCH)
+    batcher.check_capacity(PRIORITY_INGEST)
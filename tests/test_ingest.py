@@ -0,0 +1,211 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.db as db
+from app import ingest_batch, ingest_product, search_cache
+from app.config import settings
+from app.embedding_utils import EmbeddingQueueFull
+from app.ingest_product import product_record, product_text
+from app.ingest_service import service_text
+from app.ingest_sql import ITEM_COLUMNS, content_hash, merge_staging_query, upsert_item_query
+from app.main import app
+from app.models import Package, Product, Service, Variant
+from tests.conftest import FakePool
+
+
+def product(**fields) -> Product:
+    values = {"id": "p1", "name": "Oak Table", "categoryName": "Tables", "basePrice": 100,
+              "variants": [Variant(id="v1", sku="OAK-1", price=120, stock=3)]}
+    values.update(fields)
+    return Product(**values)
+
+
+def test_content_hash_depends_on_the_text_and_the_model(monkeypatch):
+    assert content_hash("Name: Oak Table") == content_hash("Name: Oak Table")
+    assert content_hash("Name: Oak Table") != content_hash("Name: Oak Tables")
+    hashed = content_hash("Name: Oak Table")
+    monkeypatch.setattr("app.ingest_sql.MODEL_NAME", "another-model")
+    assert content_hash("Name: Oak Table") != hashed
+
+
+def test_volatile_fields_stay_out_of_the_product_text(monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_EXCLUDE_VOLATILE_FIELDS", True)
+    restocked = product(basePrice=90, variants=[Variant(id="v1", sku="OAK-1", price=99, stock=0)])
+    assert product_text(product()) == product_text(restocked)
+    assert "OAK-1" in product_text(product())
+    assert product_text(product()) != product_text(product(name="Oak Desk"))
+
+    monkeypatch.setattr(settings, "EMBEDDING_EXCLUDE_VOLATILE_FIELDS", False)
+    assert product_text(product()) != product_text(restocked)
+
+
+def test_volatile_fields_stay_out_of_the_service_text(monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_EXCLUDE_VOLATILE_FIELDS", True)
+    cleaning = Service(id="s1", name="Sofa Cleaning", categoryName="Cleaning", basePrice=50,
+                       packages=[Package(id="k1", name="Basic", price=50)])
+    repriced = Service(id="s1", name="Sofa Cleaning", categoryName="Cleaning", basePrice=60,
+                       packages=[Package(id="k1", name="Basic", price=65)])
+    assert service_text(cleaning) == service_text(repriced)
+    assert "Basic" in service_text(cleaning)
+
+
+def test_merge_only_updates_rows_that_differ():
+    sql = merge_staging_query("products")
+    assert "WHERE (products.name, products.barcode" in sql
+    assert "IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.barcode" in sql
+    # Rows with a new embedding are always written; merged but unwritten rows come back with inserted NULL
+    assert "staged.embedded" in sql
+    assert "FROM staged LEFT JOIN item" in sql
+
+
+def batch_pool(unchanged: set, merged: dict):
+    """Pool answering the hash lookup with `unchanged` ids and the merge with `merged` ({id: inserted})"""
+    def handler(sql, args):
+        if "unnest" in sql:
+            return [{"id": item_id} for item_id in args[0] if item_id in unchanged]
+        if "FROM staged LEFT JOIN item" in sql:
+            return [{"id": item_id, "inserted": inserted} for item_id, inserted in merged.items()]
+        return None
+    return FakePool(handler)
+
+
+@pytest.fixture
+def embedded(monkeypatch):
+    texts = []
+
+    async def embed_texts(batch):
+        texts.extend(batch)
+        return [[0.0] * 768 for _ in batch]
+    monkeypatch.setattr(ingest_batch, "embed_texts", embed_texts)
+    return texts
+
+
+def ingest(pool, monkeypatch, products: list):
+    monkeypatch.setattr(db, "pool", pool)
+    return asyncio.run(ingest_batch.ingest_items("products", products, product_text, product_record, lambda item: None))
+
+
+def test_batch_reports_items_with_no_differing_field_as_unchanged(monkeypatch, embedded):
+    pool = batch_pool(unchanged={"p1", "p2"}, merged={"p1": None, "p2": False, "p3": True})
+    generation = search_cache._local_generation
+    statuses = ingest(pool, monkeypatch, [product(), product(id="p2"), product(id="p3")])
+
+    assert [(s.id, s.status) for s in statuses] == [("p1", "unchanged"), ("p2", "updated"), ("p3", "created")]
+    assert statuses[1].detail == "Content unchanged, embedding kept"
+    # Only the new item is embedded, and nothing is merged twice
+    assert len(embedded) == 1
+    assert len(pool.statements("copy")) == 1
+    assert search_cache._local_generation == generation + 1
+
+
+def test_batch_writing_nothing_keeps_cached_results(monkeypatch, embedded):
+    pool = batch_pool(unchanged={"p1"}, merged={"p1": None})
+    generation = search_cache._local_generation
+    statuses = ingest(pool, monkeypatch, [product()])
+    assert statuses[0].status == "unchanged"
+    assert not embedded
+    assert search_cache._local_generation == generation
+
+
+def test_batch_ingest_is_refused_before_writing_when_the_embedding_queue_is_full(monkeypatch, embedded):
+    def check_capacity(priority):
+        raise EmbeddingQueueFull(priority)
+    monkeypatch.setattr(ingest_batch.batcher, "check_capacity", check_capacity)
+    pool = batch_pool(unchanged=set(), merged={"p1": True})
+    monkeypatch.setattr(db, "pool", pool)
+
+    response = TestClient(app).post("/product/batch", json={"products": [{"id": "p1", "name": "Oak Table", "categoryName": "Tables"}]})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert not embedded and not pool.statements("copy")
+
+
+def test_item_row_and_embedding_are_written_in_one_statement():
+    sql = upsert_item_query("products")
+    columns = len(ITEM_COLUMNS["products"])
+    assert sql.count("INSERT INTO") == 2
+    # The embedding is inserted from the item CTE, so it never exists without its row
+    assert f"SELECT id, ${columns + 1}::vector, ${columns + 2} FROM item" in sql
+    assert "UPDATE embedding_jobs SET status = 'superseded'" in sql
+
+
+@pytest.fixture
+def ingest_pool(monkeypatch):
+    """Pool for single-item ingest: the content-hash check answers with `pool.stored`"""
+    def handler(sql, args):
+        if "unchanged_content" in sql:
+            return pool.stored
+        return None
+    pool = FakePool(handler)
+    pool.stored = {"unchanged_content": False, "updated": False}
+    monkeypatch.setattr(db, "pool", pool)
+
+    async def embed_text(text):
+        pool.embedded = text
+        return [0.5] * 768
+    monkeypatch.setattr(ingest_product, "embed_text", embed_text)
+    pool.embedded = None
+    return pool
+
+
+def test_a_new_product_is_embedded_and_stored_in_one_round_trip(ingest_pool):
+    generation = search_cache._local_generation
+    response = TestClient(app).post("/product/", json={"id": "p1", "name": "Oak Table", "categoryName": "Tables"})
+    assert response.json() == {"status": "embedded", "product_id": "p1"}
+
+    stored = [(sql, args) for kind, sql, args in ingest_pool.calls if kind == "fetchval"]
+    assert [sql for sql, _ in stored] == [upsert_item_query("products")]
+    args = stored[0][1]
+    assert args[0] == "p1" and args[-2] == [0.5] * 768 and args[-1] == content_hash(ingest_pool.embedded)
+    assert search_cache._local_generation == generation + 1
+
+
+def test_batch_reports_invalid_and_duplicate_items_and_copies_the_rest_once(monkeypatch, embedded):
+    pool = batch_pool(unchanged=set(), merged={"p1": True, "p2": False})
+    statuses = ingest(pool, monkeypatch, [product(), product(id="p2"), product(name=""), product(id="p2", name="Oak Desk")])
+    assert [(s.id, s.status) for s in statuses] == [("p1", "created"), ("p2", "duplicate"), ("p1", "invalid"),
+                                                   ("p2", "updated")]
+
+    (kind, table, (records, columns)), = [call for call in pool.calls if call[0] == "copy"]
+    assert table == "products_staging"
+    assert columns[-2:] == ["embedding", "content_hash"] and "categoryname" in columns
+    # The later p2 replaced the earlier one
+    assert [(record[0], record[1]) for record in records] == [("p1", "Oak Table"), ("p2", "Oak Desk")]
+    assert len(embedded) == 2
+
+
+def test_batch_ingest_limits_the_number_of_items(monkeypatch):
+    monkeypatch.setattr(settings, "INGEST_BATCH_MAX_ITEMS", 1)
+    monkeypatch.setattr(db, "pool", FakePool())
+    response = TestClient(app).post("/product/batch", json={"products": [
+        {"id": "p1", "name": "Oak Table", "categoryName": "Tables"}, {"id": "p2", "name": "Oak Desk", "categoryName": "Desks"}]})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("updated, status", [(False, "unchanged"), (True, "fields_updated")])
+def test_a_product_with_unchanged_content_is_not_embedded_again(ingest_pool, updated, status):
+    ingest_pool.stored = {"unchanged_content": True, "updated": updated}
+    response = TestClient(app).post("/product/", json={"id": "p1", "name": "Oak Table", "categoryName": "Tables"})
+    assert response.json() == {"status": status, "product_id": "p1"}
+    assert ingest_pool.embedded is None
+    assert not [call for call in ingest_pool.calls if "::vector" in call[1]]
+
+
+def test_batch_embeds_items_whose_content_changed_after_the_hash_lookup(monkeypatch, embedded):
+    merges = [{}, {"p1": False}]
+
+    def handler(sql, args):
+        if "unnest" in sql:
+            return [{"id": "p1"}]
+        if "FROM staged LEFT JOIN item" in sql:
+            return [{"id": item_id, "inserted": inserted} for item_id, inserted in merges.pop(0).items()]
+        return None
+    pool = FakePool(handler)
+    statuses = ingest(pool, monkeypatch, [product()])
+
+    # Skipped as unchanged, not merged because another writer changed the text meanwhile: embedded after all
+    assert len(embedded) == 1
+    assert len(pool.statements("copy")) == 2
+    assert (statuses[0].status, statuses[0].detail) == ("updated", None)
@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.db as db
+import bulk_import
+import rabbitmq_consumer
+from app.config import settings
+from app.item_text import product_text, service_text
+from app.main import app
+from tests.conftest import FakePool
+
+# Raw JSON as another system sends it: nulls, and numbers as strings
+PRODUCT = {
+    "id": "p1", "name": "Oak Table", "description": None, "basePrice": "120", "categoryName": "Tables",
+    "brand": None, "tags": ["oak", "dining"],
+    "variants": [{"id": "v1", "sku": "OT-1", "price": 120, "stock": "3", "attributes": [
+        {"id": "a1", "templateId": None, "name": "Width", "dataType": "NUMBER", "numberValue": "80"},
+        {"id": "a2", "templateId": None, "name": "Foldable", "dataType": "BOOLEAN", "booleanValue": "true"},
+    ]}],
+    "attributes": [{"id": "a3", "templateId": None, "name": "Finish", "dataType": "STRING", "stringValue": "oiled"}],
+}
+SERVICE = {
+    "id": "s1", "name": "Assembly", "description": "At home", "basePrice": 40, "categoryName": "Furniture",
+    "tags": None,
+    "packages": [{"id": "k1", "name": "Basic", "price": "40", "description": None, "attributes": [
+        {"id": "a1", "templateId": None, "name": "Hours", "dataType": "NUMBER", "numberValue": 2},
+    ]}],
+    "attributes": [],
+}
+
+
+def hashing_pool():
+    """Pool recording the content hash each writer compares, and answering that the content is unchanged"""
+    def handler(sql, args):
+        if "unchanged_content" in sql:
+            pool.hashes.append(args[-1])
+            return {"unchanged_content": True, "updated": False}
+        return None
+    pool = FakePool(handler)
+    pool.hashes = []
+    return pool
+
+
+@pytest.mark.parametrize("item_type, data", [("product", PRODUCT), ("service", SERVICE)])
+def test_every_writer_hashes_an_item_identically(monkeypatch, item_type, data):
+    pool = hashing_pool()
+    monkeypatch.setattr(db, "pool", pool)
+    monkeypatch.setattr(rabbitmq_consumer, "db_pool", pool)
+
+    assert TestClient(app).post(f"/{item_type}/", json=data).json()["status"] == "unchanged"
+    assert asyncio.run(getattr(bulk_import, f"insert_{item_type}")(json.loads(json.dumps(data)))) is False
+    assert asyncio.run(getattr(rabbitmq_consumer, f"process_{item_type}_data")(json.loads(json.dumps(data)))) is True
+    assert len(pool.hashes) == 3 and len(set(pool.hashes)) == 1
+
+
+def test_nulls_render_like_missing_fields():
+    text = product_text(PRODUCT)
+    assert "None" not in text
+    assert "Brand: \n" in text and "Description: \n" in text
+    assert "SKU: OT-1 | Price: 120.0 | Stock: 3 | Width: 80.0 | Foldable: True\n" in text
+    assert "Tags: \n" in service_text(SERVICE)
+
+
+def test_volatile_fields_are_left_out_by_every_writer(monkeypatch):
+    monkeypatch.setattr(settings, "EMBEDDING_EXCLUDE_VOLATILE_FIELDS", True)
+    text = product_text(PRODUCT)
+    assert "Price" not in text and "Stock" not in text
+    assert "Package: Basic | Description:  | Hours: 2.0\n" in service_text(SERVICE)
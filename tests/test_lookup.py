@@ -0,0 +1,43 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.db as db
+from app.config import settings
+from app.main import app
+from tests.conftest import FakePool
+
+
+@pytest.fixture
+def lookup_pool(monkeypatch):
+    def handler(sql, args):
+        return [{"id": item_id, "name": item_id.upper(), "barcode": None, "description": "", "basePrice": 10,
+                 "categoryName": "Sofas", "brand": None, "tags": json.dumps(["soft"]), "variants": None,
+                 "attributes": "[]"}
+                for item_id in args[0] if item_id != "gone"]
+    pool = FakePool(handler)
+    monkeypatch.setattr(db, "pool", pool)
+    monkeypatch.setattr(db, "read_pools", [])
+    return pool
+
+
+def test_bulk_lookup_returns_products_in_request_order_with_missing_ids(lookup_pool):
+    response = TestClient(app).get("/product/", params={"ids": "p2,gone,p1,p2"})
+    assert response.status_code == 200
+    body = response.json()
+    assert [product["id"] for product in body["products"]] == ["p2", "p1"]
+    assert body["missing"] == ["gone"]
+    assert body["products"][0]["tags"] == ["soft"] and body["products"][0]["variants"] == []
+    # One query for every id, repeated ids asked once
+    (kind, sql, args), = lookup_pool.calls
+    assert args == (["p2", "gone", "p1"],)
+
+
+def test_bulk_lookup_limits_the_number_of_ids(lookup_pool, monkeypatch):
+    monkeypatch.setattr(settings, "BULK_LOOKUP_MAX_IDS", 2)
+    assert TestClient(app).get("/product/", params={"ids": "a,b,c"}).status_code == 400
+
+
+def test_search_rejects_unknown_fields(lookup_pool):
+    assert TestClient(app).get("/search/", params={"query": "sofa", "fields": "name,price"}).status_code == 400
@@ -0,0 +1,38 @@
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+import app.db as db
+from app import metrics
+from app.main import app
+from tests.conftest import FakePool
+
+
+def requests_seen(route: str, status: str) -> float:
+    return REGISTRY.get_sample_value("homez_http_request_duration_seconds_count",
+                                     {"method": "GET", "route": route, "status": status}) or 0
+
+
+def test_requests_are_labelled_with_their_route_template(monkeypatch):
+    monkeypatch.setattr(db, "pool", FakePool())
+    monkeypatch.setattr(db, "read_pools", [])
+    before = requests_seen("/jobs/{job_id}", "404")
+    assert TestClient(app).get("/jobs/7").status_code == 404
+    assert requests_seen("/jobs/{job_id}", "404") == before + 1
+
+    # A path parameter equal to the text of a later segment is no longer put in the wrong place
+    before = requests_seen("/product/{product_id}/similar", "404")
+    assert TestClient(app).get("/product/similar/similar").status_code == 404
+    assert requests_seen("/product/{product_id}/similar", "404") == before + 1
+
+
+def test_unmatched_requests_share_one_label():
+    assert metrics.route_template({"type": "http", "path": "/nowhere/42"}) == "unmatched"
+
+
+def test_stage_timings_are_exposed_at_metrics():
+    with metrics.timed("search", "embed"):
+        pass
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'homez_stage_duration_seconds_count{operation="search",stage="embed"}' in response.text
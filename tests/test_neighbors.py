@@ -0,0 +1,76 @@
+import asyncio
+import subprocess
+import sys
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+import app.db as db
+import rebuild_neighbors
+from app import neighbors
+from app.config import settings
+from app.main import app
+from tests.conftest import FakePool
+
+
+def test_rebuild_neighbors_does_not_load_the_model():
+    # The model module is imported by app.embedding_utils only
+    check = "import sys, rebuild_neighbors; assert 'app.embedding_utils' not in sys.modules, sorted(sys.modules)"
+    subprocess.run([sys.executable, "-c", check], cwd=Path(__file__).parents[1], check=True)
+
+
+def test_refresh_neighbors_replaces_the_list_of_every_target_type(monkeypatch):
+    monkeypatch.setattr(settings, "SIMILAR_ITEMS_PRECOMPUTED", True)
+    pool = FakePool()
+    asyncio.run(neighbors.refresh_neighbors(pool, "products", "p1"))
+    statements = pool.statements("execute")
+    assert "set_config" in statements[0]
+    assert statements[1].startswith("DELETE FROM item_neighbors")
+    assert len([sql for sql in statements if "INSERT INTO item_neighbors" in sql]) == 2
+
+
+def test_refresh_of_many_items_takes_one_statement_per_target_type(monkeypatch):
+    monkeypatch.setattr(settings, "SIMILAR_ITEMS_PRECOMPUTED", True)
+    pool = FakePool()
+    item_ids = [f"p{n}" for n in range(1000)]
+    asyncio.run(neighbors.refresh_neighbors_many(pool, "products", item_ids))
+    assert len(pool.statements("execute")) == 4
+    inserts = [args for kind, sql, args in pool.calls if "INSERT INTO item_neighbors" in sql]
+    assert inserts == [(item_ids, settings.SIMILAR_ITEMS_PRECOMPUTED_K)] * 2
+
+
+def test_refresh_neighbors_is_off_without_precomputed_lists(monkeypatch):
+    monkeypatch.setattr(settings, "SIMILAR_ITEMS_PRECOMPUTED", False)
+    pool = FakePool()
+    asyncio.run(neighbors.refresh_neighbors(pool, "products", "p1"))
+    assert not pool.calls
+
+
+def test_precomputed_neighbors_are_read_with_the_item_and_limit(monkeypatch):
+    def handler(sql, args):
+        if "FROM item_neighbors n" in sql:
+            return [{"id": "p2", "score": 0.9}]
+        return []
+    pool = FakePool(handler)
+    monkeypatch.setattr(db, "pool", pool)
+    monkeypatch.setattr(db, "read_pools", [])
+    monkeypatch.setattr(settings, "SIMILAR_ITEMS_PRECOMPUTED", True)
+
+    response = TestClient(app).get("/product/p1/similar", params={"limit": 5})
+    assert response.status_code == 200
+    assert [item["id"] for item in response.json()["products"]] == ["p2"]
+    assert [args for kind, sql, args in pool.calls if "FROM item_neighbors n" in sql] == [("p1", 5)]
+
+
+def test_rebuild_counts_the_chunks_that_failed(monkeypatch):
+    def handler(sql, args):
+        if sql.startswith("SELECT product_id"):
+            return [{"product_id": f"p{n}"} for n in range(5)]
+        # The chunk holding p2 times out
+        if "INSERT INTO item_neighbors" in sql and "p2" in args[0]:
+            raise TimeoutError("canceling statement due to statement timeout")
+        return None
+    monkeypatch.setattr(settings, "SIMILAR_ITEMS_PRECOMPUTED", True)
+    pool = FakePool(handler)
+    assert asyncio.run(rebuild_neighbors.rebuild_type(pool, "products", concurrency=2, chunk_size=2)) == 1
+    assert asyncio.run(neighbors.refresh_neighbors_many(pool, "products", ["p0"])) is True
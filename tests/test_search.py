@@ -0,0 +1,387 @@
+import asyncio
+import base64
+import contextlib
+import json
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import app.db as db
+from app import search, search_cache
+from app.config import settings
+from app.embedding_utils import PRIORITY_SEARCH, EmbeddingQueueFull
+from app.main import app
+from tests.conftest import FakeConnection, FakePool
+
+
+def search_handler(sql, args):
+    if "catalog_version_seq" in sql:
+        return {"last_value": 1, "is_called": True}
+    if sql.startswith("EXPLAIN"):
+        return json.dumps([{"Plan": {"Node Type": "Limit", "Plans": []}, "Execution Time": 1.0}])
+    if "<=>" in sql:
+        return [{"id": f"v{n}", "distance": 0.1 * n, "score": 1 - 0.1 * n} for n in range(1, 4)]
+    return []
+
+
+@pytest.fixture
+def search_pool(monkeypatch):
+    pool = FakePool(search_handler)
+    monkeypatch.setattr(db, "pool", pool)
+    monkeypatch.setattr(db, "read_pools", [])
+    monkeypatch.setattr(settings, "SEARCH_DEBUG_TOKEN", "secret")
+    monkeypatch.setattr(settings, "SEARCH_BACKEND", "postgres")
+
+    async def embed_query(query):
+        return [0.0] * 768
+    monkeypatch.setattr(search, "embed_query", embed_query)
+    search_cache.invalidate()
+    yield pool
+    search_cache.result_cache._entries.clear()
+
+
+def recall_settings(pool) -> list:
+    """The set_config(name, value) pairs of every recall-settings statement, in order"""
+    applied = []
+    for kind, sql, args in pool.calls:
+        if kind == "execute" and "set_config" in sql:
+            applied.append(dict(zip(args[::2], args[1::2])))
+    return applied
+
+
+def test_debug_explain_uses_the_recall_settings_of_a_filtered_search(search_pool):
+    client = TestClient(app)
+    response = client.get("/search/", params={"query": "sofa", "debug": "true", "category": "Furniture"},
+                          headers={"X-Debug-Token": "secret"})
+    assert response.status_code == 200
+
+    explained = response.json()["debug"]["legs"]
+    assert explained and all(leg["ef_search"] == settings.HNSW_EF_SEARCH for leg in explained.values())
+    # The EXPLAIN statements run under the same settings as the legs themselves
+    applied = recall_settings(search_pool)
+    legs, explains = applied[:len(applied) // 2], applied[len(applied) // 2:]
+    # (only the legs run under the request's time budget)
+    assert explains == [{name: value for name, value in s.items() if name != "statement_timeout"} for s in legs]
+    assert all(s["hnsw.ef_search"] == str(settings.HNSW_EF_SEARCH) and "hnsw.iterative_scan" in s for s in explains)
+
+
+def test_debug_explain_keeps_ef_search_and_probes_overrides(search_pool):
+    client = TestClient(app)
+    response = client.get("/search/", params={"query": "sofa", "debug": "true", "ef_search": 100, "probes": 7},
+                          headers={"X-Debug-Token": "secret"})
+    assert response.status_code == 200
+    applied = recall_settings(search_pool)
+    assert applied and all(s["hnsw.ef_search"] == "100" and s["ivfflat.probes"] == "7" for s in applied)
+    assert all("hnsw.iterative_scan" not in s for s in applied)
+
+
+@pytest.mark.parametrize("limit", [0, -1, 1001])
+def test_search_rejects_out_of_range_limits(search_pool, limit):
+    response = TestClient(app).get("/search/", params={"query": "sofa", "limit": limit})
+    assert response.status_code == 422
+
+
+def test_next_page_cursor_without_rows_ends_paging():
+    rows_by_leg = {"products_vector": [], "services_vector": []}
+    assert search.next_page_cursor("sofa", search.SearchFilters(), rows_by_leg, set(), 0, None) is None
+    assert search.next_page_cursor("sofa", search.SearchFilters(), rows_by_leg, set(), 20, None) is None
+
+
+def test_catalog_version_is_read_from_the_primary(search_pool, monkeypatch):
+    replica = FakePool(search_handler)
+    monkeypatch.setattr(db, "read_pools", [replica])
+    monkeypatch.setattr(search_cache, "_db_checked_at", float("-inf"))
+
+    response = TestClient(app).get("/search/", params={"query": "sofa"})
+    assert response.status_code == 200
+    # The search itself runs on the replica, the version poll on the primary
+    assert any("<=>" in sql for _, sql, _ in replica.calls)
+    assert not any("catalog_version_seq" in sql for _, sql, _ in replica.calls)
+    assert any("catalog_version_seq" in sql for _, sql, _ in search_pool.calls)
+
+
+class CountingPool(FakePool):
+    """FakePool that holds each connection briefly and records how many were held at once"""
+
+    def __init__(self, handler=None):
+        super().__init__(handler)
+        self.held = 0
+        self.most_held = 0
+
+    def acquire(self):
+        @contextlib.asynccontextmanager
+        async def acquire():
+            self.held += 1
+            self.most_held = max(self.most_held, self.held)
+            try:
+                await asyncio.sleep(0.01)
+                yield FakeConnection(self)
+            finally:
+                self.held -= 1
+        return acquire()
+
+
+def legs(count: int) -> list:
+    return [search.SearchLeg(f"leg{n}", f"SELECT {n} <=> $1", ("v",)) for n in range(count)]
+
+
+@pytest.mark.parametrize("fanout, most_held", [(4, 4), (2, 2), (1, 1)])
+def test_legs_run_concurrently_up_to_the_connection_limit(monkeypatch, fanout, most_held):
+    monkeypatch.setattr(settings, "SEARCH_MAX_CONNECTIONS_PER_REQUEST", fanout)
+    pool = CountingPool(search_handler)
+    rows_by_leg, timings = asyncio.run(search.run_search_legs(pool, legs(4), 3))
+    assert pool.most_held == most_held
+    assert set(rows_by_leg) == set(timings) == {"leg0", "leg1", "leg2", "leg3"}
+    assert all(len(rows) == 3 for rows in rows_by_leg.values())
+
+
+def test_a_failed_leg_yields_no_rows_without_failing_the_others():
+    def handler(sql, args):
+        if "1 <=>" in sql:
+            raise RuntimeError("relation does not exist")
+        return search_handler(sql, args)
+    rows_by_leg, timings = asyncio.run(search.run_search_legs(FakePool(handler), legs(2), 3))
+    assert rows_by_leg["leg1"] == [] and "leg1" not in timings
+    assert len(rows_by_leg["leg0"]) == 3
+
+
+def test_repeated_searches_are_served_from_the_cache_until_a_write(search_pool):
+    client = TestClient(app)
+    first = client.get("/search/", params={"query": "sofa"}).json()
+    searched = len(search_pool.statements("fetch"))
+    again = client.get("/search/", params={"query": "Sofa "}).json()
+    assert again["served_by"] == "cache"
+    assert again["products"] == first["products"]
+    assert len(search_pool.statements("fetch")) == searched
+
+    search_cache.invalidate()
+    assert client.get("/search/", params={"query": "sofa"}).json()["served_by"] != "cache"
+
+
+def test_reciprocal_rank_fusion_favours_items_ranked_well_in_both_lists():
+    vector_rows = [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+    lexical_rows = [{"id": "c"}, {"id": "b"}, {"id": "d"}]
+    fused = search.reciprocal_rank_fusion([vector_rows, lexical_rows], limit=3, k=60)
+    assert [row["id"] for row, _ in fused] == ["c", "b", "a"]
+    assert fused[0][1] == pytest.approx(1 / 63 + 1 / 61)
+    assert fused[2][1] == pytest.approx(1 / 61)
+    assert search.reciprocal_rank_fusion([vector_rows], limit=2, k=60) == [
+        (vector_rows[0], pytest.approx(1 / 61)), (vector_rows[1], pytest.approx(1 / 62))]
+
+
+@pytest.mark.parametrize("query, identifier", [
+    ("WH-001-BLK", True), ("1234567890123", True), ("velvet sofa", False), ("sofa", False), ("3 seat sofa", False),
+])
+def test_identifier_queries_are_recognized(query, identifier):
+    assert search.looks_like_identifier(query) is identifier
+
+
+def test_hybrid_ranking_fuses_the_vector_and_lexical_legs(search_pool):
+    def handler(sql, args):
+        if "websearch_to_tsquery" in sql:
+            return [{"id": "v3", "score": 0.9}, {"id": "w1", "score": 0.5}]
+        return search_handler(sql, args)
+    search_pool.handler = handler
+
+    body = TestClient(app).get("/search/", params={"query": "sofa", "ranking": "hybrid", "limit": 4}).json()
+    assert body["ranking"] == "hybrid"
+    # v3 is in both lists; w1 only matched lexically and ties with v2, which was ranked first
+    assert [item["id"] for item in body["products"]] == ["v3", "v1", "v2", "w1"]
+
+
+def test_a_products_only_filter_leaves_the_services_leg_out(search_pool):
+    body = TestClient(app).get("/search/", params={"query": "sofa", "brand": "Acme"}).json()
+    assert body["services"] == [] and len(body["products"]) == 3
+    searched = [(sql, args) for kind, sql, args in search_pool.calls if kind == "fetch" and "<=>" in sql]
+    assert len(searched) == 1
+    sql, args = searched[0]
+    assert "FROM product_embeddings" in sql and "i.brand = $" in sql and "Acme" in args
+
+
+def test_batch_search_embeds_all_queries_together_and_searches_in_one_statement(search_pool, monkeypatch):
+    embedded = []
+
+    async def embed_queries(queries):
+        embedded.append(queries)
+        return [[0.5] * 3 for _ in queries]
+    monkeypatch.setattr(search, "embed_queries", embed_queries)
+
+    def handler(sql, args):
+        if "unnest" in sql:
+            return [{"ord": 2, "item_type": "services", "id": "s1", "score": 0.8},
+                    {"ord": 1, "item_type": "products", "id": "p1", "score": 0.9}]
+        return None
+    search_pool.handler = handler
+
+    response = TestClient(app).post("/search/batch", json={"queries": [
+        {"query": "sofa", "limit": 5}, {"query": "cleaning", "limit": 3, "category": "Cleaning"}]})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [item["id"] for item in results[0]["products"]] == ["p1"]
+    assert [item["id"] for item in results[1]["services"]] == ["s1"]
+
+    assert embedded == [["sofa", "cleaning"]]
+    (sql, args), = [(sql, args) for kind, sql, args in search_pool.calls if kind == "fetch"]
+    columns = dict(zip(search.BATCH_QUERY_COLUMNS, args))
+    assert columns["embedding"] == ["[0.5,0.5,0.5]"] * 2
+    assert columns["lim"] == [5, 3] and columns["category"] == [None, "Cleaning"]
+
+
+def test_batch_search_rejects_too_many_queries(search_pool, monkeypatch):
+    monkeypatch.setattr(settings, "SEARCH_BATCH_MAX_QUERIES", 2)
+    response = TestClient(app).post("/search/batch", json={"queries": [{"query": "sofa"}] * 3})
+    assert response.status_code == 400
+
+
+def test_quantized_legs_raise_ef_search_to_their_over_fetch(search_pool, monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION_PRODUCTS", "halfvec")
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION_SERVICES", "none")
+    monkeypatch.setattr(settings, "QUANTIZATION_RESCORE_FACTOR", 4)
+    monkeypatch.setattr(settings, "HNSW_EF_SEARCH", 40)
+    assert TestClient(app).get("/search/", params={"query": "sofa", "limit": 30}).status_code == 200
+    assert sorted(s["hnsw.ef_search"] for s in recall_settings(search_pool)) == ["120", "40"]
+
+
+def test_cursor_round_trip():
+    filters = search.SearchFilters(category="Sofas")
+    after = {"products": [0.25, "p9"], "services": None}
+    cursor = search.encode_cursor("Velvet Sofa", filters, after, 20)
+    page = search.decode_cursor(cursor, "velvet  sofa", filters)
+    assert page["after"] == after and page["served"] == 20
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "e30=", base64.urlsafe_b64encode(b'{"after": {"products": [1]}, "served": 0}').decode()])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        search.decode_cursor(cursor, "sofa", search.SearchFilters())
+    assert error.value.status_code == 400
+
+
+def test_a_cursor_only_continues_its_own_query_and_filters():
+    cursor = search.encode_cursor("sofa", search.SearchFilters(), {"products": [0.1, "p1"]}, 20)
+    for query, filters in [("table", search.SearchFilters()), ("sofa", search.SearchFilters(brand="Acme"))]:
+        with pytest.raises(HTTPException) as error:
+            search.decode_cursor(cursor, query, filters)
+        assert "does not belong" in error.value.detail
+
+
+def test_next_page_cursor_continues_after_the_last_row_of_full_pages():
+    rows_by_leg = {"products_vector": [{"id": "p1", "distance": 0.1}, {"id": "p2", "distance": 0.2}],
+                   "services_vector": [{"id": "s1", "distance": 0.3}]}
+    cursor = search.next_page_cursor("sofa", search.SearchFilters(), rows_by_leg, set(), 2, None)
+    page = search.decode_cursor(cursor, "sofa", search.SearchFilters())
+    # Services returned less than a page: they are exhausted
+    assert page["after"] == {"products": [0.2, "p2"], "services": None}
+    assert page["served"] == 2
+
+
+def test_later_pages_skip_served_rows_with_a_keyset_condition(search_pool):
+    cursor = search.encode_cursor("sofa", search.SearchFilters(), {"products": [0.2, "p2"], "services": None}, 20)
+    response = TestClient(app).get("/search/", params={"query": "sofa", "cursor": cursor})
+    assert response.status_code == 200
+    (sql, args), = [(sql, args) for kind, sql, args in search_pool.calls if kind == "fetch" and "<=>" in sql]
+    assert "FROM product_embeddings" in sql and "(e.embedding <=> $1, i.id) > ($3::float8, $4::text)" in sql
+    assert args[2:] == (0.2, "p2")
+
+    hybrid = TestClient(app).get("/search/", params={"query": "sofa", "cursor": cursor, "ranking": "hybrid"})
+    assert hybrid.status_code == 400
+
+
+def test_unified_mode_returns_one_list_across_types(search_pool):
+    def handler(sql, args):
+        if "UNION ALL" in sql:
+            return [{"item_type": "services", "id": "s1", "distance": 0.1, "score": 0.9},
+                    {"item_type": "products", "id": "p1", "distance": 0.2, "score": 0.8}]
+        return search_handler(sql, args)
+    search_pool.handler = handler
+
+    body = TestClient(app).get("/search/", params={"query": "sofa", "mode": "unified", "limit": 2}).json()
+    assert [(item["type"], item["id"]) for item in body["results"]] == [("service", "s1"), ("product", "p1")]
+    assert body["products"] == body["services"] == []
+    assert len([sql for sql in search_pool.statements("fetch") if "<=>" in sql]) == 1
+
+
+@pytest.mark.parametrize("configured, presented", [("secret", None), ("secret", "guess"), ("", "secret")])
+def test_debug_mode_needs_the_configured_token(search_pool, monkeypatch, configured, presented):
+    monkeypatch.setattr(settings, "SEARCH_DEBUG_TOKEN", configured)
+    headers = {"X-Debug-Token": presented} if presented else {}
+    response = TestClient(app).get("/search/", params={"query": "sofa", "debug": "true"}, headers=headers)
+    assert response.status_code == 403
+    assert not search_pool.calls
+
+
+def lexical_handler(sql, args):
+    if "websearch_to_tsquery" in sql:
+        return [{"id": "w1", "score": 0.5}]
+    return search_handler(sql, args)
+
+
+def test_a_query_not_embedded_in_time_is_answered_lexically(search_pool, monkeypatch):
+    async def slow_embed_query(query):
+        await asyncio.sleep(1)
+    monkeypatch.setattr(search, "embed_query", slow_embed_query)
+    search_pool.handler = lexical_handler
+
+    body = TestClient(app).get("/search/", params={"query": "sofa", "deadline_ms": 100}).json()
+    assert body["served_by"] == "lexical"
+    assert [item["id"] for item in body["products"]] == ["w1"]
+    # The cursor asks for the first vector page again
+    page = search.decode_cursor(body["next_cursor"], "sofa", search.SearchFilters())
+    assert page["after"]["products"] == search.CURSOR_START and page["served"] == 20
+
+
+def test_failed_vector_legs_are_retried_with_reduced_recall(search_pool):
+    attempts = []
+
+    def handler(sql, args):
+        if "<=>" in sql:
+            attempts.append(sql)
+            if len(attempts) <= 2:
+                raise asyncio.TimeoutError
+        return search_handler(sql, args)
+    search_pool.handler = handler
+
+    body = TestClient(app).get("/search/", params={"query": "sofa", "limit": 3}).json()
+    assert body["served_by"] == "reduced_recall"
+    assert len(body["products"]) == 3
+    assert [s["ivfflat.probes"] for s in recall_settings(search_pool)][-2:] == [str(search.DEGRADED_PROBES)] * 2
+
+
+def test_the_last_result_is_served_stale_when_the_search_fails(search_pool):
+    client = TestClient(app)
+    fresh = client.get("/search/", params={"query": "sofa"}).json()
+    search_cache.invalidate()
+
+    def handler(sql, args):
+        if "<=>" in sql:
+            raise asyncio.TimeoutError
+        return search_handler(sql, args)
+    search_pool.handler = handler
+
+    body = client.get("/search/", params={"query": "sofa"}).json()
+    assert body["served_by"] == "stale_cache"
+    assert body["products"] == fresh["products"]
+
+
+def test_nothing_searched_in_time_answers_503(search_pool):
+    def handler(sql, args):
+        if "<=>" in sql or "websearch_to_tsquery" in sql:
+            raise asyncio.TimeoutError
+        return search_handler(sql, args)
+    search_pool.handler = handler
+
+    response = TestClient(app).get("/search/", params={"query": "sofa"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def test_a_full_embedding_queue_sheds_the_search_to_lexical_matching(search_pool, monkeypatch):
+    async def embed_query(query):
+        raise EmbeddingQueueFull(PRIORITY_SEARCH)
+    monkeypatch.setattr(search, "embed_query", embed_query)
+    search_pool.handler = lexical_handler
+
+    body = TestClient(app).get("/search/", params={"query": "sofa"}).json()
+    assert body["served_by"] == "lexical"
+    assert not [sql for sql in search_pool.statements("fetch") if "<=>" in sql]
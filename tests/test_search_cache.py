@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from app import search_cache
+from app.config import settings
+from app.search_cache import SearchResultCache
+from tests.conftest import FakeClock, FakePool
+
+
+def test_entries_only_match_the_catalog_version_they_were_computed_at():
+    cache = SearchResultCache(max_size=10, ttl=0)
+    cache.put(("sofa",), (0, 5), "result")
+    assert cache.get(("sofa",), (0, 5)) == "result"
+    assert cache.get(("sofa",), (1, 5)) is None
+    assert cache.get(("sofa",), (0, 6)) is None
+    # Outdated entries stay available as a fallback
+    assert cache.get_stale(("sofa",)) == "result"
+    assert cache.stats()["stale_hits"] == 1
+
+
+def test_entries_expire_and_are_evicted_least_recently_used_first(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(search_cache, "time", clock)
+    cache = SearchResultCache(max_size=2, ttl=30)
+    cache.put(("sofa",), (0, 1), "sofas")
+    cache.put(("table",), (0, 1), "tables")
+    assert cache.get(("sofa",), (0, 1)) == "sofas"
+    cache.put(("lamp",), (0, 1), "lamps")
+    assert cache.get(("table",), (0, 1)) is None
+    clock.advance(31)
+    assert cache.get(("sofa",), (0, 1)) is None
+
+
+def test_keys_normalize_the_query_and_include_every_parameter():
+    assert search_cache.make_key("Velvet  Sofa", limit=10) == search_cache.make_key("velvet sofa", limit=10)
+    assert search_cache.make_key("sofa", limit=10) != search_cache.make_key("sofa", limit=20)
+
+
+@pytest.fixture
+def version_pool(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(search_cache, "time", clock)
+    monkeypatch.setattr(settings, "SEARCH_CACHE_MAX_STALENESS", 5)
+    monkeypatch.setattr(search_cache, "_db_checked_at", float("-inf"))
+    monkeypatch.setattr(search_cache, "_db_check_lock", None)
+    versions = [7, 8]
+    pool = FakePool(lambda sql, args: {"last_value": versions[0], "is_called": True})
+    pool.versions, pool.clock = versions, clock
+    return pool
+
+
+def test_database_version_is_polled_at_most_every_max_staleness(version_pool):
+    generation = search_cache._local_generation
+    assert asyncio.run(search_cache.current_version(version_pool)) == (generation, 7)
+    version_pool.versions.pop(0)
+    version_pool.clock.advance(4)
+    assert asyncio.run(search_cache.current_version(version_pool)) == (generation, 7)
+    version_pool.clock.advance(1)
+    assert asyncio.run(search_cache.current_version(version_pool)) == (generation, 8)
+    assert len(version_pool.calls) == 2
+
+
+def test_local_writes_change_the_version_at_once(version_pool):
+    before = asyncio.run(search_cache.current_version(version_pool))
+    search_cache.invalidate()
+    assert asyncio.run(search_cache.current_version(version_pool)) == (before[0] + 1, before[1])
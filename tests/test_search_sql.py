@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+
+import pytest
+
+from app import search_sql
+from app.config import settings
+from app.search import SearchFilters
+from migrations import rebuild_ann_indexes
+from tests.conftest import FakePool
+
+
+def applied_settings(limit: int, **options) -> dict:
+    """The {name: value} pairs apply_recall_settings sets for a search of `limit` rows"""
+    pool = FakePool()
+
+    async def run():
+        async with pool.acquire() as conn:
+            await search_sql.apply_recall_settings(conn, limit, **options)
+    asyncio.run(run())
+    (kind, sql, args), = pool.calls
+    assert sql.count("set_config") == len(args) // 2
+    return dict(zip(args[::2], args[1::2]))
+
+
+@pytest.mark.parametrize("limit, ef_search, expected", [
+    (10, None, 40), (100, None, 100), (10, 200, 200), (5000, None, search_sql.HNSW_MAX_EF_SEARCH),
+])
+def test_ef_search_covers_the_limit_within_the_pgvector_maximum(monkeypatch, limit, ef_search, expected):
+    monkeypatch.setattr(settings, "HNSW_EF_SEARCH", 40)
+    assert search_sql.effective_ef_search(limit, ef_search) == expected
+    assert applied_settings(limit, ef_search=ef_search)["hnsw.ef_search"] == str(expected)
+
+
+def test_recall_settings_are_set_in_one_statement(monkeypatch):
+    monkeypatch.setattr(settings, "IVFFLAT_PROBES", 10)
+    assert applied_settings(20) == {"hnsw.ef_search": str(max(settings.HNSW_EF_SEARCH, 20)), "ivfflat.probes": "10"}
+    assert applied_settings(20, probes=3)["ivfflat.probes"] == "3"
+
+
+def test_filtered_searches_use_iterative_index_scans(monkeypatch):
+    monkeypatch.setattr(settings, "ANN_ITERATIVE_SCAN", "strict_order")
+    applied = applied_settings(20, filtered=True)
+    assert applied["hnsw.iterative_scan"] == "strict_order"
+    assert applied["ivfflat.iterative_scan"] == "relaxed_order"
+
+    monkeypatch.setattr(settings, "ANN_ITERATIVE_SCAN", "off")
+    assert "hnsw.iterative_scan" not in applied_settings(20, filtered=True)
+
+
+def test_statement_timeout_is_set_in_milliseconds():
+    assert applied_settings(20, statement_timeout=0.25)["statement_timeout"] == "250"
+    assert applied_settings(20, statement_timeout=0.0001)["statement_timeout"] == "1"
+
+
+def filters(**values) -> SearchFilters:
+    return SearchFilters(**values)
+
+
+def test_filters_become_numbered_conditions_inside_the_vector_scan(monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION_PRODUCTS", "none")
+    sql, args = search_sql.vector_query("products", "[0.1]", 10, filters(category="Sofas", min_price=100, in_stock=True))
+    assert args == ("[0.1]", 10, "Sofas", 100)
+    assert "WHERE i.categoryName = $3 AND i.basePrice >= $4 AND i.in_stock" in sql
+    # The filters sit inside the index-ordered scan, not on its output
+    assert sql.index("WHERE") < sql.index("ORDER BY e.embedding <=> $1")
+    assert "NOT i.in_stock" in search_sql.vector_query("products", "[0.1]", 10, filters(in_stock=False))[0]
+
+
+def test_types_without_a_filter_are_skipped():
+    assert search_sql.supports_filters("services", filters(category="Cleaning", max_price=80))
+    assert not search_sql.supports_filters("services", filters(brand="Acme"))
+    assert not search_sql.supports_filters("services", filters(in_stock=True))
+    assert search_sql.supports_filters("products", filters(brand="Acme", in_stock=True))
+    assert search_sql.active_filters(filters(brand="Acme")) == {"brand": "Acme"}
+
+
+@pytest.mark.parametrize("level, order", [
+    ("halfvec", "ORDER BY e.embedding::halfvec(768) <=> $1::vector::halfvec(768)"),
+    ("binary", "ORDER BY binary_quantize(e.embedding)::bit(768) <~> binary_quantize($1::vector)::bit(768)"),
+])
+def test_quantized_scans_over_fetch_and_rescore_with_full_vectors(monkeypatch, level, order):
+    monkeypatch.setattr(settings, "QUANTIZATION_RESCORE_FACTOR", 4)
+    sql, args = search_sql.vector_query("products", "[0.1]", 10, level=level)
+    assert args == ("[0.1]", 10, 40)
+    assert order in sql and "LIMIT $3" in sql
+    # The outer query ranks the candidates by the exact distance and keeps `limit` of them
+    assert sql.rstrip().endswith("ORDER BY nn.distance, nn.id\n        LIMIT $2")
+    assert search_sql.ann_limit("products", 10, level) == 40
+
+
+def test_unquantized_scans_fetch_exactly_the_limit(monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION_PRODUCTS", "none")
+    sql, args = search_sql.vector_query("products", "[0.1]", 10)
+    assert args == ("[0.1]", 10)
+    assert "ORDER BY e.embedding <=> $1" in sql and "LIMIT $3" not in sql
+    assert search_sql.ann_limit("products", 10) == 10
+
+
+def test_unified_query_ranks_every_type_in_one_statement(monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION_PRODUCTS", "none")
+    monkeypatch.setattr(settings, "VECTOR_QUANTIZATION_SERVICES", "none")
+    sql, args = search_sql.unified_vector_query(["products", "services"], "[0.1]", 10, filters(category="Sofas"))
+    assert args == ("[0.1]", 10, "Sofas")
+    assert sql.count("UNION ALL") == 1
+    assert "'products' AS item_type" in sql and "'services' AS item_type" in sql
+    # Both branches share the filter parameter; the merged list is cut to `limit` rows in total
+    assert sql.count("i.categoryName = $3") == 2
+    assert sql.rstrip().endswith("ORDER BY u.distance, u.id\n        LIMIT $2")
+
+
+def test_projection_selects_only_the_requested_fields():
+    assert search_sql.projection("products") == "i.id"
+    assert search_sql.projection("products", ["name", "brand"]) == 'i.id, i.name AS "name", i.brand AS "brand"'
+    # Services have no brand: NULL keeps UNION ALL branches aligned
+    assert search_sql.projection("services", ["name", "brand"]) == 'i.id, i.name AS "name", NULL AS "brand"'
+    sql, _ = search_sql.vector_query("products", "[0.1]", 10, fields=["name"])
+    assert "variants" not in sql and "attributes" not in sql
+
+
+def test_similar_items_are_ranked_by_the_stored_embedding_without_the_item_itself():
+    sql, args = search_sql.similar_query("products", "products", "p1", 10)
+    assert args == ("p1", 10)
+    assert "(SELECT embedding FROM product_embeddings WHERE product_id = $1)" in sql
+    assert "WHERE i.id <> $1" in sql
+    # Across types the item cannot be among the results
+    assert "<> $1" not in search_sql.similar_query("products", "services", "p1", 10)[0]
+
+
+def test_ann_index_rebuild_swaps_names_before_dropping_the_old_index():
+    pool = FakePool()
+    args = argparse.Namespace(type="hnsw", m=16, ef_construction=64, lists=None)
+
+    async def run():
+        async with pool.acquire() as conn:
+            await rebuild_ann_indexes.rebuild_index(conn, "product_embeddings", args)
+    asyncio.run(run())
+    statements = pool.statements("execute")
+    assert statements[2].startswith("CREATE INDEX CONCURRENTLY product_embeddings_ann_idx_new ON product_embeddings")
+    # The old index is renamed aside, not dropped, until the new one has its name
+    assert statements[3:6] == [
+        "ALTER INDEX IF EXISTS product_embeddings_ann_idx RENAME TO product_embeddings_ann_idx_old",
+        "ALTER INDEX product_embeddings_ann_idx_new RENAME TO product_embeddings_ann_idx",
+        "DROP INDEX CONCURRENTLY IF EXISTS product_embeddings_ann_idx_old",
+    ]
@@ -0,0 +1,82 @@
+import asyncio
+
+from app import suggest
+from app.suggest import SuggestIndex
+from tests.conftest import FakePool
+
+ITEMS = [
+    ("products", "p1", "Oak Dining Table", "Nordhus", "Tables", ["oak", "dining"]),
+    ("products", "p2", "Oak Side Table", "Nordhus", "Tables", ["oak"]),
+    ("products", "p3", "Velvet Sofa", "Casa", "Sofas", ["living room"]),
+    ("services", "s1", "Sofa Cleaning", None, "Cleaning", ["sofa"]),
+]
+
+
+def texts(suggestions) -> list:
+    return [s.text for s in suggestions]
+
+
+def incremental(items) -> SuggestIndex:
+    index = SuggestIndex()
+    for item in items:
+        index.index_item(*item)
+    return index
+
+
+def test_build_matches_incremental_indexing():
+    built, grown = SuggestIndex.build(ITEMS), incremental(ITEMS)
+    assert built._suffixes == sorted(built._suffixes) == grown._suffixes
+    for query in ["o", "oak", "tab", "sofa", "clean", "nord", "sofx"]:
+        assert texts(built.lookup(query, 10)) == texts(grown.lookup(query, 10))
+
+
+def test_prefix_matches_rank_phrase_starts_and_popularity_first():
+    index = SuggestIndex.build(ITEMS)
+    # Phrases starting with the query come first, then popularity, kind and shorter phrases
+    assert texts(index.lookup("ta", 10)) == ["Tables", "Oak Side Table", "Oak Dining Table"]
+    assert texts(index.lookup("sofa", 10)) == ["Sofa Cleaning", "Sofas", "sofa", "Velvet Sofa"]
+    assert index.lookup("Nord", 1)[0].count == 2
+
+
+def test_fuzzy_fallback_for_typos():
+    index = SuggestIndex.build(ITEMS)
+    assert "Velvet Sofa" in texts(index.lookup("velvat sofa", 5))
+
+
+def test_reindexing_and_removing_items_updates_suggestions():
+    index = SuggestIndex.build(ITEMS)
+    index.index_item("products", "p3", "Linen Sofa", "Casa", "Sofas", [])
+    assert "Velvet Sofa" not in texts(index.lookup("vel", 10))
+    assert "Linen Sofa" in texts(index.lookup("lin", 10))
+    index.remove_item("products", "p3")
+    assert texts(index.lookup("lin", 10)) == []
+    assert index._suffixes == sorted(index._suffixes)
+
+
+def test_load_swaps_in_a_new_index_and_keeps_items_ingested_meanwhile(monkeypatch):
+    def handler(sql, args):
+        if "FROM products" in sql:
+            return [{"id": "p1", "name": "Oak Dining Table", "brand": "Nordhus", "categoryname": "Tables", "tags": '["oak"]'}]
+        return [{"id": "s1", "name": "Sofa Cleaning", "categoryname": "Cleaning", "tags": None}]
+
+    build = SuggestIndex.build
+    running = {}
+
+    async def ingest():
+        suggest.index_item("products", "p9", "Walnut Shelf", None, "Shelves", [])
+
+    def slow_build(items):
+        # An item is ingested on the event loop while the new index is being built off it
+        asyncio.run_coroutine_threadsafe(ingest(), running["loop"]).result()
+        return build(items)
+
+    async def run():
+        running["loop"] = asyncio.get_running_loop()
+        await suggest.load(FakePool(handler))
+
+    monkeypatch.setattr(suggest, "suggest_index", SuggestIndex())
+    monkeypatch.setattr(SuggestIndex, "build", staticmethod(slow_build))
+    asyncio.run(run())
+    assert texts(suggest.suggest_index.lookup("oak", 5)) == ["Oak Dining Table", "oak"]
+    assert texts(suggest.suggest_index.lookup("walnut", 5)) == ["Walnut Shelf"]
+    assert suggest._ingested_during_load is None
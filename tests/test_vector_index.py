@@ -0,0 +1,58 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app import vector_index
+from app.vector_index import EMBEDDING_DIMENSIONS, MemoryVectorIndex
+
+
+def unit(*positions) -> np.ndarray:
+    """768-dimensional vector with ones at `positions`"""
+    vector = np.zeros(EMBEDDING_DIMENSIONS, dtype=np.float32)
+    vector[list(positions)] = 1
+    return vector
+
+
+@pytest.fixture(params=["float32", "float16"])
+def index(request, tmp_path):
+    index = MemoryVectorIndex("products", str(tmp_path), request.param)
+    yield index
+    index.close()
+
+
+def test_search_ranks_by_cosine_similarity(index):
+    index.upsert(["a", "b", "c"], np.stack([unit(0), unit(0, 1), unit(2)]))
+    results = index.search(unit(0) * 5, 2)
+    assert [item_id for item_id, _ in results] == ["a", "b"]
+    assert results[0][1] == pytest.approx(1.0, abs=1e-3)
+    assert results[1][1] == pytest.approx(1 / np.sqrt(2), abs=1e-3)
+
+
+def test_updated_rows_are_overwritten_and_removed_rows_masked(index):
+    index.upsert(["a", "b"], np.stack([unit(0), unit(1)]))
+    index.upsert(["a"], np.stack([unit(1)]))
+    assert index.count == 2
+    assert {item_id: round(score, 2) for item_id, score in index.search(unit(1), 2)} == {"a": 1.0, "b": 1.0}
+    index.remove("b")
+    assert [item_id for item_id, _ in index.search(unit(1), 5)] == ["a"]
+
+
+def test_growing_the_matrix_keeps_rows_and_deletes_the_old_file(index):
+    index.upsert(["a"], np.stack([unit(0)]))
+    first_file = index.matrix.filename
+    ids = [f"p{n}" for n in range(2000)]
+    index.upsert(ids, np.stack([unit(n % EMBEDDING_DIMENSIONS) for n in range(2000)]))
+    assert index.matrix.shape[0] >= 2001
+    assert not os.path.exists(first_file)
+    assert index.search(unit(0), 1)[0][0] == "a"
+
+
+def test_chunks_advance_the_refresh_watermark(index):
+    records = [{"id": "a", "embedding": unit(0), "updated_at": datetime(2026, 1, 2)},
+               {"id": "b", "embedding": unit(1), "updated_at": datetime(2026, 1, 3)}]
+    assert vector_index._apply_chunk(index, records) == 2
+    assert index.watermark == datetime(2026, 1, 3)
+    vector_index._apply_chunk(index, [{"id": "a", "embedding": unit(2), "updated_at": datetime(2026, 1, 1)}])
+    assert index.watermark == datetime(2026, 1, 3)